@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mock LLM Server - Offline OpenAI-compatible chat-completions server for load tests
+
+Speaks POST /v1/chat/completions (JSON and SSE streaming, tool calls included), so the
+framework can run unchanged with an llm_config.yaml whose base_url points here.
+Requests with tools are answered by a policy that emits file_write / file_read /
+sub-agent calls / final_output; requests without tools (thinking, compression) get
+plain text.
+
+Each agent is identified by a marker in its task input, e.g.
+    [mock agent=r1 turns=20 fanout=2 max_depth=2 seed=7] Benchmark task
+Sub-agent calls carry the marker on with depth + 1, so the parameters of the whole
+run come from the user input; agents without a marker use the command-line defaults.
+
+Usage:
+    python benchmarks/mock_llm_server.py --port 8090                        # random policy
+    python benchmarks/mock_llm_server.py --policy scripted --script s.yaml  # scripted steps
+"""
+
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+MARKER_RE = re.compile(r"\[mock ([^\]]*)\]")
+# Task section of the agent's own prompt (core/context_builder.py); the call tree in the
+# same prompt also contains the markers of parent and sibling agents
+TASK_RE = re.compile(r"<当前智能体任务>(.*?)</当前智能体任务>", re.S)
+AGENT_NAME_RE = re.compile(r"<当前运行智能体名称>\s*(.*?)\s*</当前运行智能体名称>", re.S)
+
+DEFAULT_PARAMS = {
+    "turns": 10,          # tool-call turns before final_output (history length)
+    "fanout": 0,          # sub-agent calls per agent
+    "max_depth": 0,       # deepest hierarchy level that may still call sub-agents
+    "seed": 0,
+    "write_ratio": 0.5,   # share of file turns that write (the rest read back earlier files)
+    "payload": 2000,      # bytes written per file_write
+    "text": 400,          # bytes of text answers (thinking / compression)
+    "latency_ms": 0       # simulated model latency per request
+}
+
+
+def parse_marker(text: str) -> Optional[Dict]:
+    """Parameters of the first [mock ...] marker in text (None when there is none)"""
+    match = MARKER_RE.search(text or "")
+    if not match:
+        return None
+    params = {}
+    for item in match.group(1).split():
+        key, _, value = item.partition("=")
+        params[key] = value
+    return params
+
+
+def format_marker(params: Dict) -> str:
+    return "[mock " + " ".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+
+def _text_of(content) -> str:
+    """Text of a message content (string or content blocks)"""
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content or ""
+
+
+def _estimate_tokens(data) -> int:
+    return max(1, len(json.dumps(data, ensure_ascii=False)) // 4)
+
+
+def _is_sub_agent(tool: Dict) -> bool:
+    """Agent tools (llm_call_agent) take a task_input parameter"""
+    properties = tool.get("function", {}).get("parameters", {}).get("properties", {})
+    return "task_input" in properties
+
+
+class AgentState:
+    """Progress of one agent (identified by its marker's agent id)"""
+    
+    def __init__(self, agent_id: str, params: Dict):
+        self.agent_id = agent_id
+        self.params = params
+        self.depth = int(params.get("depth", 0))
+        self.turn = 0
+        self.files = []
+        self.children = 0
+        self.rng = random.Random(f"{params.get('seed', 0)}:{agent_id}")
+        self.plan = None  # policy-specific
+    
+    def param(self, key: str, cast=int):
+        return cast(self.params.get(key, DEFAULT_PARAMS[key]))
+
+
+class Policy:
+    """Chooses the tool calls of an agent's next turn"""
+    
+    def next_calls(self, state: AgentState, tools: Dict[str, Dict], parallel: bool) -> List[Tuple[str, Dict]]:
+        raise NotImplementedError
+    
+    def sub_agent_call(self, state: AgentState, tool_name: str, task: str = "Benchmark sub-task") -> Tuple[str, Dict]:
+        """Sub-agent call whose task input carries the marker on (depth + 1)"""
+        state.children += 1
+        params = dict(state.params, agent=f"{state.agent_id}.{state.children}", depth=state.depth + 1)
+        return tool_name, {"task_id": "mock", "task_input": f"{format_marker(params)} {task}"}
+    
+    def final_call(self, state: AgentState) -> Tuple[str, Dict]:
+        return "final_output", {
+            "task_id": "mock",
+            "status": "success",
+            "output": f"Mock agent {state.agent_id} finished after {state.turn} turns ({len(state.files)} files)"
+        }
+    
+    def file_call(self, state: AgentState, write: bool) -> Tuple[str, Dict]:
+        if write or not state.files:
+            path = f"bench/{state.agent_id}/file_{state.turn}.md"
+            state.files.append(path)
+            line = f"turn {state.turn} of {state.agent_id}: lorem ipsum dolor sit amet\n"
+            content = (line * (state.param("payload") // len(line) + 1))[:state.param("payload")]
+            return "file_write", {"path": path, "content": content}
+        return "file_read", {"path": [state.rng.choice(state.files)]}
+
+
+class RandomPolicy(Policy):
+    """Seeded random file reads/writes, fanout sub-agent calls at random turns, then final_output"""
+    
+    def next_calls(self, state: AgentState, tools: Dict[str, Dict], parallel: bool) -> List[Tuple[str, Dict]]:
+        turns = state.param("turns")
+        sub_agents = sorted(name for name, tool in tools.items() if _is_sub_agent(tool))
+        if state.plan is None:
+            fanout = state.param("fanout") if sub_agents and state.depth < state.param("max_depth") else 0
+            fanout = min(fanout, max(turns, 1))
+            state.plan = sorted(state.rng.sample(range(max(turns, 1)), fanout))
+        
+        if state.turn >= turns and "final_output" in tools:
+            return [self.final_call(state)]
+        
+        if state.plan and state.turn >= state.plan[0]:
+            # With parallel tool calls, all remaining sub-agents are started in one turn
+            count = len(state.plan) if parallel else 1
+            del state.plan[:count]
+            return [self.sub_agent_call(state, state.rng.choice(sub_agents)) for _ in range(count)]
+        
+        return [self.file_call(state, state.rng.random() < state.param("write_ratio", float))]
+
+
+class ScriptedPolicy(Policy):
+    """
+    Steps from a YAML script, per hierarchy depth:
+        
+        depths:
+          0:
+            - tool: file_write
+              arguments: {path: notes.md, content: hello}
+            - tool: $sub_agent          # first sub-agent tool of the agent (or an agent name)
+              arguments: {task_input: write section 1}
+        default:
+          - tool: file_read
+            arguments: {path: [notes.md]}
+    
+    final_output is called when an agent's steps are exhausted.
+    """
+    
+    def __init__(self, script: Dict):
+        self.depths = {int(k): v for k, v in (script.get("depths") or {}).items()}
+        self.default = script.get("default") or []
+    
+    def next_calls(self, state: AgentState, tools: Dict[str, Dict], parallel: bool) -> List[Tuple[str, Dict]]:
+        steps = self.depths.get(state.depth, self.default)
+        if state.turn >= len(steps):
+            return [self.final_call(state)]
+        
+        step = steps[state.turn]
+        name = step.get("tool", "final_output")
+        arguments = dict(step.get("arguments") or {})
+        if name == "$sub_agent":
+            sub_agents = sorted(n for n, tool in tools.items() if _is_sub_agent(tool))
+            if not sub_agents:
+                return [self.file_call(state, write=True)]
+            name = sub_agents[0]
+        if name in tools and _is_sub_agent(tools[name]):
+            return [self.sub_agent_call(state, name, arguments.get("task_input", "Scripted sub-task"))]
+        if name == "final_output":
+            return [self.final_call(state)]
+        return [(name, arguments)]
+
+
+class MockLLM:
+    """Request handling and statistics of the mock server"""
+    
+    def __init__(self, policy: Policy, defaults: Dict):
+        self.policy = policy
+        self.defaults = defaults
+        self.agents = {}
+        self.ids = itertools.count(1)
+        self.stats = {"requests": 0, "tool_turns": 0, "text": 0, "stream": 0, "sub_agent_calls": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+    
+    def reset(self):
+        self.agents.clear()
+        for key in self.stats:
+            self.stats[key] = 0
+    
+    def _params(self, messages: List[Dict]) -> Dict:
+        """Parameters of the requesting agent (its marker over the command-line defaults)"""
+        texts = [_text_of(m.get("content")) for m in messages]
+        params = None
+        for text in texts:
+            task = TASK_RE.search(text)
+            if task:
+                params = parse_marker(task.group(1))
+                if params is None:
+                    # No marker: one state per agent name
+                    name = AGENT_NAME_RE.search(text)
+                    params = {"agent": name.group(1)} if name else None
+                break
+        if params is None:
+            params = next((p for p in map(parse_marker, texts) if p), None) or {}
+        return dict(self.defaults, **params)
+    
+    def _agent(self, params: Dict) -> AgentState:
+        agent_id = params.setdefault("agent", "default")
+        state = self.agents.get(agent_id)
+        if state is None:
+            state = self.agents[agent_id] = AgentState(agent_id, params)
+        return state
+    
+    def respond(self, body: Dict) -> Dict:
+        """
+        Answer one chat-completions request
+        
+        Returns:
+            {"content": str or None, "tool_calls": [...], "finish_reason": str, "usage": {...}}
+        """
+        messages = body.get("messages", [])
+        tools = {t.get("function", {}).get("name"): t for t in body.get("tools") or []}
+        self.stats["requests"] += 1
+        
+        params = self._params(messages)
+        if not tools or body.get("tool_choice") == "none":
+            self.stats["text"] += 1
+            line = f"Mock analysis for {params.get('agent', 'default')}: progress is on track, continue with the plan. "
+            size = int(params["text"])
+            content, tool_calls, finish_reason = (line * (size // len(line) + 1))[:size], [], "stop"
+        else:
+            self.stats["tool_turns"] += 1
+            state = self._agent(params)
+            calls = self.policy.next_calls(state, tools, bool(body.get("parallel_tool_calls")))
+            state.turn += 1
+            self.stats["sub_agent_calls"] += sum(1 for name, _ in calls if name in tools and _is_sub_agent(tools[name]))
+            tool_calls = [
+                {"id": f"call_mock_{next(self.ids)}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)}}
+                for name, arguments in calls
+            ]
+            content, finish_reason = None, "tool_calls"
+        
+        usage = {
+            "prompt_tokens": _estimate_tokens(messages) + (_estimate_tokens(body["tools"]) if tools else 0),
+            "completion_tokens": _estimate_tokens([content, tool_calls]),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self.stats["prompt_tokens"] += usage["prompt_tokens"]
+        self.stats["completion_tokens"] += usage["completion_tokens"]
+        return {"content": content, "tool_calls": tool_calls, "finish_reason": finish_reason,
+                "usage": usage, "latency_ms": int(params["latency_ms"])}
+
+
+def _completion(model: str, answer: Dict) -> Dict:
+    message = {"role": "assistant", "content": answer["content"]}
+    if answer["tool_calls"]:
+        message["tool_calls"] = answer["tool_calls"]
+    return {
+        "id": f"chatcmpl-mock-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": answer["finish_reason"]}],
+        "usage": answer["usage"]
+    }
+
+
+def _stream_chunks(model: str, answer: Dict, include_usage: bool):
+    """SSE events of a streamed answer (text in small deltas, tool-call arguments in pieces)"""
+    chunk_id = f"chatcmpl-mock-{time.time_ns()}"
+    created = int(time.time())
+    
+    def chunk(delta: Dict, finish_reason: str = None, usage: Dict = None) -> str:
+        data = {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        if usage:
+            data["usage"] = usage
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    yield chunk({"role": "assistant", "content": ""})
+    content = answer["content"] or ""
+    for i in range(0, len(content), 32):
+        yield chunk({"content": content[i:i + 32]})
+    for index, call in enumerate(answer["tool_calls"]):
+        function = call["function"]
+        yield chunk({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                     "function": {"name": function["name"], "arguments": ""}}]})
+        arguments = function["arguments"]
+        for i in range(0, len(arguments), 64):
+            yield chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[i:i + 64]}}]})
+    yield chunk({}, answer["finish_reason"])
+    if include_usage:
+        yield chunk({}, usage=answer["usage"])
+    yield "data: [DONE]\n\n"
+
+
+def create_app(mock: MockLLM) -> FastAPI:
+    app = FastAPI(title="Mock LLM Server")
+    
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "service": "mock_llm_server"}
+    
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+    
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        answer = mock.respond(body)
+        if answer["latency_ms"]:
+            await asyncio.sleep(answer["latency_ms"] / 1000)
+        if body.get("stream"):
+            mock.stats["stream"] += 1
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(_stream_chunks(model, answer, include_usage), media_type="text/event-stream")
+        return JSONResponse(_completion(model, answer))
+    
+    @app.get("/mock/stats")
+    async def stats():
+        return dict(mock.stats, agents=len(mock.agents))
+    
+    @app.post("/mock/reset")
+    async def reset():
+        mock.reset()
+        return {"success": True}
+    
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline OpenAI-compatible mock LLM server')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind')
+    parser.add_argument('--port', type=int, default=8090, help='Port to bind')
+    parser.add_argument('--policy', type=str, choices=['random', 'scripted'], default='random', help='Tool-call policy')
+    parser.add_argument('--script', type=str, help='YAML script for --policy scripted')
+    for key, value in DEFAULT_PARAMS.items():
+        parser.add_argument(f'--{key.replace("_", "-")}', dest=key, type=type(value), default=value,
+                            help=f'Default {key} for agents without a marker (default: {value})')
+    args = parser.parse_args()
+    
+    if args.policy == 'scripted':
+        if not args.script:
+            parser.error("--policy scripted requires --script")
+        with open(args.script, 'r', encoding='utf-8') as f:
+            policy = ScriptedPolicy(yaml.safe_load(f) or {})
+    else:
+        policy = RandomPolicy()
+    
+    defaults = {key: getattr(args, key) for key in DEFAULT_PARAMS}
+    print(f"🧪 Mock LLM server on http://{args.host}:{args.port}/v1 ({args.policy} policy)")
+    uvicorn.run(create_app(MockLLM(policy, defaults)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
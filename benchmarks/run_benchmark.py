@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark Runner - End-to-end start.py runs against the offline mock LLM server
+
+Starts benchmarks/mock_llm_server.py (and the tool server if it is not running), then
+runs one start.py task per combination of history length, hierarchy depth and fan-out.
+For every run it reports turns per second, per-phase self time per turn (from the
+--trace spans) and memory (peak RSS and growth after the first LLM request).
+
+Usage:
+    python benchmarks/run_benchmark.py                                         # default matrix
+    python benchmarks/run_benchmark.py --history 10,50,200 --depth 0 --fanout 0
+    python benchmarks/run_benchmark.py --depth 0,1,2 --fanout 1,3 --output results.json
+"""
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import subprocess
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.conversation_storage import ConversationStorage
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Phases shown in the per-phase table (span self time per turn)
+PHASES = ("turn", "build_request", "build_context", "llm_queue", "llm_call", "tool",
+          "save_state", "thinking", "compress_history")
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _get_json(url: str, timeout: float = 2) -> Optional[Dict]:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except Exception:
+        return None
+
+
+def _post(url: str):
+    request = urllib.request.Request(url, data=b"{}", method="POST", headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        response.read()
+
+
+def _wait_for(url: str, timeout: float = 30) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if _get_json(url) is not None:
+            return True
+        time.sleep(0.3)
+    return False
+
+
+def start_mock_server(port: int, log_dir: Path) -> subprocess.Popen:
+    """Start the mock LLM server and wait until it answers"""
+    log = open(log_dir / "mock_llm_server.log", "w", encoding="utf-8")
+    process = subprocess.Popen(
+        [sys.executable, str(project_root / "benchmarks" / "mock_llm_server.py"), "--port", str(port)],
+        stdout=log, stderr=subprocess.STDOUT
+    )
+    if not _wait_for(f"http://127.0.0.1:{port}/health"):
+        process.terminate()
+        raise RuntimeError(f"Mock LLM server did not start, see {log_dir / 'mock_llm_server.log'}")
+    return process
+
+
+def ensure_tool_server(log_dir: Path) -> Optional[subprocess.Popen]:
+    """Start the tool server of tool_config.yaml unless it is already running"""
+    with open(project_root / "config" / "run_env_config" / "tool_config.yaml", "r", encoding="utf-8") as f:
+        server_url = (yaml.safe_load(f) or {}).get("tools_server", "http://127.0.0.1:8001").rstrip("/")
+    if _get_json(f"{server_url}/health") is not None:
+        return None
+
+    from urllib.parse import urlparse
+    parsed = urlparse(server_url)
+    log = open(log_dir / "tool_server.log", "w", encoding="utf-8")
+    process = subprocess.Popen(
+        [sys.executable, str(project_root / "tool_server_lite" / "server.py"),
+         "--host", parsed.hostname or "127.0.0.1", "--port", str(parsed.port or 8001)],
+        stdout=log, stderr=subprocess.STDOUT
+    )
+    if not _wait_for(f"{server_url}/health", timeout=60):
+        process.terminate()
+        raise RuntimeError(f"Tool server did not start, see {log_dir / 'tool_server.log'}")
+    return process
+
+
+def write_llm_config(path: Path, port: int):
+    """LLM configuration pointing every model list at the mock server"""
+    config = {
+        "temperature": 0,
+        "max_tokens": 0,
+        "max_context_window": 200000,
+        "base_url": f"http://127.0.0.1:{port}/v1",
+        "api_key": "mock",
+        "models": ["openai/mock-agent"],
+        "figure_models": ["openai/mock-agent"],
+        "compressor_models": ["openai/mock-agent"],
+        "read_figure_models": ["openai/mock-agent"]
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f)
+
+
+def analyze_trace(trace_path: Path) -> Dict:
+    """
+    Turn count and self time (span time minus direct child spans) per phase
+
+    Returns:
+        {"turns": int, "self_ms": {phase: ms}}
+    """
+    with open(trace_path, "r", encoding="utf-8") as f:
+        events = [e for e in json.load(f).get("traceEvents", []) if e.get("ph") == "X"]
+
+    self_us = defaultdict(float)
+    by_track = defaultdict(list)
+    for event in events:
+        by_track[(event["pid"], event["tid"])].append(event)
+    for track_events in by_track.values():
+        track_events.sort(key=lambda e: (e["ts"], -e["dur"]))
+        stack = []  # [(end, phase)]
+        for event in track_events:
+            while stack and stack[-1][0] <= event["ts"]:
+                stack.pop()
+            phase = event["name"].split(" ", 1)[0]  # "tool file_read" -> tool, "agent x" -> agent
+            self_us[phase] += event["dur"]
+            if stack:
+                self_us[stack[-1][1]] -= event["dur"]
+            stack.append((event["ts"] + event["dur"], phase))
+
+    return {
+        "turns": sum(1 for e in events if e["name"] == "turn"),
+        "self_ms": {phase: round(us / 1000, 3) for phase, us in self_us.items()}
+    }
+
+
+def run_case(case: Dict, args, workspace_root: Path, llm_config: Path) -> Dict:
+    """Run one start.py task and collect timing, phase and memory results"""
+    name = f"h{case['history']}_d{case['depth']}_f{case['fanout']}_r{case['repeat']}"
+    workspace = workspace_root / name
+    workspace.mkdir(parents=True, exist_ok=True)
+    trace_path = workspace_root / f"{name}.trace.json"
+    marker = (f"[mock agent={name} turns={case['history']} fanout={case['fanout']} max_depth={case['depth']} "
+              f"seed={args.seed} payload={args.payload} latency_ms={args.latency_ms}]")
+
+    command = [
+        sys.executable, str(project_root / "start.py"),
+        "--task_id", str(workspace),
+        "--agent_name", args.agent_name,
+        "--agent_system", args.agent_system,
+        "--user_input", f"{marker} Benchmark task",
+        "--config-file", str(llm_config),
+        "--trace", str(trace_path),
+        "--auto-mode", "true",
+        "--force-new"
+    ]
+    if args.use_async:
+        command.append("--async")
+
+    mock_url = f"http://127.0.0.1:{args.port}"
+    _post(f"{mock_url}/mock/reset")
+    log = open(workspace_root / f"{name}.log", "w", encoding="utf-8")
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=str(project_root))
+
+    # Sample RSS; the baseline is taken when the first LLM request arrives (after imports and setup)
+    peak_rss = baseline_rss = None
+    monitor = psutil.Process(process.pid) if psutil is not None else None
+    while process.poll() is None:
+        if time.perf_counter() - start > args.timeout:
+            process.kill()
+            break
+        if monitor is not None:
+            try:
+                rss = monitor.memory_info().rss
+            except psutil.Error:
+                rss = None
+            if rss:
+                peak_rss = max(peak_rss or 0, rss)
+                if baseline_rss is None and (_get_json(f"{mock_url}/mock/stats") or {}).get("requests"):
+                    baseline_rss = rss
+        time.sleep(0.1)
+    wall = time.perf_counter() - start
+    returncode = process.wait()
+    log.close()
+
+    result = {
+        "case": name, **case,
+        "status": "ok" if returncode == 0 else f"exit {returncode}",
+        "wall_s": round(wall, 3),
+        "mock": _get_json(f"{mock_url}/mock/stats") or {},
+        "peak_rss_mb": round(peak_rss / 2**20, 1) if peak_rss else None,
+        "rss_growth_mb": round((peak_rss - baseline_rss) / 2**20, 1) if peak_rss and baseline_rss else None
+    }
+    if trace_path.exists():
+        result.update(analyze_trace(trace_path))
+        result["turns_per_s"] = round(result["turns"] / wall, 2) if wall else 0.0
+        # Framework time: everything except model calls, tool execution and the agent span itself
+        excluded = ("llm_call", "llm_queue", "tool", "agent")
+        overhead = sum(ms for phase, ms in result["self_ms"].items() if phase not in excluded)
+        result["overhead_ms_per_turn"] = round(overhead / result["turns"], 3) if result["turns"] else None
+    return result
+
+
+def print_results(results: List[Dict]):
+    print(f"\n{'case':<18} {'status':<7} {'turns':>6} {'wall s':>8} {'turns/s':>8} {'LLM req':>8} "
+          f"{'ovh ms/turn':>11} {'peak MB':>8} {'growth MB':>9}")
+    for r in results:
+        print(f"{r['case']:<18} {r['status']:<7} {r.get('turns', 0):>6} {r['wall_s']:>8.2f} {r.get('turns_per_s', 0):>8.2f} "
+              f"{r['mock'].get('requests', 0):>8} {r.get('overhead_ms_per_turn') or 0:>11.2f} "
+              f"{r['peak_rss_mb'] or 0:>8.1f} {r['rss_growth_mb'] or 0:>9.1f}")
+
+    print(f"\nSelf time per turn (ms):\n{'case':<18} " + " ".join(f"{p[:12]:>12}" for p in PHASES))
+    for r in results:
+        turns = r.get("turns") or 1
+        self_ms = r.get("self_ms", {})
+        print(f"{r['case']:<18} " + " ".join(f"{self_ms.get(p, 0) / turns:>12.2f}" for p in PHASES))
+
+
+def cleanup(workspace_root: Path, results: List[Dict]):
+    """Remove benchmark workspaces and their conversation / hierarchy files"""
+    storage = ConversationStorage()
+    for result in results:
+        task_name = storage._task_name(str(workspace_root / result["case"]))
+        for path in storage.conversations_dir.glob(f"{task_name}_*"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    shutil.rmtree(workspace_root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark start.py end to end against the mock LLM server')
+    parser.add_argument('--history', type=_int_list, default=[10, 50], help='Turns per agent, comma separated')
+    parser.add_argument('--depth', type=_int_list, default=[0, 1], help='Hierarchy depths, comma separated')
+    parser.add_argument('--fanout', type=_int_list, default=[2], help='Sub-agent calls per agent, comma separated')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per combination')
+    parser.add_argument('--seed', type=int, default=0, help='Random policy seed')
+    parser.add_argument('--payload', type=int, default=2000, help='Bytes written per file_write')
+    parser.add_argument('--latency-ms', type=int, default=0, help='Simulated model latency per request')
+    parser.add_argument('--port', type=int, default=8090, help='Mock LLM server port')
+    parser.add_argument('--agent_name', type=str, default='alpha_agent', help='Agent to start')
+    parser.add_argument('--agent_system', type=str, default='Default', help='Agent system name')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Run start.py with --async')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds before a run is killed')
+    parser.add_argument('--output', type=str, help='Write the results as JSON to this file')
+    parser.add_argument('--keep', action='store_true', help='Keep workspaces, logs and traces')
+    args = parser.parse_args()
+
+    if psutil is None:
+        print("⚠️ psutil is not installed, memory is not measured")
+
+    workspace_root = Path(tempfile.mkdtemp(prefix="mla_bench_"))
+    llm_config = workspace_root / "llm_config.yaml"
+    write_llm_config(llm_config, args.port)
+
+    servers = []
+    results = []
+    try:
+        servers.append(start_mock_server(args.port, workspace_root))
+        tool_server = ensure_tool_server(workspace_root)
+        if tool_server is not None:
+            servers.append(tool_server)
+
+        cases = [
+            {"history": h, "depth": d, "fanout": f if d else 0, "repeat": r}
+            for h, d, f, r in itertools.product(args.history, args.depth, args.fanout, range(args.repeat))
+        ]
+        # Without sub-agents the fan-out does not matter: run depth 0 once per history length
+        cases = [dict(t) for t in dict.fromkeys(tuple(c.items()) for c in cases)]
+        for index, case in enumerate(cases, 1):
+            print(f"▶️  [{index}/{len(cases)}] history={case['history']} depth={case['depth']} fanout={case['fanout']}")
+            result = run_case(case, args, workspace_root, llm_config)
+            results.append(result)
+            print(f"   {result['status']}, {result.get('turns', 0)} turns in {result['wall_s']:.2f}s")
+    finally:
+        for process in servers:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    if args.keep:
+        print(f"📂 Workspaces, logs and traces: {workspace_root}")
+    else:
+        cleanup(workspace_root, results)
+    return 0 if results and all(r["status"] == "ok" for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
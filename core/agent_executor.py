@@ -12,12 +12,106 @@ try:
 except ImportError:
     pass
 
+import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
 from services.llm_client import SimpleLLMClient, ChatMessage
 from core.context_builder import ContextBuilder
 from core.tool_executor import ToolExecutor
 from utils.event_emitter import get_event_emitter
+from utils.tracer import get_tracer, traced, usage_args
+from utils.llm_scheduler import get_llm_scheduler, agent_priority
+from utils.usage_ledger import get_usage_ledger, usage_scope, set_usage_agent
+
+
+# 只读工具读取的路径参数（缺省为工作空间根目录）；save_path 是工具写入的文件
+_READ_PATH_KEYS = ("path", "search_path")
+
+
+def _normalize_tool_path(path) -> str:
+    return os.path.normpath(str(path)).replace("\\", "/")
+
+
+def _path_covers(target: str, path: str) -> bool:
+    """target（文件或目录）是否包含 path"""
+    return target == "." or path == target or path.startswith(target.rstrip("/") + "/")
+
+
+# 提前执行只读工具的线程池（进程内所有Agent、子Agent共享，按需创建）
+_early_dispatch_pool = None
+_early_dispatch_pool_lock = threading.Lock()
+
+
+def _get_early_dispatch_pool(max_workers: int) -> ThreadPoolExecutor:
+    """获取共享的提前执行线程池（max_workers 只在首次创建时生效）"""
+    global _early_dispatch_pool
+    with _early_dispatch_pool_lock:
+        if _early_dispatch_pool is None:
+            _early_dispatch_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="early-tool")
+        return _early_dispatch_pool
+
+
+class _EarlyDispatcher:
+    """
+    流式响应中只读工具的提前执行器（作为 LLMClient.chat 的 on_tool_call 回调）
+    
+    重试/模型回退会重放工具调用回调：每次尝试开始时（begin_attempt）重新计算只读前缀，
+    id、名称、参数都相同的调用复用已提交的执行，不重复执行；
+    take() 只交出与最终响应的只读前缀一致的结果，其余尚未开始的执行被取消
+    """
+    
+    def __init__(self, executor, submit):
+        """
+        Args:
+            executor: AgentExecutor（判断工具是否只读/能否提前执行）
+            submit: 提交执行的函数 submit(tool_call) -> Future / asyncio.Task
+        """
+        self.executor = executor
+        self.submit = submit
+        self.submitted = {}  # tool_call.id -> (名称, 参数, Future)
+        self.streamed_calls = []  # 当前尝试中已收到的工具调用
+    
+    def begin_attempt(self):
+        """一次新的（重）试开始：之前尝试收到的调用不再计入只读前缀"""
+        self.streamed_calls = []
+    
+    def __call__(self, tool_call):
+        if tool_call.id and self.executor._can_dispatch_early(tool_call, self.streamed_calls):
+            previous = self.submitted.get(tool_call.id)
+            if previous is None or previous[:2] != (tool_call.name, tool_call.arguments):
+                if previous is not None:
+                    previous[2].cancel()
+                safe_print(f"⚡ 提前执行只读工具: {tool_call.name}")
+                self.submitted[tool_call.id] = (tool_call.name, tool_call.arguments, self.submit(tool_call))
+        self.streamed_calls.append(tool_call)
+    
+    def take(self, tool_calls: List) -> Dict:
+        """
+        取出与最终响应一致的提前执行结果
+        
+        Args:
+            tool_calls: 最终响应中的工具调用
+        
+        Returns:
+            tool_call.id -> Future（只包含最终响应开头可以并发的只读调用）
+        """
+        results = {}
+        prefix = []
+        for tool_call in tool_calls:
+            if not self.executor._is_read_only_tool(tool_call.name) or self.executor._paths_conflict(tool_call, prefix):
+                break
+            prefix.append(tool_call)
+            entry = self.submitted.pop(tool_call.id, None) if tool_call.id else None
+            if entry is not None and entry[:2] == (tool_call.name, tool_call.arguments):
+                results[tool_call.id] = entry[2]
+            elif entry is not None:
+                entry[2].cancel()
+        for _, _, future in self.submitted.values():
+            future.cancel()
+        self.submitted = {}
+        return results
 
 
 class AgentExecutor:
@@ -72,8 +166,30 @@ class AgentExecutor:
         
         # 初始化对话存储
         from utils.conversation_storage import ConversationStorage
+        from utils.runtime_config import get_runtime_option
         self.conversation_storage = ConversationStorage()
         
+        # 系统提示词快照策略：inline / checkpoint / blob / none
+        self.prompt_snapshot_policy = get_runtime_option("prompt_snapshot.policy", "checkpoint")
+        
+        # 并行工具调用：允许LLM一次返回多个工具调用，连续的只读工具并发执行
+        self.parallel_tool_calls = get_runtime_option("tool_execution.parallel_tool_calls", False)
+        self.max_parallel_tools = max(1, int(get_runtime_option("tool_execution.max_parallel_tools", 8)))
+        # 兄弟子Agent并发执行（每个子Agent在独立的层级分支上运行）
+        self.parallel_sub_agents = get_runtime_option("tool_execution.parallel_sub_agents", False)
+        self.max_parallel_sub_agents = max(1, int(get_runtime_option("tool_execution.max_parallel_sub_agents", 4)))
+        
+        # 流式LLM响应：文本增量实时转发；并行模式下只读工具参数完整即提前执行
+        self.stream_responses = get_runtime_option("llm_stream.enabled", False)
+        self.early_tool_dispatch = get_runtime_option("llm_stream.early_tool_dispatch", True)
+        
+        # 上下文布局：cache_friendly 时稳定前缀在前、历史动作在后（提供商提示词缓存）
+        self.prompt_layout = get_runtime_option("prompt_layout.mode", "legacy")
+        
+        # 超长工具结果转存到blob时，为Agent提供分页读取的blob_read工具
+        if get_runtime_option("tool_results.offload", False) and "blob_read" not in self.available_tools:
+            self.available_tools = self.available_tools + ["blob_read"]
+        
         # Agent状态
         self.agent_id = None
         self.action_history = []  # 渲染用（会压缩）
@@ -83,9 +199,39 @@ class AgentExecutor:
         self.first_thinking_done = False
         self.thinking_interval = 10  # 每10轮工具调用触发一次thinking
         self.tool_call_counter = 0
+        self._thinking_agent = None
+        # 上下文缓存版本号（action_history / latest_thinking 每次变化时递增）
+        self.history_version = 0
+        self.thinking_version = 0
+        # 系统提示词快照（checkpoint: 最近一次发送给LLM的提示词；blob: 每轮的 {turn, hash}）
+        self.system_prompt_snapshot = ""
+        self.prompt_snapshots = []
+        # 提供商提示词缓存统计（usage 中的 prompt_tokens / cached_tokens 累计）
+        self.prompt_cache_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+        # 调用树层级（限流调度优先级：顶层Agent优先）
+        self._agent_level = None
     
     def run(self, task_id: str, user_input: str) -> Dict:
-        """执行Agent任务"""
+        """执行Agent任务（记录Agent级span，子Agent的span嵌套在调用它的工具span中）"""
+        with get_tracer().span(f"agent {self.agent_name}", "agent", task_input=user_input[:200]) as span, \
+                usage_scope(task_id, self.agent_name):
+            result = self._run(task_id, user_input)
+            span["agent_id"] = self.agent_id
+            span["status"] = result.get("status")
+            return result
+    
+    def _traced_turns(self, start_turn: int):
+        """
+        逐轮迭代，每一轮记录一个turn span
+        
+        循环中 continue/return 时生成器被推进/关闭，span随之结束
+        """
+        for turn in range(start_turn, self.max_turns):
+            with get_tracer().span("turn", "agent", agent=self.agent_name, turn=turn + 1):
+                yield turn
+    
+    def _run(self, task_id: str, user_input: str) -> Dict:
+        """执行Agent任务（主循环）"""
         safe_print(f"\n{'='*80}")
         safe_print(f"🤖 启动Agent: {self.agent_name}")
         safe_print(f"📝 任务: {user_input[:100]}...")
@@ -96,96 +242,76 @@ class AgentExecutor:
         
         # Agent入栈
         self.agent_id = self.hierarchy_manager.push_agent(self.agent_name, user_input)
+        self._agent_level = self.hierarchy_manager.get_agent_level(self.agent_id)
+        set_usage_agent(self.agent_id)
         
         # 尝试加载已有的对话历史
-        loaded_data = self.conversation_storage.load_actions(task_id, self.agent_id)
-        start_turn = 0
-        if loaded_data:
-            self.action_history = loaded_data.get("action_history", [])
-            self.action_history_fact = loaded_data.get("action_history_fact", [])
-            self.pending_tools = loaded_data.get("pending_tools", [])
-            self.latest_thinking = loaded_data.get("latest_thinking", "")
-            self.first_thinking_done = loaded_data.get("first_thinking_done", False)
-            self.tool_call_counter = loaded_data.get("tool_call_counter", 0)
-            start_turn = loaded_data.get("current_turn", 0) + 1
-            safe_print(f"📂 已加载对话历史，从第 {start_turn + 1} 轮继续")
-            safe_print(f"   渲染历史: {len(self.action_history)}条, 完整轨迹: {len(self.action_history_fact)}条")
-            
-            # 检查是否已经完成（有final_output）
-            for action in self.action_history_fact:
-                if action.get("tool_name") == "final_output":
-                    final_result = action.get("result", {})
-                    safe_print(f"\n✅ 任务已完成，直接返回之前的final_output结果")
-                    safe_print(f"   状态: {final_result.get('status')}")
-                    return final_result
-            
-            # 恢复pending工具（如果有）
-            if self.pending_tools:
-                safe_print(f"🔄 发现{len(self.pending_tools)}个pending工具，恢复执行...")
-                self._recover_pending_tools(task_id)
+        start_turn, final_result = self._load_saved_state(task_id)
+        if final_result is not None:
+            return final_result
+        
+        # 恢复pending工具（如果有）
+        if self.pending_tools:
+            safe_print(f"🔄 发现{len(self.pending_tools)}个pending工具，恢复执行...")
+            self._recover_pending_tools(task_id)
         
         # 首次thinking（初始规划）
         if start_turn == 0 and not self.first_thinking_done:
             safe_print(f"[{self.agent_name}] 开始行动前进行初始规划...")
             thinking_result = self._trigger_thinking(task_id, user_input, is_first=True)
-            if thinking_result:
-                self.latest_thinking = thinking_result
-                self.first_thinking_done = True
-                self.hierarchy_manager.update_thinking(self.agent_id, thinking_result)
-                self._save_state(task_id, user_input, 0)
-                safe_print(f"[{self.agent_name}] 初始规划完成")
-                
-                # 发送 thinking 事件（完整内容）
-                emitter = get_event_emitter()
-                if emitter.enabled:
-                    emitter.token(f"[{self.agent_name}] 初始规划: {thinking_result}")
+            self._apply_first_thinking(thinking_result, task_id, user_input)
         
         # 强制工具调用计数器
         max_tool_try = 0
         
         # 执行循环
-        for turn in range(start_turn, self.max_turns):
+        for turn in self._traced_turns(start_turn):
             safe_print(f"\n--- 第 {turn + 1}/{self.max_turns} 轮执行 ---")
             
             try:
+                # 超过任务的token/费用预算时停止
+                budget_error = get_usage_ledger().check_budget(task_id)
+                if budget_error:
+                    return self._fail_budget_exceeded(budget_error)
+                
                 # 每轮开始前保存状态
                 self._save_state(task_id, user_input, turn)
                 
                 # 检查并压缩历史动作（如果超过限制）
                 self._compress_action_history_if_needed()
                 
-                # 构建完整的系统提示词（包含通用prompts + 动态上下文）
-                full_system_prompt = self.context_builder.build_context(
-                    task_id,  # 添加task_id参数
-                    self.agent_id,
-                    self.agent_name,
-                    user_input,
-                    action_history=self.action_history  # 传入当前的动作历史
-                )
-                
-                # 调用LLM（history永远只有一条）
-                history = [ChatMessage(role="user", content="请输出下一个动作")]
+                # 构建完整的提示词（包含通用prompts + 动态上下文）
+                system_prompt, history, full_prompt = self._build_llm_request(task_id, user_input)
+                self.snapshot_prompt(task_id, full_prompt, turn)
                 
                 safe_print(f"🤖 调用LLM: {self.model_type}")
-                safe_print(f"   📝 System Prompt长度: {len(full_system_prompt)} 字符")
+                safe_print(f"   📝 System Prompt长度: {len(full_prompt)} 字符")
                 safe_print(f"   🔧 可用工具: {len(self.available_tools)} 个")
                 
-                llm_response = self.llm_client.chat(
-                    history=history,
-                    model=self.model_type,
-                    system_prompt=full_system_prompt,
-                    tool_list=self.available_tools,
-                    tool_choice="required"  # 强制工具调用
-                )
+                # 流式模式下提前执行只读工具（None表示不提前执行）
+                early_dispatcher = self._make_early_dispatcher(task_id)
+                with get_tracer().span("llm_call", "llm", model=self.model_type) as span:
+                    llm_response = self.llm_client.chat(
+                        history=history,
+                        model=self.model_type,
+                        system_prompt=system_prompt,
+                        tool_list=self.available_tools,
+                        tool_choice="required",  # 强制工具调用
+                        parallel_tool_calls=self.parallel_tool_calls,
+                        stream=self.stream_responses,
+                        on_tool_call=early_dispatcher,
+                        prompt_cache=self.prompt_layout == "cache_friendly",
+                        priority=self._llm_priority(),
+                        purpose="agent_turn"
+                    )
+                    span.update(usage_args(llm_response.usage))
+                    self._record_prompt_cache_usage(llm_response.usage)
+                    span["tool_calls"] = len(llm_response.tool_calls)
+                # 只采用与最终响应一致的提前执行结果（tool_call.id -> Future）
+                early_results = early_dispatcher.take(llm_response.tool_calls) if early_dispatcher else {}
                 
                 if llm_response.status != "success":
-                    error_result = {
-                        "status": "error",
-                        "output": f"LLM调用失败",
-                        "error_information": llm_response.error_information
-                    }
-                    self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
-                    return error_result
+                    return self._fail_llm_call(llm_response)
                 
                 safe_print(f"📥 LLM输出: {llm_response.output[:100]}...")
                 safe_print(f"🔧 工具调用数量: {len(llm_response.tool_calls)}")
@@ -195,145 +321,268 @@ class AgentExecutor:
                     # 强制工具调用机制
                     if max_tool_try < 5:
                         max_tool_try += 1
-                        safe_print(f"⚠️ LLM未调用工具，第{max_tool_try}/5次提醒")
-                        # 下一轮会在XML上下文中看到之前的失败记录
-                        # 可以选择在action_history中添加一个标记
-                        self.action_history.append({
-                            "tool_name": "_no_tool_call",
-                            "arguments": {},
-                            "result": {
-                                "status": "error",
-                                "output": f"第{max_tool_try}次：LLM未调用工具，请在下一轮中必须调用工具"
-                            }
-                        })
-                        self._save_state(task_id, user_input, turn)
+                        self._record_no_tool_call(max_tool_try, task_id, user_input, turn)
                         continue
                     else:
                         # 5次后仍不调用，触发thinking并报错
                         safe_print("❌ 5次提醒后仍未调用工具，触发thinking分析")
                         thinking_result = self._trigger_thinking(task_id, user_input, is_first=False)
-                        
-                        # 发送 thinking 事件（完整内容）
-                        emitter = get_event_emitter()
-                        if emitter.enabled:
-                            emitter.warn(f"[{self.agent_name}] 强制thinking: {thinking_result if thinking_result else '分析失败'}")
-                        
-                        error_result = {
-                            "status": "error",
-                            "output": thinking_result if thinking_result else "多次未调用工具",
-                            "error_information": "Agent拒绝调用工具"
-                        }
-                        self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
-                        return error_result
+                        return self._fail_no_tool_call(thinking_result)
                 
                 # 重置计数器（成功调用了工具）
                 max_tool_try = 0
                 
-                # 执行所有工具调用
-                for tool_call in llm_response.tool_calls:
-                    safe_print(f"\n🔧 执行工具: {tool_call.name}")
-                    safe_print(f"📋 参数: {tool_call.arguments}")
-                    
-                    # 发送工具调用事件（JSONL模式）
-                    emitter = get_event_emitter()
-                    if emitter.enabled:
-                        import json
-                        params_str = json.dumps(tool_call.arguments, ensure_ascii=False, indent=2)
-                        emitter.token(f"调用工具: {tool_call.name}\n参数: {params_str}")
-                    
-                    # ✅ 在保存 pending 之前，为 level != 0 的工具添加 uuid
-                    arguments_with_uuid = self._add_uuid_if_needed(tool_call.name, tool_call.arguments)
-                    
-                    # ✅ 先标记为pending（保存带 uuid 的参数）
-                    pending_tool = {
-                        "id": tool_call.id,
-                        "name": tool_call.name,
-                        "arguments": arguments_with_uuid,
-                        "status": "pending"
-                    }
-                    self.pending_tools.append(pending_tool)
+                # 执行所有工具调用（并行模式下，连续的只读工具合为一组并发执行）
+                for tool_group in self._group_tool_calls(llm_response.tool_calls):
+                    prepared_calls = [(tool_call, self._prepare_tool_call(tool_call)) for tool_call in tool_group]
                     self._save_state(task_id, user_input, turn)  # 保存pending状态
                     
-                    # 执行工具（使用带 uuid 的参数）
-                    tool_result = self.tool_executor.execute(
-                        tool_call.name,
-                        arguments_with_uuid,
-                        task_id
-                    )
-                    
-                    # ✅ 执行后从pending移除
-                    self.pending_tools = [t for t in self.pending_tools if t["id"] != tool_call.id]
-                    
-                    safe_print(f"✅ 结果: {tool_result.get('status', 'unknown')}")
-                    
-                    # 发送工具结果事件（JSONL模式）
-                    emitter = get_event_emitter()
-                    if emitter.enabled:
-                        status = tool_result.get('status', 'unknown')
-                        output_preview = tool_result.get('output', '')[:100]
-                        emitter.token(f"工具 {tool_call.name} 完成: {status} - {output_preview}...")
-                    
-                    # 记录动作到历史（使用带 uuid 的参数）
-                    action_record = {
-                        "tool_name": tool_call.name,
-                        "arguments": arguments_with_uuid,
-                        "result": tool_result
-                    }
+                    # 执行工具（使用带 uuid 的参数，结果按原始调用顺序返回）
+                    tool_results = self._execute_tool_group(prepared_calls, task_id, early_results)
                     
-                    # 添加到完整轨迹（永不压缩）
-                    self.action_history_fact.append(action_record)
-                    
-                    # 添加到渲染历史（会被压缩）
-                    self.action_history.append(action_record)
-                    
-                    self.hierarchy_manager.add_action(self.agent_id, action_record)
-                    
-                    # 工具执行后保存状态
-                    self._save_state(task_id, user_input, turn)
-                    
-                    # 增加工具调用计数
-                    self.tool_call_counter += 1
-                    
-                    # 如果是final_output，返回结果
-                    if tool_call.name == "final_output":
-                        safe_print(f"\n{'='*80}")
-                        safe_print(f"✅ Agent完成: {self.agent_name}")
-                        safe_print(f"📊 状态: {tool_result.get('status', 'unknown')}")
-                        safe_print(f"{'='*80}\n")
-                        
-                        self.hierarchy_manager.pop_agent(self.agent_id, tool_result.get("output", ""))
-                        return tool_result
+                    for (tool_call, arguments_with_uuid), tool_result in zip(prepared_calls, tool_results):
+                        # 记录结果；如果是final_output，返回结果
+                        if self._record_tool_result(tool_call, arguments_with_uuid, tool_result, task_id, user_input, turn):
+                            return tool_result
                 
                 # 检查是否该触发thinking（每N轮工具调用）
                 if self.tool_call_counter % self.thinking_interval == 0:
                     safe_print(f"[{self.agent_name}] 第{self.tool_call_counter}轮工具调用，触发thinking分析")
                     thinking_result = self._trigger_thinking(task_id, user_input, is_first=False)
-                    if thinking_result:
-                        self.latest_thinking = thinking_result
-                        self.hierarchy_manager.update_thinking(self.agent_id, thinking_result)
-                        self._save_state(task_id, user_input, turn)
-                        
-                        # 发送 thinking 事件（完整内容）
-                        emitter = get_event_emitter()
-                        if emitter.enabled:
-                            emitter.token(f"[{self.agent_name}] 进度分析: {thinking_result}")
-                        safe_print(f"[{self.agent_name}] Thinking分析已更新")
-                        self.action_history=[]
+                    self._apply_progress_thinking(thinking_result, task_id, user_input, turn)
             
             except Exception as e:
-                safe_print(f"❌ 执行出错: {e}")
-                import traceback
-                traceback.print_exc()
-                safe_print(f"错误信息: {traceback.format_exc()}")
-                
-                error_result = {
-                    "status": "error",
-                    "output": f"执行过程中出错\n\n目前进度:\n{self.latest_thinking}" if self.latest_thinking else "执行过程中出错"
-                }
-                self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
-                return error_result
+                return self._fail_with_exception(e)
         
         # 超过最大轮次
+        return self._fail_max_turns()
+    
+    def _load_saved_state(self, task_id: str):
+        """
+        加载已有的对话历史
+        
+        Returns:
+            (起始轮次, 已完成时之前的final_output结果或None)
+        """
+        loaded_data = self.conversation_storage.load_actions(task_id, self.agent_id)
+        if not loaded_data:
+            return 0, None
+        
+        self.action_history = loaded_data.get("action_history", [])
+        self.action_history_fact = loaded_data.get("action_history_fact", [])
+        self.pending_tools = loaded_data.get("pending_tools", [])
+        self.latest_thinking = loaded_data.get("latest_thinking", "")
+        self.first_thinking_done = loaded_data.get("first_thinking_done", False)
+        self.tool_call_counter = loaded_data.get("tool_call_counter", 0)
+        self.system_prompt_snapshot = loaded_data.get("system_prompt", "")
+        self.prompt_snapshots = loaded_data.get("prompt_snapshots", [])
+        self.history_version += 1
+        self.thinking_version += 1
+        start_turn = loaded_data.get("current_turn", 0) + 1
+        safe_print(f"📂 已加载对话历史，从第 {start_turn + 1} 轮继续")
+        safe_print(f"   渲染历史: {len(self.action_history)}条, 完整轨迹: {len(self.action_history_fact)}条")
+        
+        # 检查是否已经完成（有final_output）
+        for action in self.action_history_fact:
+            if action.get("tool_name") == "final_output":
+                final_result = action.get("result", {})
+                safe_print(f"\n✅ 任务已完成，直接返回之前的final_output结果")
+                safe_print(f"   状态: {final_result.get('status')}")
+                return start_turn, final_result
+        
+        return start_turn, None
+    
+    def _apply_first_thinking(self, thinking_result: str, task_id: str, user_input: str):
+        """应用首次thinking（初始规划）结果"""
+        if not thinking_result:
+            return
+        self.latest_thinking = thinking_result
+        self.thinking_version += 1
+        self.first_thinking_done = True
+        self.hierarchy_manager.update_thinking(self.agent_id, thinking_result)
+        self._save_state(task_id, user_input, 0)
+        safe_print(f"[{self.agent_name}] 初始规划完成")
+        
+        # 发送 thinking 事件（完整内容）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            emitter.token(f"[{self.agent_name}] 初始规划: {thinking_result}")
+    
+    def _apply_progress_thinking(self, thinking_result: str, task_id: str, user_input: str, turn: int):
+        """应用周期性thinking（进度分析）结果，并清空渲染历史"""
+        if not thinking_result:
+            return
+        self.latest_thinking = thinking_result
+        self.thinking_version += 1
+        self.hierarchy_manager.update_thinking(self.agent_id, thinking_result)
+        self._save_state(task_id, user_input, turn)
+        
+        # 发送 thinking 事件（完整内容）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            emitter.token(f"[{self.agent_name}] 进度分析: {thinking_result}")
+        safe_print(f"[{self.agent_name}] Thinking分析已更新")
+        self.action_history=[]
+        self.history_version += 1
+    
+    def _record_no_tool_call(self, max_tool_try: int, task_id: str, user_input: str, turn: int):
+        """记录LLM未调用工具（下一轮会在XML上下文中看到之前的失败记录）"""
+        safe_print(f"⚠️ LLM未调用工具，第{max_tool_try}/5次提醒")
+        self.action_history.append({
+            "tool_name": "_no_tool_call",
+            "arguments": {},
+            "result": {
+                "status": "error",
+                "output": f"第{max_tool_try}次：LLM未调用工具，请在下一轮中必须调用工具"
+            }
+        })
+        self.history_version += 1
+        self._save_state(task_id, user_input, turn)
+    
+    def _prepare_tool_call(self, tool_call) -> Dict:
+        """
+        执行工具前的准备：打印/发送事件、添加 uuid、标记为pending
+        
+        Returns:
+            带 uuid 的参数
+        """
+        safe_print(f"\n🔧 执行工具: {tool_call.name}")
+        safe_print(f"📋 参数: {tool_call.arguments}")
+        
+        # 发送工具调用事件（JSONL模式）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            params_str = json.dumps(tool_call.arguments, ensure_ascii=False, indent=2)
+            emitter.token(f"调用工具: {tool_call.name}\n参数: {params_str}")
+        
+        # ✅ 在保存 pending 之前，为 level != 0 的工具添加 uuid
+        arguments_with_uuid = self._add_uuid_if_needed(tool_call.name, tool_call.arguments)
+        
+        # ✅ 先标记为pending（保存带 uuid 的参数）
+        pending_tool = {
+            "id": tool_call.id,
+            "name": tool_call.name,
+            "arguments": arguments_with_uuid,
+            "status": "pending"
+        }
+        self.pending_tools.append(pending_tool)
+        return arguments_with_uuid
+    
+    def _record_tool_result(
+        self,
+        tool_call,
+        arguments_with_uuid: Dict,
+        tool_result: Dict,
+        task_id: str,
+        user_input: str,
+        turn: int
+    ) -> bool:
+        """
+        记录工具执行结果并保存状态
+        
+        Returns:
+            是否为final_output（Agent已完成并出栈）
+        """
+        # ✅ 执行后从pending移除
+        self.pending_tools = [t for t in self.pending_tools if t["id"] != tool_call.id]
+        
+        safe_print(f"✅ 结果: {tool_result.get('status', 'unknown')}")
+        
+        # 发送工具结果事件（JSONL模式）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            status = tool_result.get('status', 'unknown')
+            output_preview = tool_result.get('output', '')[:100]
+            emitter.token(f"工具 {tool_call.name} 完成: {status} - {output_preview}...")
+        
+        # 记录动作到历史（使用带 uuid 的参数）
+        action_record = {
+            "tool_name": tool_call.name,
+            "arguments": arguments_with_uuid,
+            "result": tool_result
+        }
+        
+        # 添加到完整轨迹（永不压缩）
+        self.action_history_fact.append(action_record)
+        
+        # 添加到渲染历史（会被压缩）
+        self.action_history.append(action_record)
+        self.history_version += 1
+        
+        self.hierarchy_manager.add_action(self.agent_id, action_record)
+        
+        # 工具执行后保存状态
+        self._save_state(task_id, user_input, turn)
+        
+        # 增加工具调用计数
+        self.tool_call_counter += 1
+        
+        if tool_call.name != "final_output":
+            return False
+        
+        safe_print(f"\n{'='*80}")
+        safe_print(f"✅ Agent完成: {self.agent_name}")
+        safe_print(f"📊 状态: {tool_result.get('status', 'unknown')}")
+        context_section = "prompt_parts" if self.prompt_layout == "cache_friendly" else "full_context"
+        cache_stats = self.context_builder.get_cache_stats().get(context_section)
+        if cache_stats:
+            safe_print(f"🗂️ 上下文缓存命中率: {cache_stats['hit_rate']*100:.1f}% ({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']})")
+        prompt_tokens = self.prompt_cache_stats["prompt_tokens"]
+        if prompt_tokens:
+            cached_tokens = self.prompt_cache_stats["cached_tokens"]
+            safe_print(f"💾 提示词缓存命中: {cached_tokens/prompt_tokens*100:.1f}% ({cached_tokens}/{prompt_tokens} tokens)")
+        usage_totals = get_usage_ledger().totals(task_id)
+        if usage_totals["calls"]:
+            safe_print(f"🧾 任务累计用量: {usage_totals['total_tokens']} tokens, ${usage_totals['cost']:.4f} ({usage_totals['calls']} 次LLM调用)")
+        queue_metrics = get_llm_scheduler().get_metrics().get(self.model_type)
+        if queue_metrics:
+            safe_print(f"🚦 LLM限流排队: 平均等待 {queue_metrics['avg_wait_s']:.2f}s, 最大队列深度 {queue_metrics['max_queue_depth']}")
+        safe_print(f"{'='*80}\n")
+        
+        self.hierarchy_manager.pop_agent(self.agent_id, tool_result.get("output", ""))
+        return True
+    
+    def _fail_llm_call(self, llm_response) -> Dict:
+        """LLM调用失败：出栈并返回错误结果"""
+        error_result = {
+            "status": "error",
+            "output": f"LLM调用失败",
+            "error_information": llm_response.error_information
+        }
+        self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
+        return error_result
+    
+    def _fail_no_tool_call(self, thinking_result: str) -> Dict:
+        """多次提醒后仍未调用工具：出栈并返回错误结果"""
+        # 发送 thinking 事件（完整内容）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            emitter.warn(f"[{self.agent_name}] 强制thinking: {thinking_result if thinking_result else '分析失败'}")
+        
+        error_result = {
+            "status": "error",
+            "output": thinking_result if thinking_result else "多次未调用工具",
+            "error_information": "Agent拒绝调用工具"
+        }
+        self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
+        return error_result
+    
+    def _fail_with_exception(self, e: Exception) -> Dict:
+        """执行出错：出栈并返回错误结果（附带目前进度）"""
+        safe_print(f"❌ 执行出错: {e}")
+        import traceback
+        traceback.print_exc()
+        safe_print(f"错误信息: {traceback.format_exc()}")
+        
+        error_result = {
+            "status": "error",
+            "output": f"执行过程中出错\n\n目前进度:\n{self.latest_thinking}" if self.latest_thinking else "执行过程中出错"
+        }
+        self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
+        return error_result
+    
+    def _fail_max_turns(self) -> Dict:
+        """超过最大轮次：出栈并返回错误结果"""
         safe_print(f"\n⚠️ 达到最大轮次限制: {self.max_turns}")
         timeout_result = {
             "status": "error",
@@ -343,6 +592,163 @@ class AgentExecutor:
         self.hierarchy_manager.pop_agent(self.agent_id, str(timeout_result))
         return timeout_result
     
+    def _fail_budget_exceeded(self, budget_error: str) -> Dict:
+        """超过任务预算（runtime_config.yaml usage_ledger.budget）：出栈并返回错误结果"""
+        safe_print(f"\n⚠️ {budget_error}")
+        budget_result = {
+            "status": "error",
+            "output": f"任务用量超过预算\n\n目前进度:\n{self.latest_thinking}" if self.latest_thinking else "任务用量超过预算",
+            "error_information": budget_error
+        }
+        self.hierarchy_manager.pop_agent(self.agent_id, str(budget_result))
+        return budget_result
+    
+    def _is_read_only_tool(self, tool_name: str) -> bool:
+        """判断工具是否为只读工具（level_0_tools.yaml 中标记 read_only: true）"""
+        return bool(self.config_loader.all_tools.get(tool_name, {}).get("read_only", False))
+    
+    def _is_sub_agent_tool(self, tool_name: str) -> bool:
+        """判断工具是否为子Agent调用（llm_call_agent）"""
+        return self.config_loader.all_tools.get(tool_name, {}).get("type") == "llm_call_agent"
+    
+    def _concurrent_kind(self, tool_name: str) -> str:
+        """获取工具的并发类别：read_only / sub_agent / None（必须单独执行）"""
+        if self._is_read_only_tool(tool_name):
+            return "read_only"
+        if self.parallel_sub_agents and self._is_sub_agent_tool(tool_name):
+            return "sub_agent"
+        return None
+    
+    def _tool_paths(self, tool_call):
+        """
+        工具调用读取和写入的路径（归一化）
+        
+        Returns:
+            (读取的路径列表, 写入的路径列表)；工具定义中有路径参数但调用未给出时按工作空间根目录计
+        """
+        properties = self.config_loader.all_tools.get(tool_call.name, {}).get("parameters", {}).get("properties", {})
+        arguments = tool_call.arguments or {}
+        reads = []
+        for key in _READ_PATH_KEYS:
+            if key in properties:
+                value = arguments.get(key) or "."
+                reads.extend(value if isinstance(value, list) else [value])
+        writes = [arguments["save_path"]] if arguments.get("save_path") else []
+        return [_normalize_tool_path(p) for p in reads], [_normalize_tool_path(p) for p in writes]
+    
+    def _paths_conflict(self, tool_call, group: List) -> bool:
+        """
+        工具调用与组内的调用是否存在读写冲突（只读工具中的搜索/爬取类工具会写入 save_path）：
+        一方写入的文件与另一方读取或写入的路径重叠时不能并发执行
+        """
+        reads, writes = self._tool_paths(tool_call)
+        for other in group:
+            other_reads, other_writes = self._tool_paths(other)
+            if any(_path_covers(target, path) for path in writes for target in other_reads + other_writes):
+                return True
+            if any(_path_covers(target, path) for path in other_writes for target in reads + writes):
+                return True
+        return False
+    
+    def _group_tool_calls(self, tool_calls: List) -> List[List]:
+        """
+        将工具调用分组：连续的只读工具合为一组，连续的兄弟子Agent调用
+        （开启 parallel_sub_agents 时）合为一组，其余工具单独成组；
+        与组内调用存在 save_path 读写冲突的只读工具开始新的一组
+        
+        未开启并行模式时每个工具调用单独成组（与顺序执行完全一致）
+        
+        Args:
+            tool_calls: LLM返回的工具调用列表
+            
+        Returns:
+            工具调用分组列表（保持原始顺序）
+        """
+        if not self.parallel_tool_calls:
+            return [[tool_call] for tool_call in tool_calls]
+        
+        groups = []
+        for tool_call in tool_calls:
+            kind = self._concurrent_kind(tool_call.name)
+            if kind and groups and self._concurrent_kind(groups[-1][-1].name) == kind \
+                    and not (kind == "read_only" and self._paths_conflict(tool_call, groups[-1])):
+                groups[-1].append(tool_call)
+            else:
+                groups.append([tool_call])
+        return groups
+    
+    def _can_dispatch_early(self, tool_call, previous_calls: List) -> bool:
+        """
+        判断流式响应中的工具调用能否在模型生成完成前提前执行
+        
+        只有开启并行模式、本轮此前的调用全部为只读工具、且与它们没有 save_path 读写冲突时才提前执行，
+        与 _group_tool_calls 的第一个并发分组一致；只读工具可安全重放，因此不需要先保存pending状态
+        """
+        if not (self.stream_responses and self.early_tool_dispatch and self.parallel_tool_calls):
+            return False
+        if not all(self._is_read_only_tool(call.name) for call in list(previous_calls) + [tool_call]):
+            return False
+        return not self._paths_conflict(tool_call, previous_calls)
+    
+    def _make_early_dispatcher(self, task_id: str):
+        """
+        创建流式工具调用回调：参数完整的只读工具立即提交到共享线程池执行
+        
+        Args:
+            task_id: 任务ID
+        
+        Returns:
+            _EarlyDispatcher，未开启提前执行时为None
+        """
+        if not (self.stream_responses and self.early_tool_dispatch and self.parallel_tool_calls):
+            return None
+        
+        pool = _get_early_dispatch_pool(self.max_parallel_tools)
+        
+        def submit(tool_call):
+            return pool.submit(self.tool_executor.execute, tool_call.name, tool_call.arguments, task_id)
+        
+        return _EarlyDispatcher(self, submit)
+    
+    def _execute_tool_group(self, prepared_calls: List, task_id: str, early_results: Dict = None) -> List[Dict]:
+        """
+        执行一组工具调用，多个调用时使用线程池并发执行（子Agent组在独立分支上并发执行）
+        
+        Args:
+            prepared_calls: (tool_call, 带 uuid 的参数) 列表
+            task_id: 任务ID
+            early_results: 流式模式下已提前执行的工具（tool_call.id -> Future）
+            
+        Returns:
+            工具结果列表（与 prepared_calls 顺序一致）
+        """
+        if early_results and any(tool_call.id in early_results for tool_call, _ in prepared_calls):
+            remaining = [call for call in prepared_calls if call[0].id not in early_results]
+            remaining_results = iter(self._execute_tool_group(remaining, task_id) if remaining else [])
+            return [
+                early_results[tool_call.id].result() if tool_call.id in early_results else next(remaining_results)
+                for tool_call, _ in prepared_calls
+            ]
+        
+        if len(prepared_calls) == 1:
+            tool_call, arguments = prepared_calls[0]
+            return [self.tool_executor.execute(tool_call.name, arguments, task_id)]
+        
+        if self._is_sub_agent_tool(prepared_calls[0][0].name):
+            return self.tool_executor.execute_fan_out(
+                [(tool_call.name, arguments) for tool_call, arguments in prepared_calls],
+                task_id,
+                max_workers=self.max_parallel_sub_agents
+            )
+        
+        safe_print(f"⚡ 并发执行 {len(prepared_calls)} 个只读工具")
+        max_workers = min(len(prepared_calls), self.max_parallel_tools)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(
+                lambda call: self.tool_executor.execute(call[0].name, call[1], task_id),
+                prepared_calls
+            ))
+    
     def _add_uuid_if_needed(self, tool_name: str, arguments: Dict) -> Dict:
         """
         为 level != 0 的工具添加 uuid 后缀到 task_input
@@ -378,6 +784,7 @@ class AgentExecutor:
             safe_print(f"⚠️ 添加 uuid 时出错: {e}")
             return arguments
     
+    @traced("thinking")
     def _trigger_thinking(self, task_id: str, task_input: str, is_first: bool = False) -> str:
         """
         触发Thinking Agent进行分析
@@ -393,16 +800,13 @@ class AgentExecutor:
         try:
             from services.thinking_agent import ThinkingAgent
             
-            thinking_agent = ThinkingAgent()
+            # 复用Thinking Agent（借用本Agent的LLM客户端）
+            if self._thinking_agent is None:
+                self._thinking_agent = ThinkingAgent(self.llm_client)
+            thinking_agent = self._thinking_agent
             
             # 构建完整的系统提示词
-            full_system_prompt = self.context_builder.build_context(
-                task_id,
-                self.agent_id,
-                self.agent_name,
-                task_input,
-                action_history=self.action_history
-            )
+            full_system_prompt = self._build_context(task_id, task_input)
             
             if is_first:
                 # 首次thinking - 初始规划
@@ -431,6 +835,7 @@ class AgentExecutor:
             traceback.print_exc()
             return ""
     
+    @traced("compress_history")
     def _compress_action_history_if_needed(self):
         """检查并压缩历史动作（如果超过上下文窗口限制）"""
         if not self.action_history:
@@ -451,10 +856,11 @@ class AgentExecutor:
                 task_input=getattr(self, 'current_task_input', '')
             )
             
-            # 如果发生了压缩，替换
-            if len(compressed) < len(self.action_history):
+            # 如果发生了压缩，替换（未压缩时返回的就是原列表；压缩后条数可能不变，如单条超大动作）
+            if compressed is not self.action_history:
                 safe_print(f"✅ 历史动作已压缩: {len(self.action_history)}条 → {len(compressed)}条")
                 self.action_history = compressed
+                self.history_version += 1
         
         except Exception as e:
             safe_print(f"⚠️ 压缩失败: {e}")
@@ -491,6 +897,7 @@ class AgentExecutor:
                 
                 self.action_history_fact.append(action_record)
                 self.action_history.append(action_record)
+                self.history_version += 1
                 
                 # 从pending移除
                 self.pending_tools.remove(pending_tool)
@@ -507,6 +914,82 @@ class AgentExecutor:
         # 清空pending列表
         self.pending_tools = []
     
+    @traced("build_context")
+    def _build_context(self, task_id: str, task_input: str) -> str:
+        """构建完整的系统提示词（传入版本号，未变化的部分直接复用缓存）"""
+        return self.context_builder.build_context(
+            task_id,
+            self.agent_id,
+            self.agent_name,
+            task_input,
+            action_history=self.action_history,  # 传入当前的动作历史
+            history_version=self.history_version,
+            thinking=self.latest_thinking,
+            thinking_version=self.thinking_version
+        )
+    
+    @traced("build_request")
+    def _build_llm_request(self, task_id: str, task_input: str):
+        """
+        构建本轮LLM请求
+        
+        legacy: 完整上下文作为系统提示词，history只有一条"请输出下一个动作"
+        cache_friendly: 稳定前缀作为系统提示词；会话上下文作为第一条消息（缓存断点）；
+                        只追加的历史动作放在最后一条消息中，保证多轮之间的前缀逐字节一致
+        
+        Returns:
+            (系统提示词, history, 完整提示词文本（用于快照）)
+        """
+        if self.prompt_layout != "cache_friendly":
+            full_system_prompt = self._build_context(task_id, task_input)
+            return full_system_prompt, [ChatMessage(role="user", content="请输出下一个动作")], full_system_prompt
+        
+        stable_prefix, session_context, history_block = self.context_builder.build_prompt_parts(
+            task_id,
+            self.agent_id,
+            self.agent_name,
+            task_input,
+            action_history=self.action_history,
+            history_version=self.history_version,
+            thinking=self.latest_thinking,
+            thinking_version=self.thinking_version
+        )
+        history = [
+            ChatMessage(role="user", content=session_context, cache=True),
+            ChatMessage(role="user", content=f"{history_block}\n请输出下一个动作")
+        ]
+        return stable_prefix, history, "\n\n".join((stable_prefix, session_context, history_block))
+    
+    def _llm_priority(self) -> int:
+        """本Agent的LLM调用在限流调度器中的优先级（层级越浅越优先）"""
+        if self._agent_level is None:
+            self._agent_level = self.hierarchy_manager.get_agent_level(self.agent_id)
+        return agent_priority(self._agent_level)
+    
+    def _record_prompt_cache_usage(self, usage: Dict):
+        """累计提供商提示词缓存命中的token数"""
+        if not usage:
+            return
+        self.prompt_cache_stats["prompt_tokens"] += usage.get("prompt_tokens", 0) or 0
+        self.prompt_cache_stats["cached_tokens"] += usage.get("cached_tokens", 0) or 0
+    
+    def snapshot_prompt(self, task_id: str, system_prompt: str, turn: int):
+        """
+        记录发送给LLM的系统提示词（按prompt_snapshot策略，也可手动调用做按需快照）
+        
+        Args:
+            task_id: 任务ID（blob策略按任务存放快照）
+            system_prompt: 完整的系统提示词
+            turn: 当前轮次
+        """
+        if self.prompt_snapshot_policy == "checkpoint":
+            self.system_prompt_snapshot = system_prompt
+        elif self.prompt_snapshot_policy == "blob":
+            prompt_hash = self.conversation_storage.save_prompt_blob(task_id, system_prompt)
+            if not self.prompt_snapshots or self.prompt_snapshots[-1].get("hash") != prompt_hash:
+                self.prompt_snapshots.append({"turn": turn, "hash": prompt_hash})
+    
+    @traced("save_state", "storage")
     def _save_state(self, task_id: str, user_input: str, current_turn: int):
         """
         保存当前状态
@@ -516,14 +999,13 @@ class AgentExecutor:
             user_input: 用户输入
             current_turn: 当前轮次
         """
-        # 构建完整的系统提示词（包含XML上下文）
-        full_system_prompt = self.context_builder.build_context(
-            task_id,  # 添加task_id参数
-            self.agent_id,
-            self.agent_name,
-            user_input,
-            action_history=self.action_history  # 传入动作历史
-        )
+        # 只有inline策略在每次保存时渲染系统提示词，其余策略见snapshot_prompt
+        if self.prompt_snapshot_policy == "inline":
+            system_prompt = self._build_context(task_id, user_input)
+        elif self.prompt_snapshot_policy == "checkpoint":
+            system_prompt = self.system_prompt_snapshot
+        else:
+            system_prompt = ""
         
         # 保存状态（新格式）
         self.conversation_storage.save_actions(
@@ -538,7 +1020,8 @@ class AgentExecutor:
             latest_thinking=self.latest_thinking,
             first_thinking_done=self.first_thinking_done,
             tool_call_counter=self.tool_call_counter,
-            system_prompt=full_system_prompt
+            system_prompt=system_prompt,
+            prompt_snapshots=self.prompt_snapshots
         )
 
 
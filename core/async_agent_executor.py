@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+from utils.windows_compat import safe_print
+# -*- coding: utf-8 -*-
+"""
+异步Agent执行器 - 基于 asyncio 的 AgentExecutor
+
+与 AgentExecutor.run 语义相同：
+- LLM 调用使用 litellm.acompletion（SimpleLLMClient.achat）
+- 工具调用使用 httpx.AsyncClient（ToolExecutor.aexecute），子Agent同样异步执行
+- 状态保存、层级文件读写、thinking/压缩等阻塞操作放到线程中执行，不阻塞事件循环
+
+一个进程可以在同一个事件循环上同时驱动多个Agent/任务：
+    results = await asyncio.gather(agent_a.arun(task_a, input_a), agent_b.arun(task_b, input_b))
+"""
+
+import asyncio
+import json
+from typing import Dict, List
+from core.agent_executor import AgentExecutor, _EarlyDispatcher
+from utils.event_emitter import get_event_emitter
+from utils.tracer import get_tracer, usage_args
+from utils.usage_ledger import get_usage_ledger, usage_scope, set_usage_agent
+
+
+class AsyncAgentExecutor(AgentExecutor):
+    """异步Agent执行器（复用 AgentExecutor 的状态管理和上下文构建）"""
+    
+    async def arun(self, task_id: str, user_input: str) -> Dict:
+        """执行Agent任务（异步版本）"""
+        with get_tracer().span(f"agent {self.agent_name}", "agent", task_input=user_input[:200]) as span, \
+                usage_scope(task_id, self.agent_name):
+            try:
+                result = await self._arun(task_id, user_input)
+            finally:
+                # 关闭本Agent工具执行器共享的 httpx.AsyncClient
+                await self.tool_executor.aclose()
+            span["agent_id"] = self.agent_id
+            span["status"] = result.get("status")
+            return result
+    
+    async def _tracked(self, name: str, coro):
+        """在独立的trace轨道上执行协程（并发任务的span不会互相错误嵌套）"""
+        with get_tracer().track(name):
+            return await coro
+    
+    async def _arun(self, task_id: str, user_input: str) -> Dict:
+        """执行Agent任务（异步版本主循环）"""
+        safe_print(f"\n{'='*80}")
+        safe_print(f"🤖 启动Agent: {self.agent_name}")
+        safe_print(f"📝 任务: {user_input[:100]}...")
+        safe_print(f"{'='*80}\n")
+        
+        # 存储 task_input 供压缩器使用
+        self.current_task_input = user_input
+        
+        # Agent入栈
+        self.agent_id = await asyncio.to_thread(self.hierarchy_manager.push_agent, self.agent_name, user_input)
+        self._agent_level = await asyncio.to_thread(self.hierarchy_manager.get_agent_level, self.agent_id)
+        set_usage_agent(self.agent_id)
+        
+        # 尝试加载已有的对话历史
+        start_turn, final_result = await asyncio.to_thread(self._load_saved_state, task_id)
+        if final_result is not None:
+            return final_result
+        
+        # 恢复pending工具（如果有）
+        if self.pending_tools:
+            safe_print(f"🔄 发现{len(self.pending_tools)}个pending工具，恢复执行...")
+            await self._arecover_pending_tools(task_id)
+        
+        # 首次thinking（初始规划）
+        if start_turn == 0 and not self.first_thinking_done:
+            safe_print(f"[{self.agent_name}] 开始行动前进行初始规划...")
+            thinking_result = await asyncio.to_thread(self._trigger_thinking, task_id, user_input, True)
+            await asyncio.to_thread(self._apply_first_thinking, thinking_result, task_id, user_input)
+        
+        # 强制工具调用计数器
+        max_tool_try = 0
+        
+        # 执行循环
+        for turn in self._traced_turns(start_turn):
+            safe_print(f"\n--- 第 {turn + 1}/{self.max_turns} 轮执行 ---")
+            
+            try:
+                # 超过任务的token/费用预算时停止
+                budget_error = await asyncio.to_thread(get_usage_ledger().check_budget, task_id)
+                if budget_error:
+                    return await asyncio.to_thread(self._fail_budget_exceeded, budget_error)
+                
+                # 每轮开始前保存状态
+                await asyncio.to_thread(self._save_state, task_id, user_input, turn)
+                
+                # 检查并压缩历史动作（如果超过限制）
+                await asyncio.to_thread(self._compress_action_history_if_needed)
+                
+                # 构建完整的提示词（包含通用prompts + 动态上下文）
+                system_prompt, history, full_prompt = await asyncio.to_thread(self._build_llm_request, task_id, user_input)
+                await asyncio.to_thread(self.snapshot_prompt, task_id, full_prompt, turn)
+                
+                safe_print(f"🤖 调用LLM: {self.model_type}")
+                safe_print(f"   📝 System Prompt长度: {len(full_prompt)} 字符")
+                safe_print(f"   🔧 可用工具: {len(self.available_tools)} 个")
+                
+                # 流式模式下提前执行只读工具（None表示不提前执行）
+                early_dispatcher = self._make_early_dispatcher(task_id)
+                with get_tracer().span("llm_call", "llm", model=self.model_type) as span:
+                    llm_response = await self.llm_client.achat(
+                        history=history,
+                        model=self.model_type,
+                        system_prompt=system_prompt,
+                        tool_list=self.available_tools,
+                        tool_choice="required",  # 强制工具调用
+                        parallel_tool_calls=self.parallel_tool_calls,
+                        stream=self.stream_responses,
+                        on_tool_call=early_dispatcher,
+                        prompt_cache=self.prompt_layout == "cache_friendly",
+                        priority=self._llm_priority(),
+                        purpose="agent_turn"
+                    )
+                    span.update(usage_args(llm_response.usage))
+                    self._record_prompt_cache_usage(llm_response.usage)
+                    span["tool_calls"] = len(llm_response.tool_calls)
+                # 只采用与最终响应一致的提前执行结果（tool_call.id -> asyncio.Task）
+                early_results = early_dispatcher.take(llm_response.tool_calls) if early_dispatcher else {}
+                
+                if llm_response.status != "success":
+                    return await asyncio.to_thread(self._fail_llm_call, llm_response)
+                
+                safe_print(f"📥 LLM输出: {llm_response.output[:100]}...")
+                safe_print(f"🔧 工具调用数量: {len(llm_response.tool_calls)}")
+                
+                # 检查是否有工具调用
+                if not llm_response.tool_calls:
+                    # 强制工具调用机制
+                    if max_tool_try < 5:
+                        max_tool_try += 1
+                        await asyncio.to_thread(self._record_no_tool_call, max_tool_try, task_id, user_input, turn)
+                        continue
+                    else:
+                        # 5次后仍不调用，触发thinking并报错
+                        safe_print("❌ 5次提醒后仍未调用工具，触发thinking分析")
+                        thinking_result = await asyncio.to_thread(self._trigger_thinking, task_id, user_input, False)
+                        return await asyncio.to_thread(self._fail_no_tool_call, thinking_result)
+                
+                # 重置计数器（成功调用了工具）
+                max_tool_try = 0
+                
+                # 执行所有工具调用（并行模式下，连续的只读工具合为一组并发执行）
+                for tool_group in self._group_tool_calls(llm_response.tool_calls):
+                    prepared_calls = [(tool_call, self._prepare_tool_call(tool_call)) for tool_call in tool_group]
+                    await asyncio.to_thread(self._save_state, task_id, user_input, turn)  # 保存pending状态
+                    
+                    # 执行工具（使用带 uuid 的参数，结果按原始调用顺序返回）
+                    tool_results = await self._aexecute_tool_group(prepared_calls, task_id, early_results)
+                    
+                    for (tool_call, arguments_with_uuid), tool_result in zip(prepared_calls, tool_results):
+                        # 记录结果；如果是final_output，返回结果
+                        finished = await asyncio.to_thread(
+                            self._record_tool_result, tool_call, arguments_with_uuid, tool_result, task_id, user_input, turn
+                        )
+                        if finished:
+                            return tool_result
+                
+                # 检查是否该触发thinking（每N轮工具调用）
+                if self.tool_call_counter % self.thinking_interval == 0:
+                    safe_print(f"[{self.agent_name}] 第{self.tool_call_counter}轮工具调用，触发thinking分析")
+                    thinking_result = await asyncio.to_thread(self._trigger_thinking, task_id, user_input, False)
+                    await asyncio.to_thread(self._apply_progress_thinking, thinking_result, task_id, user_input, turn)
+            
+            except Exception as e:
+                return await asyncio.to_thread(self._fail_with_exception, e)
+        
+        # 超过最大轮次
+        return await asyncio.to_thread(self._fail_max_turns)
+    
+    def _make_early_dispatcher(self, task_id: str):
+        """创建流式工具调用回调（异步版本）：参数完整的只读工具立即作为asyncio任务执行"""
+        if not (self.stream_responses and self.early_tool_dispatch and self.parallel_tool_calls):
+            return None
+        
+        def submit(tool_call):
+            return asyncio.ensure_future(self._tracked(
+                tool_call.name, self.tool_executor.aexecute(tool_call.name, tool_call.arguments, task_id)
+            ))
+        
+        return _EarlyDispatcher(self, submit)
+    
+    async def _aexecute_tool_group(self, prepared_calls: List, task_id: str, early_results: Dict = None) -> List[Dict]:
+        """
+        执行一组工具调用（异步版本），多个调用时作为并发的asyncio任务执行
+        
+        Args:
+            prepared_calls: (tool_call, 带 uuid 的参数) 列表
+            task_id: 任务ID
+            early_results: 流式模式下已提前执行的工具（tool_call.id -> asyncio.Task）
+        
+        Returns:
+            工具结果列表（与 prepared_calls 顺序一致）
+        """
+        if early_results and any(tool_call.id in early_results for tool_call, _ in prepared_calls):
+            remaining = [call for call in prepared_calls if call[0].id not in early_results]
+            remaining_results = iter(await self._aexecute_tool_group(remaining, task_id) if remaining else [])
+            return [
+                await early_results[tool_call.id] if tool_call.id in early_results else next(remaining_results)
+                for tool_call, _ in prepared_calls
+            ]
+        
+        if len(prepared_calls) == 1:
+            tool_call, arguments = prepared_calls[0]
+            return [await self.tool_executor.aexecute(tool_call.name, arguments, task_id)]
+        
+        if self._is_sub_agent_tool(prepared_calls[0][0].name):
+            return await self.tool_executor.aexecute_fan_out(
+                [(tool_call.name, arguments) for tool_call, arguments in prepared_calls],
+                task_id,
+                max_workers=self.max_parallel_sub_agents
+            )
+        
+        safe_print(f"⚡ 并发执行 {len(prepared_calls)} 个只读工具")
+        semaphore = asyncio.Semaphore(self.max_parallel_tools)
+        
+        async def run_call(tool_call, arguments):
+            async with semaphore:
+                return await self._tracked(tool_call.name, self.tool_executor.aexecute(tool_call.name, arguments, task_id))
+        
+        return list(await asyncio.gather(*(run_call(tool_call, arguments) for tool_call, arguments in prepared_calls)))
+    
+    async def _arecover_pending_tools(self, task_id: str):
+        """恢复pending状态的工具调用（异步版本，与 _recover_pending_tools 相同按顺序执行）"""
+        for pending_tool in self.pending_tools[:]:  # 复制列表
+            try:
+                safe_print(f"   🔄 恢复执行: {pending_tool['name']}")
+                safe_print(f"   📋 参数: {pending_tool['arguments']}")
+                
+                # 发送恢复事件（JSONL模式）
+                emitter = get_event_emitter()
+                if emitter.enabled:
+                    params_str = json.dumps(pending_tool["arguments"], ensure_ascii=False, indent=2)
+                    emitter.token(f"恢复工具: {pending_tool['name']}\n参数: {params_str}")
+                
+                # 重新执行工具
+                tool_result = await self.tool_executor.aexecute(
+                    pending_tool["name"],
+                    pending_tool["arguments"],
+                    task_id
+                )
+                
+                # 记录结果
+                action_record = {
+                    "tool_name": pending_tool["name"],
+                    "arguments": pending_tool["arguments"],
+                    "result": tool_result
+                }
+                
+                self.action_history_fact.append(action_record)
+                self.action_history.append(action_record)
+                self.history_version += 1
+                
+                # 从pending移除
+                self.pending_tools.remove(pending_tool)
+                
+                safe_print(f"   ✅ 恢复完成: {pending_tool['name']}")
+                
+                # 如果是final_output，直接返回
+                if pending_tool["name"] == "final_output":
+                    return tool_result
+            
+            except Exception as e:
+                safe_print(f"   ❌ 恢复失败: {pending_tool['name']} - {e}")
+        
+        # 清空pending列表
+        self.pending_tools = []
@@ -5,7 +5,7 @@ from utils.windows_compat import safe_print
 上下文构造器 - 构建新的XML结构化上下文
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import json
 
 
@@ -30,6 +30,21 @@ class ContextBuilder:
         self.llm_client = llm_client
         self.max_context_window = max_context_window
         
+        # 对话存储（读取thinking和动作历史，与AgentExecutor共享同一份journal）
+        from utils.conversation_storage import ConversationStorage
+        self.conversation_storage = ConversationStorage()
+        
+        # 各部分的版本化缓存：section -> (key, value)
+        self._section_cache = {}
+        self.cache_stats = {}
+        # 单条动作的渲染缓存：id(action) -> (action, 渲染文本, token数)
+        self._action_render_cache = {}
+        self.action_history_tokens = 0  # 最近一次渲染的历史动作token数
+        
+        # 上下文布局（legacy / cache_friendly，见 runtime_config.yaml prompt_layout）
+        from utils.runtime_config import get_runtime_option
+        self.layout = get_runtime_option("prompt_layout.mode", "legacy")
+        
         # 初始化tiktoken
         try:
             import tiktoken
@@ -38,47 +53,50 @@ class ContextBuilder:
             self.encoding = None
     
     def build_context(self, task_id: str, agent_id: str, agent_name: str, task_input: str, 
-                     action_history: List[Dict] = None) -> str:
+                     action_history: List[Dict] = None, history_version: int = None,
+                     thinking: str = None, thinking_version: int = None) -> str:
         """
         构建完整的系统提示词（包含通用部分+动态上下文）
         
+        各部分按版本号缓存：通用提示词按文件修改时间，调用树等按HierarchyManager版本，
+        thinking和动作历史按AgentExecutor传入的版本号。未传入版本号的部分每次重新构建。
+        
         Args:
             task_id: 任务ID（用于读取文件）
             agent_id: 当前Agent ID
             agent_name: 当前Agent名称
             task_input: 当前Agent的任务输入
             action_history: 当前Agent的动作历史（可选，优先使用）
+            history_version: 动作历史版本号（action_history变化时递增）
+            thinking: 当前Agent的最新thinking（可选，优先于对话存储中的值）
+            thinking_version: thinking版本号（thinking变化时递增）
             
         Returns:
             完整的XML结构化上下文字符串（包含通用提示词）
         """
-        context_data = self.hierarchy_manager.get_context()
-        current = context_data.get("current", {})
-        history = context_data.get("history", [])
-        
-        # 使用传入的action_history
-        if action_history is not None:
-            self.current_action_history = action_history
-        
-        # 1️⃣ 读取通用系统提示词（general_prompts.yaml，包含<智能体经验>）
-        general_system_prompt = self._load_general_system_prompt(agent_name)
-        
-        # 2️⃣ 构建各个动态部分
-        user_latest_input = self._build_user_latest_input(current)
-        user_agent_history = self._build_user_agent_history(task_id, current)
-        structured_call_info = self._build_structured_call_info(current, agent_id)
-        current_thinking = self._build_current_thinking(task_id, agent_id, current)
-        action_history_xml = self._build_action_history(task_id, agent_id)
-        
-        # 3️⃣ 组装完整上下文（通用部分在最前面）
-        full_context = f"""{general_system_prompt}
+        if self.layout == "cache_friendly":
+            return "\n\n".join(self.build_prompt_parts(
+                task_id, agent_id, agent_name, task_input,
+                action_history, history_version, thinking, thinking_version
+            ))
+        
+        full_key = self._full_key(task_id, agent_id, agent_name, task_input, history_version, thinking_version)
+        
+        def assemble():
+            sections = self._build_sections(
+                task_id, agent_id, agent_name, task_input,
+                action_history, history_version, thinking, thinking_version
+            )
+            
+            # 组装完整上下文（通用部分在最前面）
+            return f"""{sections["general_prompt"]}
 
 <用户最新输入>
-{user_latest_input}
+{sections["user_latest_input"]}
 </用户最新输入>
 
 <用户-智能体历史交互>
-{user_agent_history}
+{sections["user_agent_history"]}
 </用户-智能体历史交互>
 
 <当前运行智能体名称>
@@ -86,7 +104,7 @@ class ContextBuilder:
 </当前运行智能体名称>
 
 <结构化调用信息>
-{structured_call_info}
+{sections["structured_call_info"]}
 </结构化调用信息>
 
 <当前智能体任务>
@@ -94,15 +112,194 @@ class ContextBuilder:
 </当前智能体任务>
 
 <当前进度思考>
-{current_thinking}
+{sections["current_thinking"]}
 </当前进度思考>
 
 <历史动作>
-{action_history_xml}
+{sections["action_history"]}
 </历史动作>
 """
         
-        return full_context
+        if action_history is not None:
+            self.current_action_history = action_history
+        return self._cached("full_context", full_key, assemble)
+    
+    def build_prompt_parts(self, task_id: str, agent_id: str, agent_name: str, task_input: str,
+                           action_history: List[Dict] = None, history_version: int = None,
+                           thinking: str = None, thinking_version: int = None) -> Tuple[str, str, str]:
+        """
+        按提供商提示词缓存友好的顺序构建上下文（prompt_layout.mode: cache_friendly）
+        
+        三部分从稳定到易变排列，前缀在多轮之间逐字节不变，提供商可以复用已缓存的前缀：
+        - 稳定前缀：通用提示词、当前智能体名称、当前智能体任务（整个Agent运行期间不变）
+        - 会话上下文：用户输入、历史交互、调用树、当前进度思考（子Agent完成或thinking时变化）
+        - 历史动作：只追加，放在最后
+        
+        参数与 build_context 相同。
+        
+        Returns:
+            (稳定前缀, 会话上下文, 历史动作)
+        """
+        full_key = self._full_key(task_id, agent_id, agent_name, task_input, history_version, thinking_version)
+        
+        def assemble():
+            sections = self._build_sections(
+                task_id, agent_id, agent_name, task_input,
+                action_history, history_version, thinking, thinking_version
+            )
+            
+            stable_prefix = f"""{sections["general_prompt"]}
+
+<当前运行智能体名称>
+{agent_name}
+</当前运行智能体名称>
+
+<当前智能体任务>
+{task_input}
+</当前智能体任务>
+"""
+            session_context = f"""<用户最新输入>
+{sections["user_latest_input"]}
+</用户最新输入>
+
+<用户-智能体历史交互>
+{sections["user_agent_history"]}
+</用户-智能体历史交互>
+
+<结构化调用信息>
+{sections["structured_call_info"]}
+</结构化调用信息>
+
+<当前进度思考>
+{sections["current_thinking"]}
+</当前进度思考>
+"""
+            history_block = f"""<历史动作>
+{sections["action_history"]}
+</历史动作>
+"""
+            return stable_prefix, session_context, history_block
+        
+        if action_history is not None:
+            self.current_action_history = action_history
+        return self._cached("prompt_parts", full_key, assemble)
+    
+    def _full_key(self, task_id: str, agent_id: str, agent_name: str, task_input: str,
+                  history_version: int = None, thinking_version: int = None):
+        """完整上下文的缓存键（未传入版本号时返回None，不缓存）"""
+        if history_version is None or thinking_version is None:
+            return None
+        return (task_id, agent_id, agent_name, task_input, self.hierarchy_manager.get_version(),
+                self._general_prompts_version(), history_version, thinking_version)
+    
+    def _build_sections(self, task_id: str, agent_id: str, agent_name: str, task_input: str,
+                        action_history: List[Dict] = None, history_version: int = None,
+                        thinking: str = None, thinking_version: int = None) -> Dict[str, str]:
+        """构建（或从缓存读取）上下文的各个部分"""
+        hierarchy_version = self.hierarchy_manager.get_version()
+        prompts_version = self._general_prompts_version()
+        
+        # 1️⃣ 读取通用系统提示词（general_prompts.yaml，包含<智能体经验>）
+        general_system_prompt = self._cached(
+            "general_prompt", (agent_name, prompts_version),
+            lambda: self._load_general_system_prompt(agent_name)
+        )
+        
+        # 2️⃣ 构建各个动态部分
+        def build_shared_sections():
+            context_data = self.hierarchy_manager.get_context()
+            current = context_data.get("current", {})
+            return (
+                current,
+                self._build_user_latest_input(current),
+                self._build_user_agent_history(task_id, current),
+                self._build_structured_call_info(current, agent_id)
+            )
+        
+        current, user_latest_input, user_agent_history, structured_call_info = self._cached(
+            "call_tree", (task_id, agent_id, hierarchy_version), build_shared_sections
+        )
+        
+        thinking_key = None
+        if thinking_version is not None:
+            thinking_key = (task_id, agent_id, hierarchy_version, thinking_version)
+        current_thinking = self._cached(
+            "thinking", thinking_key,
+            lambda: self._build_current_thinking(task_id, agent_id, current, thinking)
+        )
+        
+        history_key = None
+        if history_version is not None:
+            history_key = (task_id, agent_id, history_version)
+        action_history_xml = self._cached(
+            "action_history", history_key,
+            lambda: self._build_action_history(task_id, agent_id)
+        )
+        
+        return {
+            "general_prompt": general_system_prompt,
+            "user_latest_input": user_latest_input,
+            "user_agent_history": user_agent_history,
+            "structured_call_info": structured_call_info,
+            "current_thinking": current_thinking,
+            "action_history": action_history_xml
+        }
+    
+    def _cached(self, section: str, key, compute):
+        """
+        按key缓存某个部分的构建结果（每个部分只保留最新一份）
+        
+        Args:
+            section: 部分名称（用于统计）
+            key: 缓存键，None表示不缓存
+            compute: 构建函数
+        """
+        stats = self.cache_stats.setdefault(section, {"hits": 0, "misses": 0})
+        if key is not None:
+            entry = self._section_cache.get(section)
+            if entry is not None and entry[0] == key:
+                stats["hits"] += 1
+                return entry[1]
+        stats["misses"] += 1
+        value = compute()
+        if key is not None:
+            self._section_cache[section] = (key, value)
+        return value
+    
+    def get_cache_stats(self) -> Dict:
+        """
+        获取上下文缓存命中统计
+        
+        Returns:
+            {section: {"hits": int, "misses": int, "hit_rate": float}}
+        """
+        report = {}
+        for section, stats in self.cache_stats.items():
+            total = stats["hits"] + stats["misses"]
+            report[section] = {
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "hit_rate": stats["hits"] / total if total else 0.0
+            }
+        return report
+    
+    def invalidate_cache(self):
+        """清空所有缓存的上下文部分"""
+        self._section_cache.clear()
+        self._action_render_cache.clear()
+    
+    def _general_prompts_file(self):
+        """general_prompts.yaml路径"""
+        from pathlib import Path
+        agent_system_name = self.config_loader.agent_system_name
+        return Path(self.config_loader.config_root) / "agent_library" / agent_system_name / "general_prompts.yaml"
+    
+    def _general_prompts_version(self) -> int:
+        """general_prompts.yaml的修改时间（文件变化时通用提示词缓存失效）"""
+        try:
+            return self._general_prompts_file().stat().st_mtime_ns
+        except OSError:
+            return 0
     
     def _load_general_system_prompt(self, agent_name: str) -> str:
         """
@@ -116,10 +313,8 @@ class ContextBuilder:
         """
         # 读取general_prompts.yaml
         import yaml
-        from pathlib import Path
         
-        agent_system_name = self.config_loader.agent_system_name
-        prompts_file = Path(self.config_loader.config_root) / "agent_library" / agent_system_name / "general_prompts.yaml"
+        prompts_file = self._general_prompts_file()
         
         if not prompts_file.exists():
             return ""
@@ -169,8 +364,10 @@ class ContextBuilder:
         if current is None:
             current = context.get("current", {})
         history = context.get("history", [])
+        # 更早的历史已移入归档分段，这里只读取索引摘要
+        archived = self.hierarchy_manager.history_index()
         
-        if not history:
+        if not history and not archived:
             return "(无历史交互)"
         
 
@@ -181,7 +378,7 @@ class ContextBuilder:
             return compressed_history
         
         safe_print("未到历史交互压缩阈值")
-        if len(str(history)) < 5000:
+        if not archived and len(str(history)) < 5000:
             return str(history)
         
         # 提取当前任务的用户输入
@@ -193,14 +390,17 @@ class ContextBuilder:
             current_task = "\n".join(user_inputs)
         
         safe_print("首次压缩历史交互...")
-        compressed_result = self._compress_user_agent_history_with_llm(history, task_id, current_task)
+        compressed_result = self._compress_user_agent_history_with_llm(history, task_id, current_task, archived)
         
-        context["current"]["_compressed_user_agent_history"] = compressed_result
-        self.hierarchy_manager._save_context(context)
+        # 压缩耗时较长，期间共享上下文可能已被其他Agent/进程修改：只写回这一个字段（冲突时重新读取重试）
+        def _store_compressed(latest: Dict):
+            latest["current"]["_compressed_user_agent_history"] = compressed_result
+        self.hierarchy_manager.update_context(_store_compressed)
         
         return compressed_result
     
-    def _compress_user_agent_history_with_llm(self, history: List[Dict], task_id: str, current_task: str = "") -> str:
+    def _compress_user_agent_history_with_llm(self, history: List[Dict], task_id: str, current_task: str = "",
+                                              archived: List[Dict] = None) -> str:
         """
         使用LLM压缩历史交互（直接返回LLM输出，不解析）
         
@@ -208,13 +408,24 @@ class ContextBuilder:
             history: 历史任务列表
             task_id: 任务ID
             current_task: 当前任务的用户输入内容
+            archived: 已归档历史的索引（使用其中的摘要，不读取完整条目）
             
         Returns:
             压缩后的文本（LLM原始输出）
         """
         full_history_data = []
+        archived = archived or []
         
-        for i, hist_item in enumerate(history, 1):
+        for item in archived:
+            summary = item.get("summary", {})
+            full_history_data.append({
+                "task_id": item.get("id"),
+                "time_range": f"{item.get('start_time', '')} → {item.get('completion_time', '')}",
+                "user_inputs": summary.get("instructions", []),
+                "agents": [agent for agent in summary.get("agents", []) if agent.get("agent_name") != "judge_agent"]
+            })
+        
+        for i, hist_item in enumerate(history, len(archived) + 1):
             instructions = hist_item.get("instructions", [])
             agents_status = hist_item.get("agents_status", {})
             start_time = hist_item.get("start_time", "")
@@ -275,6 +486,7 @@ class ContextBuilder:
 - 直接输出总结内容文本，不需要任何标记，不要使用markdown格式"""
 
         from services.llm_client import ChatMessage
+        from utils.llm_scheduler import PRIORITY_COMPRESSION
         
         history_messages = [ChatMessage(role="user", content=prompt)]
         
@@ -283,7 +495,9 @@ class ContextBuilder:
             model=self.llm_client.models[0],
             system_prompt="你是一个专业的内容总结助手。请简洁明了地总结历史交互信息。",
             tool_list=[],
-            tool_choice="auto"
+            tool_choice="auto",
+            priority=PRIORITY_COMPRESSION,
+            purpose="history_compression"
         )
         
         if response.status != "success":
@@ -471,28 +685,18 @@ class ContextBuilder:
         
         return "\n".join(lines)
     
-    def _build_current_thinking(self, task_id: str, agent_id: str, current: Dict) -> str:
-        """构建当前进度思考（从文件读取最新的thinking）"""
-        # 从_actions.json文件读取（使用正确的路径）
-        from pathlib import Path
-        import json
-        import hashlib
-        import os
-        
-        # 使用与ConversationStorage相同的路径生成逻辑
-        conversations_dir = Path.home() / "mla_v3" / "conversations"
-        task_hash = hashlib.md5(task_id.encode()).hexdigest()[:8]
-        task_folder = Path(task_id).name if (os.sep in task_id or '/' in task_id or '\\' in task_id) else task_id
-        task_name = f"{task_hash}_{task_folder}"
-        filepath = conversations_dir / f"{task_name}_{agent_id}_actions.json"
+    def _build_current_thinking(self, task_id: str, agent_id: str, current: Dict, thinking: str = None) -> str:
+        """构建当前进度思考（优先使用传入的thinking，否则从对话存储读取）"""
+        if thinking:
+            return thinking
         
+        # 通过ConversationStorage读取（journal后端直接使用内存中的最新状态）
         try:
-            if filepath.exists():
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    thinking = data.get("latest_thinking", "")
-                    if thinking:
-                        return thinking
+            data = self.conversation_storage.read_state(task_id, agent_id)
+            if data:
+                thinking = data.get("latest_thinking", "")
+                if thinking:
+                    return thinking
         except Exception as e:
             safe_print(f"⚠️ 读取thinking失败: {e}")
         
@@ -506,74 +710,93 @@ class ContextBuilder:
         return "(无)"
     
     def _build_action_history(self, task_id: str, agent_id: str) -> str:
-        """构建历史动作记录（从文件读取，XML格式）"""
+        """构建历史动作记录（优先使用传入的历史，XML格式）"""
         # 优先使用传入的action_history
         action_history = self.current_action_history
         
-        # 如果没有传入，从文件读取
+        # 如果没有传入，从对话存储读取
         if not action_history:
-            from pathlib import Path
-            import json
-            import hashlib
-            import os
-            
-            # 使用与ConversationStorage相同的路径生成逻辑
-            conversations_dir = Path.home() / "mla_v3" / "conversations"
-            task_hash = hashlib.md5(task_id.encode()).hexdigest()[:8]
-            task_folder = Path(task_id).name if (os.sep in task_id or '/' in task_id or '\\' in task_id) else task_id
-            task_name = f"{task_hash}_{task_folder}"
-            filepath = conversations_dir / f"{task_name}_{agent_id}_actions.json"
-            
             try:
-                if filepath.exists():
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        action_history = data.get("action_history", [])
+                data = self.conversation_storage.read_state(task_id, agent_id)
+                if data:
+                    action_history = data.get("action_history", [])
             except Exception as e:
                 safe_print(f"⚠️ 读取action_history失败: {e}")
         
         if not action_history:
             return "(无历史动作)"
         
-        # 构建XML格式的动作历史
-        actions_xml = []
+        return "\n\n".join(self._render_actions(action_history))
+    
+    def _render_actions(self, action_history: List[Dict]) -> List[str]:
+        """
+        逐条渲染动作（按动作对象缓存渲染文本和token数）
+        
+        动作记录后不再修改，新一轮只渲染新增的动作；压缩后被总结替换的动作从缓存中移除
+        """
+        stats = self.cache_stats.setdefault("action_render", {"hits": 0, "misses": 0})
+        rendered = {}
+        texts = []
+        total_tokens = 0
         for action in action_history:
-            tool_name = action.get("tool_name", "")
-            
-            # 检查是否是历史总结
-            if tool_name == "_historical_summary":
-                # 渲染为<已压缩信息>
-                summary_text = action.get("result", {}).get("output", "")
-                actions_xml.append(f"<已压缩信息>\n{summary_text}\n</已压缩信息>")
-                continue
-            
-            # 普通action
-            arguments = action.get("arguments", {})
-            result = action.get("result", {})
-            
-            # 构建单个动作的XML
-            # action_xml = f"<action>\n"
-            # action_xml += f"  <tool_name>{tool_name}</tool_name>\n"
-            action_xml = f"action:\n"
-            action_xml += f"  tool_name:{tool_name}\n"            
-            # 添加参数
-            for param_name, param_value in arguments.items():
-                # 转义XML特殊字符
-                param_value_str = str(param_value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                #action_xml += f"  <tool_use:{param_name}>{param_value_str}</tool_use:{param_name}>\n"
-                action_xml += f"  {param_name}:{param_value_str}\n"
-            
-            # 添加结果（JSON格式）
-            try:
-                result_json = json.dumps(result, ensure_ascii=False, indent=2)
-                action_xml += f"  <result>\n{result_json}\n  </result>\n"
-            except:
-                action_xml += f"  <result>{str(result)}</result>\n"
-            
-            # action_xml += "</action>"
-            actions_xml.append(action_xml)
+            # 缓存条目保存动作对象本身：对象存活期间id不会被复用
+            entry = self._action_render_cache.get(id(action))
+            if entry is not None and entry[0] is action:
+                stats["hits"] += 1
+            else:
+                stats["misses"] += 1
+                text = self._render_action(action)
+                entry = (action, text, self._count_tokens(text))
+            rendered[id(action)] = entry
+            texts.append(entry[1])
+            total_tokens += entry[2]
+        
+        self._action_render_cache = rendered
+        self.action_history_tokens = total_tokens
+        return texts
+    
+    def _count_tokens(self, text: str) -> int:
+        """统计token数"""
+        if self.encoding:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
+        return int(chinese_chars / 1.5 + (len(text) - chinese_chars) / 4)
+    
+    def _render_action(self, action: Dict) -> str:
+        """渲染单个动作（历史总结渲染为<已压缩信息>）"""
+        tool_name = action.get("tool_name", "")
+        
+        # 检查是否是历史总结
+        if tool_name == "_historical_summary":
+            # 渲染为<已压缩信息>
+            summary_text = action.get("result", {}).get("output", "")
+            return f"<已压缩信息>\n{summary_text}\n</已压缩信息>"
+        
+        # 普通action
+        arguments = action.get("arguments", {})
+        result = action.get("result", {})
+        
+        # 构建单个动作的XML
+        # action_xml = f"<action>\n"
+        # action_xml += f"  <tool_name>{tool_name}</tool_name>\n"
+        action_xml = f"action:\n"
+        action_xml += f"  tool_name:{tool_name}\n"            
+        # 添加参数
+        for param_name, param_value in arguments.items():
+            # 转义XML特殊字符
+            param_value_str = str(param_value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            #action_xml += f"  <tool_use:{param_name}>{param_value_str}</tool_use:{param_name}>\n"
+            action_xml += f"  {param_name}:{param_value_str}\n"
+        
+        # 添加结果（JSON格式）
+        try:
+            result_json = json.dumps(result, ensure_ascii=False, indent=2)
+            action_xml += f"  <result>\n{result_json}\n  </result>\n"
+        except:
+            action_xml += f"  <result>{str(result)}</result>\n"
         
-        return "\n\n".join(actions_xml)
+        # action_xml += "</action>"
+        return action_xml
 
 
 if __name__ == "__main__":
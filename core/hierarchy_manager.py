@@ -4,19 +4,29 @@ from utils.windows_compat import safe_print
 """
 层级管理器 - 管理Agent调用层级和共享上下文
 简化版本，去除冗余功能，保留核心逻辑
+状态保存在可插拔的存储后端中（见 core/hierarchy_store.py）
 """
 
 import os
-import json
+import time
+import random
+import sqlite3
 import threading
-from typing import Dict, List, Optional
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 from pathlib import Path
+from core.hierarchy_store import JsonHierarchyStore, SqliteHierarchyStore
+from core.history_archive import HistoryArchive
 
 
 class HierarchyManager:
     """Agent层级管理器"""
     
+    # 主分支ID（顺序执行时所有Agent都在主分支上，对应栈文件中的 stack 字段）
+    MAIN_BRANCH = "main"
+    
     def __init__(self, task_id: str):
         """
         初始化层级管理器
@@ -25,7 +35,10 @@ class HierarchyManager:
             task_id: 任务ID
         """
         self.task_id = task_id
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()  # 可重入：exclusive() 内可继续调用本类方法
+        self.version = 0  # 共享上下文版本号（每次保存递增，用于上下文缓存失效）
+        # 当前执行上下文所在的分支（线程和asyncio任务各自独立）
+        self._branch = contextvars.ContextVar(f"hierarchy_branch_{id(self)}", default=self.MAIN_BRANCH)
         
         # 文件路径 - 使用用户主目录（跨平台）
         conversations_dir = Path.home() / "mla_v3" / "conversations"
@@ -40,85 +53,166 @@ class HierarchyManager:
         
         self.stack_file = conversations_dir / f'{task_name}_stack.json'
         self.context_file = conversations_dir / f'{task_name}_share_context.json'
+        self.db_file = conversations_dir / f'{task_name}_hierarchy.db'
+        # 跨进程咨询锁（多个进程同时运行同一任务时串行化写操作，两种后端共用）
+        self.lock_file = conversations_dir / f'{task_name}_hierarchy.lock'
+        # 历史归档分段目录（共享上下文中只保留最近的history）
+        self.history_dir = conversations_dir / f'{task_name}_history'
         
-        # 初始化文件
-        self._initialize_files()
-    
-    def _initialize_files(self):
-        """初始化栈文件和共享上下文文件"""
-        # 初始化栈文件
-        if not self.stack_file.exists():
-            with open(self.stack_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "stack": [],
-                    "created_at": datetime.now().isoformat()
-                }, f, indent=2, ensure_ascii=False)
+        # 存储后端：sqlite（默认，WAL模式，行级更新）/ json（整体读写两个JSON文件）
+        from utils.runtime_config import get_runtime_option
+        self.backend = get_runtime_option("hierarchy_store.backend", "sqlite")
+        self.export_on_archive = get_runtime_option("hierarchy_store.export_json", True)
+        self.archive = None
+        self.hot_history = get_runtime_option("hierarchy_store.history_archive.hot_entries", 10)
+        if get_runtime_option("hierarchy_store.history_archive.enabled", True):
+            self.archive = HistoryArchive(
+                self.history_dir, get_runtime_option("hierarchy_store.history_archive.segment_size", 50)
+            )
+        self.store = self._open_store()
+    
+    def _open_store(self):
+        """打开存储后端（sqlite新建时导入已有的JSON状态）"""
+        if self.backend == "sqlite":
+            legacy = None
+            if not self.db_file.exists() and (self.stack_file.exists() or self.context_file.exists()):
+                legacy = JsonHierarchyStore(self.task_id, self.stack_file, self.context_file, self.lock_file)
+            try:
+                return SqliteHierarchyStore(self.task_id, self.db_file, import_from=legacy, lock_file=self.lock_file,
+                                            archive=self.archive, hot_history=self.hot_history)
+            except sqlite3.Error as e:
+                safe_print(f"⚠️ 打开层级数据库失败: {e}，改用JSON存储")
+        elif self.backend != "json":
+            safe_print(f"⚠️ 未知的层级存储后端: {self.backend}，使用JSON存储")
+        self.backend = "json"
+        return JsonHierarchyStore(self.task_id, self.stack_file, self.context_file, self.lock_file,
+                                  archive=self.archive, hot_history=self.hot_history)
+    
+    def current_branch(self) -> str:
+        """获取当前线程/asyncio任务所在的分支ID"""
+        return self._branch.get()
+    
+    def _load_branches(self) -> Dict[str, List[Dict]]:
+        """加载所有分支的栈"""
+        return self.store.load_branches()
+    
+    def _load_stack(self, branch: str = None) -> List[Dict]:
+        """加载当前分支的栈状态"""
+        return self.store.get_stack(branch or self.current_branch())
+    
+    def _save_stack(self, stack: List[Dict], branch: str = None):
+        """保存当前分支的栈状态"""
+        self.store.set_stack(branch or self.current_branch(), stack)
+    
+    def fork_branch(self) -> str:
+        """
+        从当前分支派生一个新分支（用于并发执行的兄弟子Agent）
         
-        # 初始化共享上下文文件
-        if not self.context_file.exists():
-            with open(self.context_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "task_id": self.task_id,
-                    "current": {
-                        "instructions": [],
-                        "hierarchy": {},
-                        "agents_status": {},
-                        "start_time": datetime.now().isoformat(),
-                        "last_updated": datetime.now().isoformat()
-                    },
-                    "agent_time_history": {},
-                    "history": [],
-                    "created_at": datetime.now().isoformat(),
-                    "last_updated": datetime.now().isoformat()
-                }, f, indent=2, ensure_ascii=False)
-    
-    def _load_stack(self) -> List[Dict]:
-        """加载当前栈状态"""
-        try:
-            with open(self.stack_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("stack", [])
-        except Exception as e:
-            safe_print(f"⚠️ 加载栈文件失败: {e}")
-            return []
+        新分支的栈是当前分支栈的副本，因此子Agent的父Agent与顺序执行时一致
+        
+        Returns:
+            新分支ID
+        """
+        import uuid
+        with self.lock:
+            branch_id = f"branch_{uuid.uuid4().hex[:8]}"
+            self.store.fork_branch(self.current_branch(), branch_id)
+            return branch_id
     
-    def _save_stack(self, stack: List[Dict]):
-        """保存栈状态"""
+    def close_branch(self, branch_id: str):
+        """删除分支（分支上的子Agent执行结束后调用）"""
+        if branch_id == self.MAIN_BRANCH:
+            return
+        with self.lock:
+            self.store.delete_branch(branch_id)
+    
+    @contextmanager
+    def use_branch(self, branch_id: str):
+        """在当前线程/asyncio任务中切换到指定分支（退出时恢复原分支）"""
+        token = self._branch.set(branch_id)
         try:
-            with open(self.stack_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "stack": stack,
-                    "last_updated": datetime.now().isoformat()
-                }, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            safe_print(f"⚠️ 保存栈文件失败: {e}")
+            yield branch_id
+        finally:
+            self._branch.reset(token)
     
     def _load_context(self) -> Dict:
-        """加载共享上下文"""
-        try:
-            with open(self.context_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            safe_print(f"⚠️ 加载共享上下文失败: {e}")
-            return {
-                "task_id": self.task_id,
-                "current": {
-                    "instructions": [],
-                    "hierarchy": {},
-                    "agents_status": {}
-                },
-                "agent_time_history": {},
-                "history": []
-            }
-    
-    def _save_context(self, context: Dict):
-        """保存共享上下文"""
+        """加载完整的共享上下文（JSON格式，version字段为读取时的存储版本）"""
+        return self.store.load_context()
+    
+    def _save_context(self, context: Dict) -> bool:
+        """
+        整体保存共享上下文（调用方修改 _load_context 的结果后保存）
+        
+        context带有version时按版本比较并交换：读取后已被其他进程修改则不写入
+        需要保证成功的读-改-写请用 update_context() 或在 exclusive() 内完成
+        
+        Returns:
+            是否已写入
+        """
         try:
-            context["last_updated"] = datetime.now().isoformat()
-            with open(self.context_file, 'w', encoding='utf-8') as f:
-                json.dump(context, f, indent=2, ensure_ascii=False)
+            saved = self.store.save_context(context, expected_version=context.get("version"))
         except Exception as e:
             safe_print(f"⚠️ 保存共享上下文失败: {e}")
+            return False
+        if not saved:
+            safe_print("⚠️ 共享上下文已被其他进程修改，本次保存被拒绝")
+            return False
+        self.version += 1
+        return True
+    
+    @contextmanager
+    def exclusive(self):
+        """
+        持有本进程锁和跨进程锁执行多步读-改-写
+        
+        期间其他线程和进程的写操作都会等待，因此块内 _load_context() -> _save_context() 不会冲突
+        """
+        with self.lock, self.store.process_lock:
+            yield
+    
+    def update_context(self, mutate: Callable[[Dict], None], max_retries: int = 5) -> bool:
+        """
+        乐观并发地修改共享上下文：读取 -> mutate(context) -> 按版本比较并交换保存，冲突时重新读取重试
+        
+        Args:
+            mutate: 原地修改共享上下文的函数（重试时会对新读取的上下文再次调用）
+            max_retries: 最大重试次数
+        
+        Returns:
+            是否保存成功
+        """
+        for attempt in range(max_retries + 1):
+            context = self.store.load_context()
+            mutate(context)
+            if self.store.save_context(context, expected_version=context.get("version")):
+                self.version += 1
+                return True
+            if attempt < max_retries:
+                safe_print(f"⚠️ 共享上下文已被其他进程修改，重试 ({attempt + 1}/{max_retries})")
+                time.sleep(random.uniform(0.01, 0.05) * (attempt + 1))
+        safe_print("⚠️ 共享上下文保存冲突，已放弃本次修改")
+        return False
+    
+    def get_version(self) -> tuple:
+        """
+        获取共享上下文版本（进程内版本号 + 存储修订号）
+        
+        存储修订号（数据库修订计数 / JSON文件修改时间）用于感知其他进程对共享上下文的修改
+        """
+        return (self.version, self.store.revision())
+    
+    def history_index(self) -> List[Dict]:
+        """已归档历史的索引（id、时间范围、摘要；不含完整条目），未启用归档时为空"""
+        return self.archive.index() if self.archive else []
+    
+    def load_archived_history(self, ids: List[int] = None) -> List[Dict]:
+        """读取已归档的完整历史条目（ids为None时读取全部）"""
+        return self.archive.load(ids) if self.archive else []
+    
+    def export_json(self):
+        """把当前状态导出为JSON格式（<task>_stack.json + <task>_share_context.json）"""
+        if self.backend == "sqlite":
+            self.store.export_json(self.stack_file, self.context_file)
     
     def start_new_instruction(self, instruction: str) -> str:
         """
@@ -132,14 +226,6 @@ class HierarchyManager:
         """
         with self.lock:
             import hashlib
-            context = self._load_context()
-            
-            # ✅ 检查是否已存在相同指令（避免重复）
-            existing_instructions = context["current"].get("instructions", [])
-            for existing in existing_instructions:
-                if existing.get("instruction") == instruction:
-                    safe_print(f"ℹ️ 指令已存在，跳过添加: {instruction[:50]}...")
-                    return existing.get("instruction_id", "")
             
             # 生成指令ID
             content_for_hash = f"{self.task_id}|{instruction}"
@@ -147,15 +233,16 @@ class HierarchyManager:
             instruction_hash = hash_object.hexdigest()[:12]
             instruction_id = f"instruction_{instruction_hash}"
             
-            # 添加到current指令列表
-            instruction_entry = {
+            # 添加到current指令列表（✅ 已存在相同指令时跳过，避免重复）
+            existing_id = self.store.add_instruction({
                 "instruction": instruction,
                 "instruction_id": instruction_id,
                 "start_time": datetime.now().isoformat()
-            }
-            
-            context["current"]["instructions"].append(instruction_entry)
-            self._save_context(context)
+            })
+            if existing_id is not None:
+                safe_print(f"ℹ️ 指令已存在，跳过添加: {instruction[:50]}...")
+                return existing_id
+            self.version += 1
             
             safe_print(f"📝 新指令已添加: {instruction_id} -> {instruction[:50]}...")
             
@@ -181,64 +268,9 @@ class HierarchyManager:
             agent_hash = hash_object.hexdigest()[:12]
             agent_id = f"{agent_name}_{agent_hash}"
             
-            # 加载当前状态
-            stack = self._load_stack()
-            context = self._load_context()
-            
-            # 获取父Agent（栈顶）
-            parent_id = None
-            level = 0
-            if stack:
-                parent_id = stack[-1]["agent_id"]
-                level = stack[-1]["level"] + 1
-            
-            # 创建Agent栈条目
-            agent_entry = {
-                "agent_id": agent_id,
-                "agent_name": agent_name,
-                "parent_id": parent_id,
-                "level": level,
-                "user_input": user_input,
-                "start_time": datetime.now().isoformat()
-            }
-            
-            # 入栈
-            stack.append(agent_entry)
-            self._save_stack(stack)
-            
-            # 更新共享上下文
-            if agent_id not in context["current"]["hierarchy"]:
-                context["current"]["hierarchy"][agent_id] = {
-                    "parent": parent_id,
-                    "children": [],
-                    "level": level
-                }
-            
-            # 如果有父Agent，将当前Agent添加到父Agent的children列表
-            if parent_id and parent_id in context["current"]["hierarchy"]:
-                if agent_id not in context["current"]["hierarchy"][parent_id]["children"]:
-                    context["current"]["hierarchy"][parent_id]["children"].append(agent_id)
-            
-            # 更新Agent状态（不保存action_history，它保存在单独文件中）
-            context["current"]["agents_status"][agent_id] = {
-                "agent_name": agent_name,
-                "status": "running",
-                "initial_input": user_input,
-                "start_time": datetime.now().isoformat(),
-                "parent_id": parent_id,
-                "level": level,
-                "latest_thinking": ""  # 只保留最新的thinking
-            }
-            
-            # 记录时间历史
-            if "agent_time_history" not in context:
-                context["agent_time_history"] = {}
-            context["agent_time_history"][agent_id] = {
-                "start_time": datetime.now().isoformat(),
-                "end_time": None
-            }
-            
-            self._save_context(context)
+            # 入栈（父Agent为当前分支栈顶），并登记层级关系、Agent状态和时间历史
+            parent_id, level = self.store.push_agent(self.current_branch(), agent_id, agent_name, user_input)
+            self.version += 1
             
             safe_print(f"📚 Agent入栈: {agent_name} (ID: {agent_id}, Level: {level})")
             
@@ -253,29 +285,9 @@ class HierarchyManager:
             final_output: 最终输出内容
         """
         with self.lock:
-            stack = self._load_stack()
-            
-            # 从栈中移除
-            new_stack = [entry for entry in stack if entry["agent_id"] != agent_id]
-            self._save_stack(new_stack)
-            
-            # 更新共享上下文中的Agent状态
-            context = self._load_context()
-            if agent_id in context["current"]["agents_status"]:
-                end_time = datetime.now().isoformat()
-                context["current"]["agents_status"][agent_id]["status"] = "completed"
-                context["current"]["agents_status"][agent_id]["final_output"] = final_output
-                context["current"]["agents_status"][agent_id]["end_time"] = end_time
-                
-                # 删除latest_thinking（已完成的agent不需要thinking，只保留final_output）
-                if "latest_thinking" in context["current"]["agents_status"][agent_id]:
-                    del context["current"]["agents_status"][agent_id]["latest_thinking"]
-                
-                # 更新时间历史
-                if agent_id in context.get("agent_time_history", {}):
-                    context["agent_time_history"][agent_id]["end_time"] = end_time
-            
-            self._save_context(context)
+            # 从栈中移除，并在共享上下文中标记为completed
+            self.store.pop_agent(self.current_branch(), agent_id, final_output)
+            self.version += 1
             
             # 检查是否所有Agent都完成，如果是则移动current到history
             self._check_and_complete_if_all_done()
@@ -291,12 +303,8 @@ class HierarchyManager:
             thinking: thinking内容
         """
         with self.lock:
-            context = self._load_context()
-            
-            if agent_id in context["current"]["agents_status"]:
-                context["current"]["agents_status"][agent_id]["latest_thinking"] = thinking
-                context["current"]["agents_status"][agent_id]["thinking_updated_at"] = datetime.now().isoformat()
-                self._save_context(context)
+            if self.store.update_thinking(agent_id, thinking):
+                self.version += 1
     
     def add_action(self, agent_id: str, action: Dict):
         """
@@ -312,55 +320,29 @@ class HierarchyManager:
     
     def get_context(self) -> Dict:
         """获取完整的共享上下文"""
-        return self._load_context()
+        with self.lock:
+            return self._load_context()
     
     def _check_and_complete_if_all_done(self):
-        """检查是否所有Agent都完成，如果是则移动current到history"""
-        context = self._load_context()
-        current_agents = context.get("current", {}).get("agents_status", {})
-        
-        if not current_agents:
+        """检查是否所有Agent都完成，如果是则移动current到history（并清空栈）"""
+        if not self.store.archive_if_all_done():
             return
-        
-        # 检查是否所有Agent都已completed
-        all_completed = all(
-            agent_info.get("status") == "completed"
-            for agent_info in current_agents.values()
-        )
-        
-        if all_completed:
-            safe_print("🎉 所有Agent已完成，移动current到history")
-            
-            # 移动到history
-            history_entry = {
-                "instructions": context["current"]["instructions"].copy(),
-                "hierarchy": context["current"]["hierarchy"].copy(),
-                "agents_status": context["current"]["agents_status"].copy(),
-                "start_time": context["current"]["start_time"],
-                "completion_time": datetime.now().isoformat()
-            }
-            
-            context["history"].append(history_entry)
-            
-            # 清空current
-            context["current"] = {
-                "instructions": [],
-                "hierarchy": {},
-                "agents_status": {},
-                "start_time": datetime.now().isoformat(),
-                "last_updated": datetime.now().isoformat()
-            }
-            
-            # 清空栈
-            self._save_stack([])
-            
-            self._save_context(context)
-            safe_print("✅ 任务已归档到history")
+        self.version += 1
+        safe_print("🎉 所有Agent已完成，移动current到history")
+        if self.export_on_archive:
+            self.export_json()
+        safe_print("✅ 任务已归档到history")
     
     def get_current_agent_id(self) -> Optional[str]:
-        """获取当前栈顶的Agent ID"""
-        stack = self._load_stack()
+        """获取当前分支栈顶的Agent ID"""
+        with self.lock:
+            stack = self._load_stack()
         return stack[-1]["agent_id"] if stack else None
+    
+    def get_agent_level(self, agent_id: str) -> int:
+        """获取Agent在调用树中的层级（顶层Agent为0）"""
+        with self.lock:
+            return self.store.get_agent_level(agent_id)
 
 
 # 全局管理器缓存
@@ -0,0 +1,850 @@
+#!/usr/bin/env python3
+from utils.windows_compat import safe_print
+# -*- coding: utf-8 -*-
+"""
+层级存储 - HierarchyManager 的可插拔存储后端
+
+后端（runtime_config.yaml hierarchy_store.backend）：
+- sqlite: <task>_hierarchy.db（WAL模式），栈条目、Agent状态、层级关系、指令、历史各为一行，
+          更新只改动相关的行，读取走主键/索引
+- json: <task>_stack.json + <task>_share_context.json，每次更新整体读写（旧格式）
+
+JSON格式同时是导出格式：SQLite后端可随时导出为原来的两个JSON文件
+
+历史归档：配置了 HistoryArchive 时，history 只保留最近 hot_history 条，
+更早的条目在保存时移入归档分段文件（见 core/history_archive.py）
+
+多进程安全：所有写操作持有 <task>_hierarchy.lock 上的跨进程咨询锁；整体保存共享上下文时
+按版本号做比较并交换（读取时的版本与当前版本不一致则拒绝写入，由调用方重新读取重试）
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from core.history_archive import HistoryArchive
+
+
+MAIN_BRANCH = "main"
+
+
+class ProcessLock:
+    """跨进程咨询锁（POSIX flock / Windows msvcrt.locking），同一进程内可重入"""
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._file = None
+    
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, 'a+')
+                self._acquire_file(self._file)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return self
+    
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                self._release_file(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+        self._rlock.release()
+    
+    @staticmethod
+    def _acquire_file(f):
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # 内部重试约10秒后抛出
+                    return
+                except OSError:
+                    time.sleep(0.1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    
+    @staticmethod
+    def _release_file(f):
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _with_process_lock(method):
+    """存储方法装饰器：读-改-写期间持有跨进程锁"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.process_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class _VersionConflict(Exception):
+    """比较并交换失败（用于回滚SQLite事务）"""
+
+
+def _write_json(path: Path, data: Dict):
+    """原子写入JSON（先写临时文件再替换，其他进程不会读到写了一半的文件）"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def empty_current() -> Dict:
+    """空的 current 部分"""
+    now = datetime.now().isoformat()
+    return {
+        "instructions": [],
+        "hierarchy": {},
+        "agents_status": {},
+        "start_time": now,
+        "last_updated": now
+    }
+
+
+def archive_entry(current: Dict) -> Dict:
+    """把 current 归档为一条 history 记录"""
+    return {
+        "instructions": current.get("instructions", []).copy(),
+        "hierarchy": current.get("hierarchy", {}).copy(),
+        "agents_status": current.get("agents_status", {}).copy(),
+        "start_time": current.get("start_time"),
+        "completion_time": datetime.now().isoformat()
+    }
+
+
+class JsonHierarchyStore:
+    """JSON文件存储（每次操作读写整个栈文件和共享上下文文件）"""
+    
+    def __init__(self, task_id: str, stack_file: Path, context_file: Path, lock_file: Path = None,
+                 archive: HistoryArchive = None, hot_history: int = 10):
+        self.task_id = task_id
+        self.stack_file = stack_file
+        self.context_file = context_file
+        self.process_lock = ProcessLock(lock_file or context_file.with_name(context_file.name + ".lock"))
+        self.archive = archive
+        self.hot_history = max(0, int(hot_history))
+        self._initialize_files()
+    
+    def _initialize_files(self):
+        """初始化栈文件和共享上下文文件"""
+        with self.process_lock:
+            if not self.stack_file.exists():
+                _write_json(self.stack_file, {
+                    "stack": [],
+                    "created_at": datetime.now().isoformat()
+                })
+            
+            if not self.context_file.exists():
+                _write_json(self.context_file, {
+                    "task_id": self.task_id,
+                    "version": 0,
+                    "current": empty_current(),
+                    "agent_time_history": {},
+                    "history": [],
+                    "history_offset": 0,
+                    "created_at": datetime.now().isoformat(),
+                    "last_updated": datetime.now().isoformat()
+                })
+    
+    def revision(self):
+        """存储修订号（文件修改时间，用于感知其他进程的修改）"""
+        try:
+            return self.context_file.stat().st_mtime_ns
+        except OSError:
+            return 0
+    
+    # ---------------- 栈 ----------------
+    
+    def load_branches(self) -> Dict[str, List[Dict]]:
+        """加载所有分支的栈（主分支保存在 stack 字段，兼容旧格式）"""
+        try:
+            with open(self.stack_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            branches = dict(data.get("branches", {}))
+            branches[MAIN_BRANCH] = data.get("stack", [])
+            return branches
+        except Exception as e:
+            safe_print(f"⚠️ 加载栈文件失败: {e}")
+            return {MAIN_BRANCH: []}
+    
+    def save_branches(self, branches: Dict[str, List[Dict]]):
+        """保存所有分支的栈"""
+        try:
+            data = {
+                "stack": branches.get(MAIN_BRANCH, []),
+                "last_updated": datetime.now().isoformat()
+            }
+            other_branches = {k: v for k, v in branches.items() if k != MAIN_BRANCH}
+            if other_branches:
+                data["branches"] = other_branches
+            with self.process_lock:
+                _write_json(self.stack_file, data)
+        except Exception as e:
+            safe_print(f"⚠️ 保存栈文件失败: {e}")
+    
+    def get_stack(self, branch: str) -> List[Dict]:
+        return self.load_branches().get(branch, [])
+    
+    def set_stack(self, branch: str, stack: List[Dict]):
+        with self.process_lock:
+            branches = self.load_branches()
+            branches[branch] = stack
+            self.save_branches(branches)
+    
+    def fork_branch(self, parent_branch: str, branch_id: str):
+        with self.process_lock:
+            branches = self.load_branches()
+            branches[branch_id] = [dict(entry) for entry in branches.get(parent_branch, [])]
+            self.save_branches(branches)
+    
+    def delete_branch(self, branch_id: str):
+        with self.process_lock:
+            branches = self.load_branches()
+            if branch_id in branches:
+                del branches[branch_id]
+                self.save_branches(branches)
+    
+    # ---------------- 共享上下文 ----------------
+    
+    def load_context(self) -> Dict:
+        """加载共享上下文"""
+        try:
+            with open(self.context_file, 'r', encoding='utf-8') as f:
+                return self._drop_archived(json.load(f))
+        except Exception as e:
+            safe_print(f"⚠️ 加载共享上下文失败: {e}")
+            return {
+                "task_id": self.task_id,
+                "current": {
+                    "instructions": [],
+                    "hierarchy": {},
+                    "agents_status": {}
+                },
+                "agent_time_history": {},
+                "history": []
+            }
+    
+    def save_context(self, context: Dict, expected_version: int = None) -> bool:
+        """
+        保存共享上下文（版本号递增）
+        
+        Args:
+            context: 共享上下文
+            expected_version: 读取时的版本号；给出时与当前版本比较，不一致（已被其他进程修改）则不写入
+        
+        Returns:
+            是否已写入
+        """
+        with self.process_lock:
+            try:
+                current_version = self.load_context().get("version", 0) if self.context_file.exists() else 0
+                if expected_version is not None and current_version != expected_version:
+                    return False
+                context["version"] = current_version + 1
+                context["last_updated"] = datetime.now().isoformat()
+                self._spill_history(context)
+                _write_json(self.context_file, context)
+            except Exception as e:
+                safe_print(f"⚠️ 保存共享上下文失败: {e}")
+                return False
+        return True
+    
+    def _drop_archived(self, context: Dict) -> Dict:
+        """
+        去掉已归档但仍留在文件中的历史条目（归档后、写入上下文文件前中断的情况）
+        
+        history_offset 为 history 第一条之前的条目数，history[i] 的条目ID为 history_offset + i + 1
+        """
+        if self.archive is None:
+            return context
+        last_id = self.archive.last_id()
+        # 没有该字段的文件：已归档的条目都已从文件中移除
+        offset = context.get("history_offset", last_id)
+        if last_id > offset:
+            context["history"] = context.get("history", [])[last_id - offset:]
+            offset = last_id
+        context["history_offset"] = offset
+        return context
+    
+    def _spill_history(self, context: Dict):
+        """把超出 hot_history 的最早历史条目移入归档（按条目ID去重，重试不会重复归档）"""
+        history = context.get("history", [])
+        cut = len(history) - self.hot_history
+        if self.archive is None or cut <= 0:
+            return
+        offset = context.get("history_offset", self.archive.last_id())
+        self.archive.append(history[:cut], ids=[offset + i + 1 for i in range(cut)])
+        context["history"] = history[cut:]
+        context["history_offset"] = offset + cut
+    
+    def load_current(self) -> Dict:
+        return self.load_context().get("current", {})
+    
+    def add_instruction(self, entry: Dict) -> Optional[str]:
+        """添加指令（已存在相同指令时不添加，返回已有指令ID）"""
+        with self.process_lock:
+            context = self.load_context()
+            for existing in context["current"].get("instructions", []):
+                if existing.get("instruction") == entry["instruction"]:
+                    return existing.get("instruction_id", "")
+            context["current"]["instructions"].append(entry)
+            self.save_context(context)
+            return None
+    
+    @_with_process_lock
+    def push_agent(self, branch: str, agent_id: str, agent_name: str, user_input: str) -> Tuple[Optional[str], int]:
+        """
+        Agent入栈并登记到共享上下文
+        
+        Returns:
+            (父Agent ID, 层级)
+        """
+        stack = self.get_stack(branch)
+        context = self.load_context()
+        
+        # 获取父Agent（栈顶）
+        parent_id = None
+        level = 0
+        if stack:
+            parent_id = stack[-1]["agent_id"]
+            level = stack[-1]["level"] + 1
+        
+        now = datetime.now().isoformat()
+        stack.append({
+            "agent_id": agent_id,
+            "agent_name": agent_name,
+            "parent_id": parent_id,
+            "level": level,
+            "user_input": user_input,
+            "start_time": now
+        })
+        self.set_stack(branch, stack)
+        
+        hierarchy = context["current"]["hierarchy"]
+        if agent_id not in hierarchy:
+            hierarchy[agent_id] = {"parent": parent_id, "children": [], "level": level}
+        # 如果有父Agent，将当前Agent添加到父Agent的children列表
+        if parent_id and parent_id in hierarchy and agent_id not in hierarchy[parent_id]["children"]:
+            hierarchy[parent_id]["children"].append(agent_id)
+        
+        # Agent状态（不保存action_history，它保存在单独文件中）
+        context["current"]["agents_status"][agent_id] = {
+            "agent_name": agent_name,
+            "status": "running",
+            "initial_input": user_input,
+            "start_time": now,
+            "parent_id": parent_id,
+            "level": level,
+            "latest_thinking": ""  # 只保留最新的thinking
+        }
+        context.setdefault("agent_time_history", {})[agent_id] = {"start_time": now, "end_time": None}
+        self.save_context(context)
+        return parent_id, level
+    
+    @_with_process_lock
+    def pop_agent(self, branch: str, agent_id: str, final_output: str):
+        """Agent出栈并标记为completed"""
+        stack = self.get_stack(branch)
+        self.set_stack(branch, [entry for entry in stack if entry["agent_id"] != agent_id])
+        
+        context = self.load_context()
+        status = context["current"]["agents_status"].get(agent_id)
+        if status is not None:
+            end_time = datetime.now().isoformat()
+            status["status"] = "completed"
+            status["final_output"] = final_output
+            status["end_time"] = end_time
+            # 已完成的agent不需要thinking，只保留final_output
+            status.pop("latest_thinking", None)
+            if agent_id in context.get("agent_time_history", {}):
+                context["agent_time_history"][agent_id]["end_time"] = end_time
+        self.save_context(context)
+    
+    @_with_process_lock
+    def update_thinking(self, agent_id: str, thinking: str) -> bool:
+        context = self.load_context()
+        status = context["current"]["agents_status"].get(agent_id)
+        if status is None:
+            return False
+        status["latest_thinking"] = thinking
+        status["thinking_updated_at"] = datetime.now().isoformat()
+        self.save_context(context)
+        return True
+    
+    @_with_process_lock
+    def archive_if_all_done(self) -> bool:
+        """所有Agent都已completed时把current移到history并清空栈"""
+        context = self.load_context()
+        current_agents = context.get("current", {}).get("agents_status", {})
+        if not current_agents or not all(info.get("status") == "completed" for info in current_agents.values()):
+            return False
+        context["history"].append(archive_entry(context["current"]))
+        context["current"] = empty_current()
+        self.save_branches({MAIN_BRANCH: []})
+        self.save_context(context)
+        return True
+    
+    def get_agent_level(self, agent_id: str) -> int:
+        return self.load_current().get("hierarchy", {}).get(agent_id, {}).get("level", 0)
+
+
+class SqliteHierarchyStore:
+    """
+    SQLite存储（WAL模式）
+    
+    表：stack（分支栈条目）、hierarchy / edges（调用树）、agents（Agent状态）、
+    instructions、agent_times、history（每次归档一行）、current_meta（current的其他字段）、meta（修订号）
+    每次写操作在一个 BEGIN IMMEDIATE 事务中完成并递增修订号
+    """
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS stack (
+        branch TEXT NOT NULL, position INTEGER NOT NULL, agent_id TEXT NOT NULL, entry TEXT NOT NULL,
+        PRIMARY KEY (branch, position)
+    );
+    CREATE TABLE IF NOT EXISTS hierarchy (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, agent_id TEXT UNIQUE NOT NULL, parent_id TEXT, level INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS edges (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, parent_id TEXT NOT NULL, child_id TEXT NOT NULL,
+        UNIQUE (parent_id, child_id)
+    );
+    CREATE TABLE IF NOT EXISTS agents (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, agent_id TEXT UNIQUE NOT NULL, status TEXT, info TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS agents_status ON agents (status);
+    CREATE TABLE IF NOT EXISTS instructions (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, instruction_id TEXT, instruction TEXT NOT NULL, entry TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS instructions_text ON instructions (instruction);
+    CREATE TABLE IF NOT EXISTS agent_times (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, agent_id TEXT UNIQUE NOT NULL, start_time TEXT, end_time TEXT
+    );
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, start_time TEXT, completion_time TEXT, entry TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS current_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+    
+    def __init__(self, task_id: str, db_file: Path, import_from: JsonHierarchyStore = None, lock_file: Path = None,
+                 archive: HistoryArchive = None, hot_history: int = 10):
+        """
+        Args:
+            task_id: 任务ID
+            db_file: 数据库文件
+            import_from: 数据库新建时从中导入已有状态的JSON存储（文件存在时）
+            lock_file: 跨进程锁文件（默认 <db_file>.lock）
+            archive: 历史归档（None表示history全部保存在数据库中）
+            hot_history: 使用归档时数据库中保留的最近历史条数
+        """
+        self.task_id = task_id
+        self.db_file = db_file
+        self.lock = threading.RLock()
+        self.process_lock = ProcessLock(lock_file or db_file.with_name(db_file.name + ".lock"))
+        self.archive = archive
+        self.hot_history = max(0, int(hot_history))
+        is_new = not db_file.exists()
+        
+        # 一个连接由本进程内所有线程共享（由self.lock串行化）；跨进程由SQLite锁协调
+        self.conn = sqlite3.connect(str(db_file), timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        
+        with self._transaction() as cur:
+            cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('created_at', ?)", (datetime.now().isoformat(),))
+            cur.execute("INSERT OR IGNORE INTO current_meta (key, value) VALUES ('start_time', ?)",
+                        (json.dumps(datetime.now().isoformat()),))
+        
+        if is_new and import_from is not None:
+            self._import(import_from)
+    
+    def _import(self, source: JsonHierarchyStore):
+        """导入JSON存储中的已有状态"""
+        context = source.load_context()
+        branches = source.load_branches()
+        if not context.get("history") and not context.get("current", {}).get("agents_status") \
+                and not any(branches.values()):
+            return
+        self.save_context(context)
+        for branch, stack in branches.items():
+            self.set_stack(branch, stack)
+        safe_print(f"📦 已从JSON导入层级状态: {len(context.get('history', []))} 条历史")
+    
+    @contextmanager
+    def _transaction(self):
+        """写事务（先取跨进程锁再 BEGIN IMMEDIATE 获取写锁，提交前递增修订号）"""
+        with self.process_lock, self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+                cur.execute(
+                    "INSERT INTO meta (key, value) VALUES ('revision', '1') "
+                    "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+                )
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+    
+    def revision(self):
+        """存储修订号（每次写事务递增，其他进程的写入同样可见）"""
+        rows = self._query("SELECT value FROM meta WHERE key = 'revision'")
+        return int(rows[0][0]) if rows else 0
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+    
+    # ---------------- 栈 ----------------
+    
+    def load_branches(self) -> Dict[str, List[Dict]]:
+        branches = {MAIN_BRANCH: []}
+        for branch, entry in self._query("SELECT branch, entry FROM stack ORDER BY branch, position"):
+            branches.setdefault(branch, []).append(json.loads(entry))
+        return branches
+    
+    def save_branches(self, branches: Dict[str, List[Dict]]):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM stack")
+            for branch, stack in branches.items():
+                self._insert_stack(cur, branch, stack)
+    
+    @staticmethod
+    def _insert_stack(cur, branch: str, stack: List[Dict]):
+        cur.executemany(
+            "INSERT INTO stack (branch, position, agent_id, entry) VALUES (?, ?, ?, ?)",
+            [(branch, i, entry["agent_id"], json.dumps(entry, ensure_ascii=False)) for i, entry in enumerate(stack)]
+        )
+    
+    def get_stack(self, branch: str) -> List[Dict]:
+        rows = self._query("SELECT entry FROM stack WHERE branch = ? ORDER BY position", (branch,))
+        return [json.loads(entry) for (entry,) in rows]
+    
+    def set_stack(self, branch: str, stack: List[Dict]):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM stack WHERE branch = ?", (branch,))
+            self._insert_stack(cur, branch, stack)
+    
+    def fork_branch(self, parent_branch: str, branch_id: str):
+        with self._transaction() as cur:
+            cur.execute(
+                "INSERT INTO stack (branch, position, agent_id, entry) "
+                "SELECT ?, position, agent_id, entry FROM stack WHERE branch = ?",
+                (branch_id, parent_branch)
+            )
+    
+    def delete_branch(self, branch_id: str):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM stack WHERE branch = ?", (branch_id,))
+    
+    # ---------------- 共享上下文 ----------------
+    
+    def load_current(self) -> Dict:
+        """读取 current 部分（与JSON格式相同）"""
+        with self.lock:
+            current = {key: json.loads(value) for key, value in
+                       self.conn.execute("SELECT key, value FROM current_meta")}
+            current["instructions"] = [json.loads(entry) for (entry,) in
+                                       self.conn.execute("SELECT entry FROM instructions ORDER BY seq")]
+            children = {}
+            for parent_id, child_id in self.conn.execute("SELECT parent_id, child_id FROM edges ORDER BY seq"):
+                children.setdefault(parent_id, []).append(child_id)
+            current["hierarchy"] = {
+                agent_id: {"parent": parent_id, "children": children.get(agent_id, []), "level": level}
+                for agent_id, parent_id, level in
+                self.conn.execute("SELECT agent_id, parent_id, level FROM hierarchy ORDER BY seq")
+            }
+            current["agents_status"] = {agent_id: json.loads(info) for agent_id, info in
+                                        self.conn.execute("SELECT agent_id, info FROM agents ORDER BY seq")}
+        return current
+    
+    def _archived_through(self) -> int:
+        """已归档的最大历史行ID（行ID即历史条目的序号；没有归档时为0）"""
+        return self.archive.last_id() if self.archive is not None else 0
+    
+    def load_history(self) -> List[Dict]:
+        """未归档的历史（已归档但因事务回滚尚未删除的行不返回）"""
+        rows = self._query("SELECT entry FROM history WHERE id > ? ORDER BY id", (self._archived_through(),))
+        return [json.loads(entry) for (entry,) in rows]
+    
+    def load_context(self) -> Dict:
+        """读取完整的共享上下文（JSON导出格式，version为读取前的修订号）"""
+        with self.lock:
+            meta = dict(self._query("SELECT key, value FROM meta"))
+            times = self._query("SELECT agent_id, start_time, end_time FROM agent_times ORDER BY seq")
+            return {
+                "task_id": self.task_id,
+                "version": int(meta.get("revision", 0)),
+                "current": self.load_current(),
+                "agent_time_history": {agent_id: {"start_time": start, "end_time": end} for agent_id, start, end in times},
+                "history": self.load_history(),
+                "created_at": meta.get("created_at"),
+                "last_updated": meta.get("last_updated")
+            }
+    
+    def save_context(self, context: Dict, expected_version: int = None) -> bool:
+        """
+        整体写入共享上下文（兼容调用方直接修改后保存的用法）
+        
+        history按顺序与已存储的行匹配：匹配的行保留，不在传入列表中的行删除，其余条目追加
+        
+        Args:
+            context: 共享上下文
+            expected_version: 读取时的修订号；给出时与当前修订号比较，不一致则回滚不写入
+        
+        Returns:
+            是否已写入
+        """
+        current = context.get("current", {})
+        try:
+            with self._transaction() as cur:
+                if expected_version is not None:
+                    row = cur.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+                    if (int(row[0]) if row else 0) != expected_version:
+                        raise _VersionConflict()
+                self._write_context(cur, context, current)
+        except _VersionConflict:
+            return False
+        return True
+    
+    def _write_context(self, cur, context: Dict, current: Dict):
+        """在事务内写入current、agent时间与新增的history"""
+        self._replace_current(cur, current)
+        cur.execute("DELETE FROM agent_times")
+        cur.executemany(
+            "INSERT INTO agent_times (agent_id, start_time, end_time) VALUES (?, ?, ?)",
+            [(agent_id, t.get("start_time"), t.get("end_time"))
+             for agent_id, t in context.get("agent_time_history", {}).items()]
+        )
+        history = context.get("history", [])
+        texts = [json.dumps(entry, ensure_ascii=False) for entry in history]
+        matched, stale = 0, []
+        for row_id, text in cur.execute("SELECT id, entry FROM history WHERE id > ? ORDER BY id",
+                                        (self._archived_through(),)).fetchall():
+            if matched < len(texts) and text == texts[matched]:
+                matched += 1
+            else:
+                stale.append((row_id,))
+        cur.executemany("DELETE FROM history WHERE id = ?", stale)
+        self._append_history(cur, history[matched:])
+        self._spill_history(cur)
+        self._touch(cur)
+    
+    def _replace_current(self, cur, current: Dict):
+        """用传入的 current 替换当前的所有行"""
+        for table in ("instructions", "hierarchy", "edges", "agents", "current_meta"):
+            cur.execute(f"DELETE FROM {table}")
+        cur.executemany(
+            "INSERT INTO instructions (instruction_id, instruction, entry) VALUES (?, ?, ?)",
+            [(entry.get("instruction_id"), entry.get("instruction", ""), json.dumps(entry, ensure_ascii=False))
+             for entry in current.get("instructions", [])]
+        )
+        for agent_id, node in current.get("hierarchy", {}).items():
+            cur.execute("INSERT INTO hierarchy (agent_id, parent_id, level) VALUES (?, ?, ?)",
+                        (agent_id, node.get("parent"), node.get("level", 0)))
+            cur.executemany("INSERT OR IGNORE INTO edges (parent_id, child_id) VALUES (?, ?)",
+                            [(agent_id, child) for child in node.get("children", [])])
+        cur.executemany(
+            "INSERT INTO agents (agent_id, status, info) VALUES (?, ?, ?)",
+            [(agent_id, info.get("status"), json.dumps(info, ensure_ascii=False))
+             for agent_id, info in current.get("agents_status", {}).items()]
+        )
+        cur.executemany(
+            "INSERT INTO current_meta (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in current.items()
+             if key not in ("instructions", "hierarchy", "agents_status")]
+        )
+    
+    def _spill_history(self, cur):
+        """
+        把超出 hot_history 的最早历史行移入归档，然后删除已归档的行
+        
+        归档按行ID去重：事务回滚时分段文件中已写入的条目不会在重试时重复归档
+        （这些行在删除前由 load_history 过滤）
+        """
+        if self.archive is None:
+            return
+        archived_through = self.archive.last_id()
+        rows = cur.execute("SELECT id, entry FROM history WHERE id > ? ORDER BY id", (archived_through,)).fetchall()
+        cut = len(rows) - self.hot_history
+        if cut > 0:
+            self.archive.append([json.loads(entry) for _, entry in rows[:cut]], ids=[row_id for row_id, _ in rows[:cut]])
+            archived_through = rows[cut - 1][0]
+        if archived_through:
+            cur.execute("DELETE FROM history WHERE id <= ?", (archived_through,))
+    
+    def _append_history(self, cur, entries: List[Dict]):
+        """追加历史行（行ID接在已有行和已归档条目之后，作为条目序号）"""
+        if not entries:
+            return
+        max_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM history").fetchone()[0]
+        next_id = max(max_id, self._archived_through()) + 1
+        cur.executemany(
+            "INSERT INTO history (id, start_time, completion_time, entry) VALUES (?, ?, ?, ?)",
+            [(next_id + i, entry.get("start_time"), entry.get("completion_time"), json.dumps(entry, ensure_ascii=False))
+             for i, entry in enumerate(entries)]
+        )
+    
+    @staticmethod
+    def _touch(cur):
+        now = datetime.now().isoformat()
+        cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_updated', ?)", (now,))
+        cur.execute("INSERT OR REPLACE INTO current_meta (key, value) VALUES ('last_updated', ?)", (json.dumps(now),))
+    
+    def add_instruction(self, entry: Dict) -> Optional[str]:
+        """添加指令（已存在相同指令时不添加，返回已有指令ID）"""
+        with self._transaction() as cur:
+            row = cur.execute("SELECT instruction_id FROM instructions WHERE instruction = ? LIMIT 1",
+                              (entry["instruction"],)).fetchone()
+            if row is not None:
+                return row[0] or ""
+            cur.execute("INSERT INTO instructions (instruction_id, instruction, entry) VALUES (?, ?, ?)",
+                        (entry["instruction_id"], entry["instruction"], json.dumps(entry, ensure_ascii=False)))
+            self._touch(cur)
+            return None
+    
+    def push_agent(self, branch: str, agent_id: str, agent_name: str, user_input: str) -> Tuple[Optional[str], int]:
+        """
+        Agent入栈并登记到共享上下文（一个事务内完成）
+        
+        Returns:
+            (父Agent ID, 层级)
+        """
+        now = datetime.now().isoformat()
+        with self._transaction() as cur:
+            top = cur.execute("SELECT position, entry FROM stack WHERE branch = ? ORDER BY position DESC LIMIT 1",
+                              (branch,)).fetchone()
+            parent_id, level, position = None, 0, 0
+            if top is not None:
+                parent = json.loads(top[1])
+                parent_id, level, position = parent["agent_id"], parent["level"] + 1, top[0] + 1
+            
+            entry = {
+                "agent_id": agent_id,
+                "agent_name": agent_name,
+                "parent_id": parent_id,
+                "level": level,
+                "user_input": user_input,
+                "start_time": now
+            }
+            cur.execute("INSERT INTO stack (branch, position, agent_id, entry) VALUES (?, ?, ?, ?)",
+                        (branch, position, agent_id, json.dumps(entry, ensure_ascii=False)))
+            
+            cur.execute("INSERT OR IGNORE INTO hierarchy (agent_id, parent_id, level) VALUES (?, ?, ?)",
+                        (agent_id, parent_id, level))
+            if parent_id and cur.execute("SELECT 1 FROM hierarchy WHERE agent_id = ?", (parent_id,)).fetchone():
+                cur.execute("INSERT OR IGNORE INTO edges (parent_id, child_id) VALUES (?, ?)", (parent_id, agent_id))
+            
+            info = {
+                "agent_name": agent_name,
+                "status": "running",
+                "initial_input": user_input,
+                "start_time": now,
+                "parent_id": parent_id,
+                "level": level,
+                "latest_thinking": ""
+            }
+            # 重新入栈的Agent（续跑）替换原状态，保持原来的顺序
+            cur.execute(
+                "INSERT INTO agents (agent_id, status, info) VALUES (?, ?, ?) "
+                "ON CONFLICT(agent_id) DO UPDATE SET status = excluded.status, info = excluded.info",
+                (agent_id, "running", json.dumps(info, ensure_ascii=False))
+            )
+            cur.execute(
+                "INSERT INTO agent_times (agent_id, start_time, end_time) VALUES (?, ?, NULL) "
+                "ON CONFLICT(agent_id) DO UPDATE SET start_time = excluded.start_time, end_time = NULL",
+                (agent_id, now)
+            )
+            self._touch(cur)
+        return parent_id, level
+    
+    def pop_agent(self, branch: str, agent_id: str, final_output: str):
+        """Agent出栈并标记为completed"""
+        end_time = datetime.now().isoformat()
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM stack WHERE branch = ? AND agent_id = ?", (branch, agent_id))
+            row = cur.execute("SELECT info FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+            if row is not None:
+                info = json.loads(row[0])
+                info["status"] = "completed"
+                info["final_output"] = final_output
+                info["end_time"] = end_time
+                info.pop("latest_thinking", None)
+                cur.execute("UPDATE agents SET status = 'completed', info = ? WHERE agent_id = ?",
+                            (json.dumps(info, ensure_ascii=False), agent_id))
+                cur.execute("UPDATE agent_times SET end_time = ? WHERE agent_id = ?", (end_time, agent_id))
+            self._touch(cur)
+    
+    def update_thinking(self, agent_id: str, thinking: str) -> bool:
+        with self._transaction() as cur:
+            row = cur.execute("SELECT info FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+            if row is None:
+                return False
+            info = json.loads(row[0])
+            info["latest_thinking"] = thinking
+            info["thinking_updated_at"] = datetime.now().isoformat()
+            cur.execute("UPDATE agents SET info = ? WHERE agent_id = ?", (json.dumps(info, ensure_ascii=False), agent_id))
+            self._touch(cur)
+            return True
+    
+    def archive_if_all_done(self) -> bool:
+        """所有Agent都已completed时把current移到history并清空栈"""
+        with self._transaction() as cur:
+            total, running = cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(status IS NOT 'completed'), 0) FROM agents"
+            ).fetchone()
+            if not total or running:
+                return False
+            self._append_history(cur, [archive_entry(self.load_current())])
+            self._spill_history(cur)
+            self._replace_current(cur, empty_current())
+            cur.execute("DELETE FROM stack")
+            self._touch(cur)
+            return True
+    
+    def get_agent_level(self, agent_id: str) -> int:
+        rows = self._query("SELECT level FROM hierarchy WHERE agent_id = ?", (agent_id,))
+        return rows[0][0] if rows else 0
+    
+    def export_json(self, stack_file: Path, context_file: Path):
+        """导出为JSON格式（<task>_stack.json + <task>_share_context.json）"""
+        exporter = JsonHierarchyStore.__new__(JsonHierarchyStore)
+        exporter.task_id, exporter.stack_file, exporter.context_file = self.task_id, stack_file, context_file
+        exporter.process_lock = self.process_lock
+        exporter.archive, exporter.hot_history = None, 0
+        exporter.save_branches(self.load_branches())
+        exporter.save_context(self.load_context())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史归档分段 - 把已完成指令的历史条目移出共享上下文
+
+共享上下文（share_context.json / hierarchy.db）只保留 current 和最近的若干条 history，
+更早的条目追加写入 ~/mla_v3/conversations/<task>_history/ 下的分段文件：
+    segment_00001.jsonl ...   每行一个完整的历史条目（只追加，写满 segment_size 条后换下一段）
+    index.json                已归档的ID范围（first_id / last_id），以及每个条目一行摘要：
+                              id、时间范围、用户输入与顶层Agent输出的摘要、所在分段及字节偏移
+                              （需要完整条目时按偏移直接读取）
+
+条目ID是历史条目在整个任务中的序号（由存储后端给出，递增）。追加时跳过不大于 last_id 的条目，
+因此存储后端在归档后、移除共享上下文中的条目前失败（事务回滚、进程崩溃）时，重试不会重复归档。
+
+这样每一轮读取共享上下文的开销不随工作空间累计的任务数增长。
+写入由存储后端在跨进程锁内调用，本模块不再单独加锁。
+"""
+
+import os
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# 索引中摘要字段的最大长度
+SUMMARY_CHARS = 300
+
+
+def summarize_entry(entry: Dict) -> Dict:
+    """
+    生成历史条目的索引摘要（用户输入 + 顶层Agent的最终输出，均截断）
+    
+    Args:
+        entry: 历史条目（archive_entry 的结果）
+    
+    Returns:
+        {"instructions": [...], "agents": [{"agent_name", "status", "final_output"}]}
+    """
+    instructions = [instr.get("instruction", "")[:SUMMARY_CHARS] for instr in entry.get("instructions", [])]
+    agents = []
+    for info in entry.get("agents_status", {}).values():
+        if info.get("level") == 0:
+            agents.append({
+                "agent_name": info.get("agent_name", ""),
+                "status": info.get("status", ""),
+                "final_output": (info.get("final_output") or "")[:SUMMARY_CHARS]
+            })
+    return {"instructions": instructions, "agents": agents}
+
+
+class HistoryArchive:
+    """一个任务的历史归档（分段文件 + 索引）"""
+    
+    def __init__(self, archive_dir: Path, segment_size: int = 50):
+        """
+        Args:
+            archive_dir: 归档目录（<task>_history）
+            segment_size: 每个分段文件的条目数
+        """
+        self.archive_dir = archive_dir
+        self.index_file = archive_dir / "index.json"
+        self.segment_size = max(1, int(segment_size))
+        self._index_cache = None  # ((index.json 的 mtime_ns, size), 索引文件内容)
+    
+    def _read_index(self) -> Dict:
+        """读取索引文件（文件未变化时使用缓存）"""
+        try:
+            stat = self.index_file.stat()
+        except FileNotFoundError:
+            return {}
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self._index_cache is None or self._index_cache[0] != key:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self._index_cache = (key, json.load(f))
+        return self._index_cache[1]
+    
+    def index(self) -> List[Dict]:
+        """读取索引条目"""
+        return self._read_index().get("entries", [])
+    
+    def count(self) -> int:
+        """已归档的条目数"""
+        return len(self.index())
+    
+    def last_id(self) -> int:
+        """已归档的最大条目ID（没有归档时为0）"""
+        data = self._read_index()
+        entries = data.get("entries", [])
+        return data.get("last_id", entries[-1]["id"] if entries else 0)
+    
+    def append(self, entries: List[Dict], ids: List[int] = None) -> List[int]:
+        """
+        追加历史条目（调用方持有跨进程锁）
+        
+        先写分段文件再原子替换索引：中途失败时索引中不会出现读不到的条目；
+        ID不大于 last_id 的条目已经归档过，直接跳过
+        
+        Args:
+            entries: 历史条目
+            ids: 各条目的ID（递增）；None表示紧接 last_id 连续编号
+        
+        Returns:
+            本次新归档的条目ID
+        """
+        last_id = self.last_id()
+        if ids is None:
+            ids = range(last_id + 1, last_id + 1 + len(entries))
+        items = [(entry_id, entry) for entry_id, entry in zip(ids, entries) if entry_id > last_id]
+        if not items:
+            return []
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        index = list(self.index())
+        new_ids = []
+        for entry_id, entry in items:
+            segment = f"segment_{len(index) // self.segment_size + 1:05d}.jsonl"
+            line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+            with open(self.archive_dir / segment, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+            index.append({
+                "id": entry_id,
+                "start_time": entry.get("start_time", ""),
+                "completion_time": entry.get("completion_time", ""),
+                "summary": summarize_entry(entry),
+                "segment": segment,
+                "offset": offset,
+                "length": len(line)
+            })
+            new_ids.append(entry_id)
+        
+        tmp_path = self.index_file.with_name(f"index.json.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "segment_size": self.segment_size,
+                "first_id": index[0]["id"],
+                "last_id": index[-1]["id"],
+                "entries": index
+            }, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.index_file)
+        self._index_cache = None
+        return new_ids
+    
+    def load(self, ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        读取完整的历史条目（按偏移直接读取，不扫描整个分段）
+        
+        Args:
+            ids: 条目ID列表，None表示全部
+        
+        Returns:
+            历史条目列表（按ID顺序）
+        """
+        index = self.index()
+        if ids is not None:
+            wanted = set(ids)
+            index = [item for item in index if item["id"] in wanted]
+        entries = []
+        for item in index:
+            with open(self.archive_dir / item["segment"], 'rb') as f:
+                f.seek(item["offset"])
+                entries.append(json.loads(f.read(item["length"]).decode("utf-8")))
+        return entries
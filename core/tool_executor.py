@@ -6,13 +6,16 @@ from utils.windows_compat import safe_print
 参考原项目tool_utils.py的逻辑
 """
 
+import asyncio
 import requests
 import yaml
 import json
 import time
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 from pathlib import Path
+from utils.tracer import get_tracer
+from utils.blob_store import get_blob_store
 
 
 class ToolExecutor:
@@ -25,6 +28,10 @@ class ToolExecutor:
         "execute_code",    # 执行代码
     ]
     
+    # 等待用户确认的最长时间与轮询间隔（秒）
+    CONFIRM_TIMEOUT = 300
+    CONFIRM_INTERVAL = 2
+    
     def __init__(self, config_loader, hierarchy_manager):
         """
         初始化工具执行器
@@ -42,6 +49,10 @@ class ToolExecutor:
         
         # 权限管理：task_id → auto_mode 映射
         self.task_permissions = {}  # {task_id: {"auto_mode": True/False}}
+        
+        # 异步接口共享的 httpx.AsyncClient（首次使用时创建，见 _get_async_client）
+        self._async_client = None
+        self._async_client_loop = None
     
     def _load_tools_server_url(self) -> str:
         """从配置文件加载工具服务器URL"""
@@ -67,38 +78,79 @@ class ToolExecutor:
         """检查任务是否为自动模式（默认 True）"""
         return self.task_permissions.get(task_id, {}).get("auto_mode", True)
     
+    def _task_requests(self, task_id: str) -> Tuple[str, str, Dict]:
+        """检查/创建toolServer任务的请求：(状态URL, 创建URL, 创建参数)"""
+        # URL 编码 task_id（避免路径中的特殊字符和双斜杠问题）
+        from urllib.parse import quote
+        encoded_task_id = quote(task_id, safe='')
+        
+        status_url = f"{self.tools_server_url}/api/task/{encoded_task_id}/status"
+        create_url = f"{self.tools_server_url}/api/task/create"
+        params = {"task_id": task_id, "task_name": f"MLA-V3-{task_id}"}
+        return status_url, create_url, params
+    
+    def _record_task_created(self, task_id: str, create_response):
+        """处理创建任务的响应"""
+        if create_response.status_code == 200:
+            safe_print(f"✅ 任务 '{task_id}' 已在toolServer中创建")
+            self.task_cache[task_id] = True
+        else:
+            safe_print(f"⚠️ 创建任务失败: {create_response.text}")
+    
     def _ensure_task_exists(self, task_id: str):
         """确保任务在toolServer中存在"""
         if task_id in self.task_cache:
             return
         
         try:
-            # URL 编码 task_id（避免路径中的特殊字符和双斜杠问题）
-            from urllib.parse import quote
-            encoded_task_id = quote(task_id, safe='')
+            status_url, create_url, params = self._task_requests(task_id)
             
-            # 检查任务状态（确保 URL 格式正确）
-            status_url = f"{self.tools_server_url}/api/task/{encoded_task_id}/status"
+            # 检查任务状态
             response = requests.get(status_url, timeout=5)
-            
             if response.status_code == 200:
                 self.task_cache[task_id] = True
                 return
             
             # 任务不存在，创建它
-            create_url = f"{self.tools_server_url}/api/task/create"
-            params = {"task_id": task_id, "task_name": f"MLA-V3-{task_id}"}
-            create_response = requests.post(create_url, params=params, timeout=10)
-            
-            if create_response.status_code == 200:
-                safe_print(f"✅ 任务 '{task_id}' 已在toolServer中创建")
-                self.task_cache[task_id] = True
-            else:
-                safe_print(f"⚠️ 创建任务失败: {create_response.text}")
+            self._record_task_created(task_id, requests.post(create_url, params=params, timeout=10))
         
         except Exception as e:
             safe_print(f"⚠️ 检查/创建任务时出错: {e}")
     
+    def _confirmation_request(self, tool_name: str, arguments: Dict[str, Any], task_id: str) -> Tuple[str, Dict, str]:
+        """工具确认请求：(创建URL, 请求体, 轮询URL)"""
+        # 生成唯一确认ID
+        confirm_id = f"confirm_{tool_name}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        create_url = f"{self.tools_server_url}/api/tool-confirmation/create"
+        create_payload = {
+            "confirm_id": confirm_id,
+            "task_id": task_id,
+            "tool_name": tool_name,
+            "arguments": arguments
+        }
+        status_url = f"{self.tools_server_url}/api/tool-confirmation/{confirm_id}"
+        return create_url, create_payload, status_url
+    
+    @staticmethod
+    def _confirmation_result(status_response, tool_name: str):
+        """
+        解析一次轮询的响应
+        
+        Returns:
+            True/False - 用户已批准/拒绝；None - 尚未处理
+        """
+        if status_response.status_code != 200:
+            return None
+        result = status_response.json()
+        if not (result.get("found") and result.get("status") == "completed"):
+            return None
+        approved = result.get("result") == "approved"
+        if approved:
+            safe_print(f"✅ 用户批准执行: {tool_name}")
+        else:
+            safe_print(f"❌ 用户拒绝执行: {tool_name}")
+        return approved
+    
     def _request_tool_confirmation(self, tool_name: str, arguments: Dict[str, Any], task_id: str) -> bool:
         """
         请求工具执行确认
@@ -108,48 +160,25 @@ class ToolExecutor:
             False - 用户拒绝执行
         """
         try:
-            # 生成唯一确认ID
-            confirm_id = f"confirm_{tool_name}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
-            
-            # 创建确认请求
-            create_url = f"{self.tools_server_url}/api/tool-confirmation/create"
-            create_payload = {
-                "confirm_id": confirm_id,
-                "task_id": task_id,
-                "tool_name": tool_name,
-                "arguments": arguments
-            }
+            create_url, create_payload, status_url = self._confirmation_request(tool_name, arguments, task_id)
             
             response = requests.post(create_url, json=create_payload, timeout=5)
             if response.status_code != 200:
-                safe_print(f"⚠️  创建确认请求失败，默认拒绝执行")
+                safe_print("⚠️  创建确认请求失败，默认拒绝执行")
                 return False
             
             safe_print(f"⏸️  等待用户确认: {tool_name}")
             
-            # 轮询等待用户响应（最多等待 300 秒）
-            max_wait = 300
-            check_interval = 2
+            # 轮询等待用户响应（最多等待 CONFIRM_TIMEOUT 秒）
             elapsed = 0
-            
-            status_url = f"{self.tools_server_url}/api/tool-confirmation/{confirm_id}"
-            
-            while elapsed < max_wait:
-                time.sleep(check_interval)
-                elapsed += check_interval
+            while elapsed < self.CONFIRM_TIMEOUT:
+                time.sleep(self.CONFIRM_INTERVAL)
+                elapsed += self.CONFIRM_INTERVAL
                 
                 try:
-                    status_response = requests.get(status_url, timeout=5)
-                    if status_response.status_code == 200:
-                        result = status_response.json()
-                        
-                        if result.get("found") and result.get("status") == "completed":
-                            approved = result.get("result") == "approved"
-                            if approved:
-                                safe_print(f"✅ 用户批准执行: {tool_name}")
-                            else:
-                                safe_print(f"❌ 用户拒绝执行: {tool_name}")
-                            return approved
+                    approved = self._confirmation_result(requests.get(status_url, timeout=5), tool_name)
+                    if approved is not None:
+                        return approved
                 except Exception:
                     continue
             
@@ -161,161 +190,408 @@ class ToolExecutor:
             safe_print(f"❌ 确认请求失败: {e}，拒绝执行")
             return False
     
-    def execute(self, tool_name: str, arguments: Dict[str, Any], task_id: str) -> Dict:
+    @staticmethod
+    def _error_result(error_information: str) -> Dict:
+        """构造错误结果"""
+        return {
+            "status": "error",
+            "output": "",
+            "error_information": error_information
+        }
+    
+    def _route(self, tool_name: str, task_id: str) -> Tuple[str, Dict]:
         """
-        执行工具调用
+        判断工具调用的执行方式（同步/异步执行共用）
+        
+        Returns:
+            (kind, tool_config)，kind 为 final_output / blob_read / tool / sub_agent / unsupported；
+            需要用户确认的危险工具为 confirm_tool
+        """
+        tool_config = self.config_loader.get_tool_config(tool_name)
+        tool_type = tool_config.get("type")
+        
+        # 特殊处理final_output；blob_read在本地读取转存的工具结果
+        if tool_name in ("final_output", "blob_read"):
+            return tool_name, tool_config
+        
+        if tool_type == "tool_call_agent":
+            # 检查是否为危险工具且需要确认
+            if tool_name in self.DANGEROUS_TOOLS and not self.is_auto_mode(task_id):
+                return "confirm_tool", tool_config
+            return "tool", tool_config
+        
+        if tool_type == "llm_call_agent":
+            # 子Agent - 递归调用
+            # 注意：uuid 已在 agent_executor 中添加（仅对 level != 0）
+            return "sub_agent", tool_config
+        
+        return "unsupported", tool_config
+    
+    @staticmethod
+    def _final_output_result(arguments: Dict[str, Any]) -> Dict:
+        """final_output 的执行结果"""
+        return {
+            "status": arguments.get("status", "success"),
+            "output": arguments.get("output", ""),
+            "error_information": arguments.get("error_information", "")
+        }
+    
+    def execute(self, tool_name: str, arguments: Dict[str, Any], task_id: str, branch_id: str = None) -> Dict:
+        """
+        执行工具调用（记录工具span，子Agent的span嵌套其中）
         
         Args:
             tool_name: 工具名称
             arguments: 工具参数
             task_id: 任务ID
+            branch_id: 子Agent所在的层级分支（并发执行兄弟子Agent时使用）
             
         Returns:
             执行结果字典
         """
+        with get_tracer().span(f"tool {tool_name}", "tool") as span:
+            result = self._execute(tool_name, arguments, task_id, branch_id)
+            span["status"] = result.get("status")
+            return result
+    
+    def _execute(self, tool_name: str, arguments: Dict[str, Any], task_id: str, branch_id: str = None) -> Dict:
+        """执行工具调用（按工具类型分发）"""
         try:
-            # 获取工具配置
-            tool_config = self.config_loader.get_tool_config(tool_name)
-            tool_type = tool_config.get("type")
-            
-            # 特殊处理final_output
-            if tool_name == "final_output":
-                return {
-                    "status": arguments.get("status", "success"),
-                    "output": arguments.get("output", ""),
-                    "error_information": arguments.get("error_information", "")
-                }
-            
-            # 判断是普通工具还是子Agent
-            if tool_type == "tool_call_agent":
-                # 检查是否为危险工具且需要确认
-                if tool_name in self.DANGEROUS_TOOLS and not self.is_auto_mode(task_id):
-                    # 请求用户确认
-                    approved = self._request_tool_confirmation(tool_name, arguments, task_id)
-                    
-                    if not approved:
-                        # 用户拒绝执行
-                        return {
-                            "status": "error",
-                            "output": "",
-                            "error_information": f"工具执行被用户拒绝: {tool_name}"
-                        }
-                
+            kind, tool_config = self._route(tool_name, task_id)
+            
+            if kind == "final_output":
+                return self._final_output_result(arguments)
+            
+            if kind == "blob_read":
+                return self._blob_read(arguments, task_id)
+            
+            if kind == "confirm_tool" and not self._request_tool_confirmation(tool_name, arguments, task_id):
+                # 用户拒绝执行
+                return self._error_result(f"工具执行被用户拒绝: {tool_name}")
+            
+            if kind in ("tool", "confirm_tool"):
                 # 普通工具 - 通过HTTP调用toolServer
                 return self._call_toolserver(tool_name, arguments, task_id)
             
-            elif tool_type == "llm_call_agent":
-                # 子Agent - 递归调用
-                # 注意：uuid 已在 agent_executor 中添加（仅对 level != 0）
-                return self._execute_sub_agent(tool_name, tool_config, arguments, task_id)
+            if kind == "sub_agent":
+                return self._execute_sub_agent(tool_name, tool_config, arguments, task_id, branch_id)
             
-            else:
-                return {
-                    "status": "error",
-                    "output": "",
-                    "error_information": f"不支持的工具类型: {tool_type}"
-                }
+            return self._error_result(f"不支持的工具类型: {tool_config.get('type')}")
         
         except Exception as e:
-            return {
-                "status": "error",
-                "output": "",
-                "error_information": f"工具执行失败: {str(e)}"
-            }
+            return self._error_result(f"工具执行失败: {str(e)}")
     
-    def _call_toolserver(self, tool_name: str, arguments: Dict, task_id: str) -> Dict:
-        """通过HTTP调用toolServer执行工具"""
+    def _blob_read(self, arguments: Dict, task_id: str) -> Dict:
+        """分页读取转存到blob的工具结果"""
+        handle = str(arguments.get("handle", ""))
         try:
-            # 确保任务存在
-            self._ensure_task_exists(task_id)
-            
-            # 构建请求
-            execute_url = f"{self.tools_server_url}/api/tool/execute"
-            payload = {
+            page = get_blob_store().read(task_id, handle, arguments.get("offset", 0), arguments.get("length"))
+        except (OSError, ValueError) as e:
+            return self._error_result(f"读取blob失败: {e}")
+        if page is None:
+            return self._error_result(f"blob不存在: {handle}")
+        return {
+            "status": "success",
+            "output": json.dumps(page, indent=2, ensure_ascii=False),
+            "error_information": ""
+        }
+    
+    def _toolserver_request(self, tool_name: str, arguments: Dict, task_id: str) -> Dict:
+        """构建toolServer执行请求（requests.post / httpx.AsyncClient.post 的参数）"""
+        return {
+            "url": f"{self.tools_server_url}/api/tool/execute",
+            "json": {
                 "task_id": task_id,
                 "tool_name": tool_name,
                 "params": arguments
-            }
-            
-            headers = {
+            },
+            "headers": {
                 'Content-Type': 'application/json; charset=utf-8',
                 'Accept': 'application/json; charset=utf-8'
-            }
+            },
+            "timeout": 100000
+        }
+    
+    def _toolserver_result(self, tool_server_response: Dict, tool_name: str, task_id: str) -> Dict:
+        """解析toolServer的响应（超长输出转存到blob，会写文件）"""
+        if tool_server_response.get("success"):
+            output_data = tool_server_response.get("data", {})
+            # 超长输出转存到blob，动作记录中只保留预览和句柄
+            return get_blob_store().offload_result(task_id, tool_name, {
+                "status": "success",
+                "output": json.dumps(output_data, indent=2, ensure_ascii=False),
+                "error_information": ""
+            })
+        return self._error_result(tool_server_response.get("error", "工具服务器返回未知错误"))
+    
+    def _call_toolserver(self, tool_name: str, arguments: Dict, task_id: str) -> Dict:
+        """通过HTTP调用toolServer执行工具"""
+        try:
+            # 确保任务存在
+            self._ensure_task_exists(task_id)
             
             safe_print(f"   🔗 调用toolServer: {tool_name}")
             
-            # 发送请求
-            response = requests.post(
-                execute_url,
-                json=payload,
-                headers=headers,
-                timeout=100000
-            )
+            response = requests.post(**self._toolserver_request(tool_name, arguments, task_id))
             response.raise_for_status()
             
-            # 解析响应
-            tool_server_response = response.json()
-            
-            if tool_server_response.get("success"):
-                output_data = tool_server_response.get("data", {})
-                return {
-                    "status": "success",
-                    "output": json.dumps(output_data, indent=2, ensure_ascii=False),
-                    "error_information": ""
-                }
-            else:
-                error_msg = tool_server_response.get("error", "工具服务器返回未知错误")
-                return {
-                    "status": "error",
-                    "output": "",
-                    "error_information": error_msg
-                }
+            return self._toolserver_result(response.json(), tool_name, task_id)
         
         except Exception as e:
-            return {
-                "status": "error",
-                "output": "",
-                "error_information": f"调用toolServer失败: {str(e)}"
-            }
+            return self._error_result(f"调用toolServer失败: {str(e)}")
+    
+    def _create_sub_agent(self, executor_class, agent_name: str, agent_config: Dict):
+        """创建子Agent执行器（与当前Agent共用配置和层级管理器）"""
+        return executor_class(
+            agent_name=agent_name,
+            agent_config=agent_config,
+            config_loader=self.config_loader,
+            hierarchy_manager=self.hierarchy_manager
+        )
+    
+    def _sub_agent_error(self, e: Exception) -> Dict:
+        """子Agent执行异常时的结果"""
+        import traceback
+        error_detail = traceback.format_exc()
+        safe_print(f"❌ 子Agent执行失败: {e}")
+        safe_print(f"详细错误:\n{error_detail}")
+        return self._error_result(f"子Agent执行失败: {str(e)}\n{error_detail}")
     
     def _execute_sub_agent(
         self,
         agent_name: str,
         agent_config: Dict,
         arguments: Dict,
-        task_id: str
+        task_id: str,
+        branch_id: str = None
     ) -> Dict:
-        """执行子Agent调用"""
+        """
+        执行子Agent调用
+        
+        指定 branch_id 时子Agent在该层级分支上入栈/出栈，
+        使同一轮中的兄弟子Agent可以在不同线程中并发执行
+        """
         try:
             # 导入Agent执行器（避免循环导入）
             from core.agent_executor import AgentExecutor
             
-            # 获取任务输入
+            sub_agent = self._create_sub_agent(AgentExecutor, agent_name, agent_config)
             task_input = arguments.get("task_input", "")
             
-            # 创建子Agent执行器
-            sub_agent = AgentExecutor(
-                agent_name=agent_name,
-                agent_config=agent_config,
-                config_loader=self.config_loader,
-                hierarchy_manager=self.hierarchy_manager
-            )
-            
             # 执行子Agent
-            result = sub_agent.run(task_id, task_input)
+            if branch_id:
+                with self.hierarchy_manager.use_branch(branch_id):
+                    return sub_agent.run(task_id, task_input)
+            return sub_agent.run(task_id, task_input)
+        
+        except Exception as e:
+            return self._sub_agent_error(e)
+    
+    def execute_fan_out(self, calls: List[Tuple[str, Dict]], task_id: str, max_workers: int = 4) -> List[Dict]:
+        """
+        并发执行同一轮中的多个兄弟子Agent调用
+        
+        每个子Agent在从当前分支派生的独立分支上运行，总耗时取决于最深的分支
+        
+        Args:
+            calls: (工具名称, 参数) 列表
+            task_id: 任务ID
+            max_workers: 最大并发数
             
+        Returns:
+            执行结果列表（与 calls 顺序一致）
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        branch_ids = [self.hierarchy_manager.fork_branch() for _ in calls]
+        
+        def run_branch(index):
+            tool_name, arguments = calls[index]
+            try:
+                return self.execute(tool_name, arguments, task_id, branch_id=branch_ids[index])
+            finally:
+                self.hierarchy_manager.close_branch(branch_ids[index])
+        
+        safe_print(f"🌿 并发执行 {len(calls)} 个子Agent")
+        with ThreadPoolExecutor(max_workers=max(1, min(len(calls), max_workers))) as pool:
+            return list(pool.map(run_branch, range(len(calls))))
+    
+    # ==================== 异步接口（供 AsyncAgentExecutor 使用） ====================
+    
+    def _get_async_client(self):
+        """
+        获取共享的 httpx.AsyncClient（复用连接）
+        
+        客户端绑定创建它的事件循环，换了事件循环（如再次 asyncio.run）时重新创建
+        """
+        import httpx
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client = httpx.AsyncClient()
+            self._async_client_loop = loop
+        return self._async_client
+    
+    async def aclose(self):
+        """关闭共享的 httpx.AsyncClient"""
+        client, self._async_client, self._async_client_loop = self._async_client, None, None
+        if client is not None:
+            await client.aclose()
+    
+    async def _aensure_task_exists(self, task_id: str):
+        """确保任务在toolServer中存在（异步版本）"""
+        if task_id in self.task_cache:
+            return
+        
+        try:
+            client = self._get_async_client()
+            status_url, create_url, params = self._task_requests(task_id)
+            
+            response = await client.get(status_url, timeout=5)
+            if response.status_code == 200:
+                self.task_cache[task_id] = True
+                return
+            
+            self._record_task_created(task_id, await client.post(create_url, params=params, timeout=10))
+        
+        except Exception as e:
+            safe_print(f"⚠️ 检查/创建任务时出错: {e}")
+    
+    async def _arequest_tool_confirmation(self, tool_name: str, arguments: Dict[str, Any], task_id: str) -> bool:
+        """请求工具执行确认（异步版本，等待期间不阻塞事件循环）"""
+        try:
+            client = self._get_async_client()
+            create_url, create_payload, status_url = self._confirmation_request(tool_name, arguments, task_id)
+            
+            response = await client.post(create_url, json=create_payload, timeout=5)
+            if response.status_code != 200:
+                safe_print("⚠️  创建确认请求失败，默认拒绝执行")
+                return False
+            
+            safe_print(f"⏸️  等待用户确认: {tool_name}")
+            
+            elapsed = 0
+            while elapsed < self.CONFIRM_TIMEOUT:
+                await asyncio.sleep(self.CONFIRM_INTERVAL)
+                elapsed += self.CONFIRM_INTERVAL
+                
+                try:
+                    approved = self._confirmation_result(await client.get(status_url, timeout=5), tool_name)
+                    if approved is not None:
+                        return approved
+                except Exception:
+                    continue
+            
+            # 超时，默认拒绝
+            safe_print(f"⏱️  确认超时，拒绝执行: {tool_name}")
+            return False
+        
+        except Exception as e:
+            safe_print(f"❌ 确认请求失败: {e}，拒绝执行")
+            return False
+    
+    async def aexecute(self, tool_name: str, arguments: Dict[str, Any], task_id: str, branch_id: str = None) -> Dict:
+        """
+        执行工具调用（异步版本，语义与 execute 相同）
+        
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+            task_id: 任务ID
+            branch_id: 子Agent所在的层级分支（并发执行兄弟子Agent时使用）
+            
+        Returns:
+            执行结果字典
+        """
+        with get_tracer().span(f"tool {tool_name}", "tool") as span:
+            result = await self._aexecute(tool_name, arguments, task_id, branch_id)
+            span["status"] = result.get("status")
             return result
+    
+    async def _aexecute(self, tool_name: str, arguments: Dict[str, Any], task_id: str, branch_id: str = None) -> Dict:
+        """执行工具调用（异步版本，分发规则见 _route；文件读写放到线程中执行）"""
+        try:
+            kind, tool_config = self._route(tool_name, task_id)
+            
+            if kind == "final_output":
+                return self._final_output_result(arguments)
+            
+            if kind == "blob_read":
+                return await asyncio.to_thread(self._blob_read, arguments, task_id)
+            
+            if kind == "confirm_tool" and not await self._arequest_tool_confirmation(tool_name, arguments, task_id):
+                return self._error_result(f"工具执行被用户拒绝: {tool_name}")
+            
+            if kind in ("tool", "confirm_tool"):
+                return await self._acall_toolserver(tool_name, arguments, task_id)
+            
+            if kind == "sub_agent":
+                return await self._aexecute_sub_agent(tool_name, tool_config, arguments, task_id, branch_id)
+            
+            return self._error_result(f"不支持的工具类型: {tool_config.get('type')}")
+        
+        except Exception as e:
+            return self._error_result(f"工具执行失败: {str(e)}")
+    
+    async def _acall_toolserver(self, tool_name: str, arguments: Dict, task_id: str) -> Dict:
+        """通过HTTP调用toolServer执行工具（异步版本，使用共享的 httpx.AsyncClient）"""
+        try:
+            await self._aensure_task_exists(task_id)
+            
+            safe_print(f"   🔗 调用toolServer: {tool_name}")
+            
+            response = await self._get_async_client().post(**self._toolserver_request(tool_name, arguments, task_id))
+            response.raise_for_status()
+            
+            return await asyncio.to_thread(self._toolserver_result, response.json(), tool_name, task_id)
         
         except Exception as e:
-            import traceback
-            error_detail = traceback.format_exc()
-            safe_print(f"❌ 子Agent执行失败: {e}")
-            safe_print(f"详细错误:\n{error_detail}")
-            return {
-                "status": "error",
-                "output": "",
-                "error_information": f"子Agent执行失败: {str(e)}\n{error_detail}"
-            }
+            return self._error_result(f"调用toolServer失败: {str(e)}")
+    
+    async def _aexecute_sub_agent(
+        self,
+        agent_name: str,
+        agent_config: Dict,
+        arguments: Dict,
+        task_id: str,
+        branch_id: str = None
+    ) -> Dict:
+        """执行子Agent调用（异步版本，子Agent为 AsyncAgentExecutor）"""
+        try:
+            from core.async_agent_executor import AsyncAgentExecutor
+            
+            sub_agent = self._create_sub_agent(AsyncAgentExecutor, agent_name, agent_config)
+            task_input = arguments.get("task_input", "")
+            
+            if branch_id:
+                with self.hierarchy_manager.use_branch(branch_id):
+                    return await sub_agent.arun(task_id, task_input)
+            return await sub_agent.arun(task_id, task_input)
+        
+        except Exception as e:
+            return self._sub_agent_error(e)
+    
+    async def aexecute_fan_out(self, calls: List[Tuple[str, Dict]], task_id: str, max_workers: int = 4) -> List[Dict]:
+        """
+        并发执行同一轮中的多个兄弟子Agent调用（异步版本，每个子Agent为一个asyncio任务）
+        
+        Returns:
+            执行结果列表（与 calls 顺序一致）
+        """
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+        # 分支的创建/删除会读写层级存储，放到线程中执行
+        branch_ids = [await asyncio.to_thread(self.hierarchy_manager.fork_branch) for _ in calls]
+        
+        async def run_branch(index):
+            tool_name, arguments = calls[index]
+            try:
+                async with semaphore:
+                    with get_tracer().track(branch_ids[index]):
+                        return await self.aexecute(tool_name, arguments, task_id, branch_id=branch_ids[index])
+            finally:
+                await asyncio.to_thread(self.hierarchy_manager.close_branch, branch_ids[index])
+        
+        safe_print(f"🌿 并发执行 {len(calls)} 个子Agent")
+        return list(await asyncio.gather(*(run_branch(i) for i in range(len(calls)))))
 
 
 if __name__ == "__main__":
@@ -327,7 +603,7 @@ if __name__ == "__main__":
     hierarchy_manager = get_hierarchy_manager("test_task")
     
     executor = ToolExecutor(config_loader, hierarchy_manager)
-    safe_print(f"✅ 工具执行器初始化成功")
+    safe_print("✅ 工具执行器初始化成功")
     safe_print(f"   ToolServer URL: {executor.tools_server_url}")
     
     # 测试final_output
@@ -7,7 +7,14 @@ from utils.windows_compat import safe_print
 """
 
 import json
-from typing import List, Dict
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Dict, Optional
+from utils.llm_scheduler import PRIORITY_COMPRESSION
+from utils.runtime_config import get_runtime_option
+from utils.tracer import get_tracer
+from services.summary_cache import get_summary_cache
 
 try:
     import tiktoken
@@ -19,6 +26,9 @@ except ImportError:
 class ActionCompressor:
     """历史动作压缩器"""
     
+    # 后台预压缩未完成时，历史不超过 max_context_window - 该值 就先不压缩（不阻塞本轮）
+    PRECOMPACT_GRACE_TOKENS = 10000
+    
     def __init__(self, llm_client):
         """
         初始化
@@ -33,6 +43,28 @@ class ActionCompressor:
             self.encoding = tiktoken.get_encoding("cl100k_base")
         else:
             self.encoding = None
+        
+        # 增量token统计：单条动作 id(action) -> (action, token数)
+        self._action_tokens = {}
+        # 上次统计的历史列表、已统计条数、最后一条动作和累计token数
+        self._running = (None, 0, None, 0)
+        # 最近统计过的文本（thinking / task_input）-> token数
+        self._text_tokens = {}
+        
+        # 分段压缩：并发段数、是否对各段结果做合并
+        compression_config = get_runtime_option("context_compression", {})
+        self.max_parallel_chunks = max(1, int(compression_config.get("max_parallel_chunks", 4)))
+        self.merge_chunks = bool(compression_config.get("merge_chunks", True))
+        # 历史总结模式：full（每次重新总结全部历史）/ rolling（只总结新增动作，逐层合并）
+        self.summary_mode = compression_config.get("summary_mode", "full")
+        self.segment_tokens = int(compression_config.get("segment_tokens", 1500))
+        self.summary_fanout = max(2, int(compression_config.get("summary_fanout", 4)))
+        
+        # 后台预压缩：超过低水位后在后台总结历史前缀，到达压缩阈值时直接替换
+        precompact_config = compression_config.get("precompact", {}) or {}
+        self.precompact_enabled = bool(precompact_config.get("enabled", False))
+        self.low_watermark = float(precompact_config.get("low_watermark", 0.75))
+        self._precompact = None  # (被总结的动作前缀, Future[summary action])
     
     def count_tokens(self, text: str) -> int:
         """统计token数"""
@@ -43,6 +75,43 @@ class ActionCompressor:
             other_chars = len(text) - chinese_chars
             return int(chinese_chars / 1.5 + other_chars / 4)
     
+    def action_tokens(self, action: Dict) -> int:
+        """单条动作的token数（每个动作对象只编码一次）"""
+        entry = self._action_tokens.get(id(action))
+        if entry is None or entry[0] is not action:
+            # 缓存条目保存动作对象本身：对象存活期间id不会被复用
+            entry = (action, self.count_tokens(self._actions_to_xml([action])))
+            self._action_tokens[id(action)] = entry
+        return entry[1]
+    
+    def history_tokens(self, action_history: List[Dict]) -> int:
+        """
+        历史动作的token数（增量统计）
+        
+        同一个历史列表只追加时，只统计新增的动作并累加到上次的总数；
+        列表被替换（压缩、thinking清空、重新加载）时按单条缓存重新求和，并清理失效条目
+        """
+        history, counted, last_action, total = self._running
+        if (history is not action_history or counted > len(action_history)
+                or (counted and action_history[counted - 1] is not last_action)):
+            live = {id(action) for action in action_history}
+            self._action_tokens = {k: v for k, v in self._action_tokens.items() if k in live}
+            counted, total = 0, 0
+        for action in action_history[counted:]:
+            total += self.action_tokens(action)
+        self._running = (action_history, len(action_history),
+                         action_history[-1] if action_history else None, total)
+        return total
+    
+    def _cached_text_tokens(self, text: str) -> int:
+        """thinking / task_input 等每轮基本不变的文本的token数"""
+        tokens = self._text_tokens.get(text)
+        if tokens is None:
+            if len(self._text_tokens) >= 8:
+                self._text_tokens.clear()
+            tokens = self._text_tokens[text] = self.count_tokens(text)
+        return tokens
+    
     def compress_if_needed(
         self,
         action_history: List[Dict],
@@ -73,6 +142,9 @@ class ActionCompressor:
         
         # 如果只有一条
         if len(action_history) == 1:
+            # 整条动作都不超过字段上限时，无需逐字段检查
+            if self.action_tokens(action_history[0]) <= max_context_window // 2:
+                return action_history
             # 检查是否需要压缩字段
             return [self._compress_action_fields(action_history[0], max_context_window // 2)]
         
@@ -80,27 +152,41 @@ class ActionCompressor:
         recent_action = action_history[-1]
         historical_actions = action_history[:-1]
         
-        # 计算整体token数
-        total_text = self._actions_to_xml(action_history)
-        total_tokens = self.count_tokens(total_text+thinking+task_input)
+        # 计算整体token数（增量统计，不再每轮编码整个历史）
+        text_tokens = self._cached_text_tokens(thinking) + self._cached_text_tokens(task_input)
+        total_tokens = self.history_tokens(action_history) + text_tokens
+        threshold = max_context_window - 20000
         
-        # 如果不超限，不压缩
-        if total_tokens <= max_context_window - 20000:
+        # 如果不超限，不压缩（超过低水位时在后台预先总结历史前缀）
+        if total_tokens <= threshold:
+            if self.precompact_enabled and total_tokens > threshold * self.low_watermark:
+                self._start_precompaction(historical_actions, thinking, task_input, max_context_window)
             return action_history
         
-        safe_print(f"🔄 历史动作需要压缩: {total_tokens} tokens > {max_context_window - 20000}")
+        safe_print(f"🔄 历史动作需要压缩: {total_tokens} tokens > {threshold}")
+        
+        # 已有后台预压缩的总结：替换被总结的前缀，之后新增的动作原样保留
+        summary_action, covered = self._take_precompaction(historical_actions)
+        if summary_action is not None:
+            historical_actions = [summary_action] + historical_actions[covered:]
+            swapped = historical_actions + [recent_action]
+            swapped_tokens = self.history_tokens(swapped) + text_tokens
+            if swapped_tokens <= threshold:
+                safe_print(f"✅ 使用预压缩总结: {total_tokens} tokens → {swapped_tokens} tokens "
+                           f"(替换 {covered} 条动作，保留之后的 {len(swapped) - 2} 条)")
+                return swapped
+            # 替换后仍超限：在替换后的历史上继续压缩（只需总结预压缩之后的新增部分）
+        elif total_tokens <= max_context_window - self.PRECOMPACT_GRACE_TOKENS \
+                and self._precompaction_pending(historical_actions):
+            # 后台预压缩尚未完成：本轮不等待，保留原始历史（仍留有余量），下一轮再替换
+            safe_print("   ⏳ 后台预压缩尚未完成，本轮保留原始历史")
+            return action_history
         
         # 压缩策略：
         # 1. 历史 → 基于 thinking 和 task_input 智能总结为5k tokens
         # 2. 最新 → 压缩为max_window的50%
         
-        summary_action = self._summarize_historical_xml(
-            self._actions_to_xml(historical_actions),
-            target_tokens=5000,  # 历史总结固定5k tokens
-            thinking=thinking,
-            task_input=task_input,
-            max_context_window=max_context_window
-        )
+        summary_action = self._summarize_history(historical_actions, thinking, task_input, max_context_window)
         
         # 压缩最新action的大字段（50% of max_window）
         compressed_recent = self._compress_action_fields(
@@ -120,6 +206,135 @@ class ActionCompressor:
         
         return result
     
+    def _compress_chat(
+        self,
+        kind: str,
+        content: str,
+        target_tokens: int,
+        history: List,
+        system_prompt: str
+    ):
+        """
+        调用压缩模型（结果按 提示词类型+内容哈希+目标token数+压缩模型 记忆化）
+        
+        同一任务内相同的内容（跨Agent、恢复之后）只压缩一次；返回LLMResponse
+        """
+        from services.llm_client import LLMResponse
+        
+        model = self.llm_client.compressor_models[0]
+        cache = get_summary_cache()
+        key = cache.key(kind, content, target_tokens, model) if cache.enabled else None
+        if key:
+            cached = cache.get(key)
+            if cached is not None:
+                safe_print(f"      💾 复用已缓存的压缩结果 ({kind}, {target_tokens} tokens)")
+                return LLMResponse(status="success", output=cached, tool_calls=[], model=model,
+                                   finish_reason="stop", from_cache=True)
+        
+        response = self.llm_client.chat(
+            history=history,
+            model=model,
+            system_prompt=system_prompt,
+            tool_list=[],
+            tool_choice="auto",
+            priority=PRIORITY_COMPRESSION,
+            purpose="compression"
+        )
+        if key and response.status == "success" and response.output:
+            cache.put(key, response.output)
+        return response
+    
+    def _summarize_history(
+        self,
+        historical_actions: List[Dict],
+        thinking: str,
+        task_input: str,
+        max_context_window: int
+    ) -> Dict:
+        """按 summary_mode 将历史动作总结为一个summary action"""
+        if self.summary_mode == "rolling":
+            return self._rolling_summarize(
+                historical_actions,
+                target_tokens=5000,
+                thinking=thinking,
+                task_input=task_input,
+                max_context_window=max_context_window
+            )
+        return self._summarize_historical_xml(
+            self._actions_to_xml(historical_actions),
+            target_tokens=5000,  # 历史总结固定5k tokens
+            thinking=thinking,
+            task_input=task_input,
+            max_context_window=max_context_window
+        )
+    
+    def _start_precompaction(
+        self,
+        historical_actions: List[Dict],
+        thinking: str,
+        task_input: str,
+        max_context_window: int
+    ):
+        """
+        在后台总结当前的历史前缀（已有进行中或仍然有效的预压缩时不重复启动）
+        
+        总结在守护线程中执行，不阻塞当前轮次；线程在调用方上下文的副本中运行，用量归属随之传递
+        """
+        if self._precompact is not None:
+            prefix, future = self._precompact
+            if not future.done() or self._prefix_matches(prefix, historical_actions):
+                return
+        if len(historical_actions) < 2:
+            return
+        
+        prefix = list(historical_actions)
+        future = Future()
+        context = contextvars.copy_context()
+        
+        def work():
+            try:
+                with get_tracer().track("precompact"), get_tracer().span("precompact", "compression", actions=len(prefix)):
+                    future.set_result(self._summarize_history(prefix, thinking, task_input, max_context_window))
+            except Exception as e:
+                future.set_exception(e)
+        
+        safe_print(f"   ⏳ 后台预压缩: 总结最早的 {len(prefix)} 条动作")
+        self._precompact = (prefix, future)
+        threading.Thread(target=context.run, args=(work,), name="precompact", daemon=True).start()
+    
+    def _take_precompaction(self, historical_actions: List[Dict]):
+        """
+        取出与当前历史匹配、已完成的预压缩结果（不等待仍在进行的预压缩，它保留到下一轮）
+        
+        Returns:
+            (summary action, 被替换的前缀动作数)；没有可用结果时为 (None, 0)
+        """
+        if self._precompact is None:
+            return None, 0
+        prefix, future = self._precompact
+        if not self._prefix_matches(prefix, historical_actions):
+            self._precompact = None
+            return None, 0
+        if not future.done():
+            return None, 0
+        self._precompact = None
+        try:
+            return future.result(), len(prefix)
+        except Exception as e:
+            safe_print(f"⚠️ 后台预压缩失败，改为同步压缩: {e}")
+            return None, 0
+    
+    def _precompaction_pending(self, historical_actions: List[Dict]) -> bool:
+        """是否有与当前历史匹配、仍在进行的后台预压缩"""
+        return (self._precompact is not None and not self._precompact[1].done()
+                and self._prefix_matches(self._precompact[0], historical_actions))
+    
+    @staticmethod
+    def _prefix_matches(prefix: List[Dict], historical_actions: List[Dict]) -> bool:
+        """历史动作是否仍以同一组动作对象开头（历史被替换或清空后预压缩结果作废）"""
+        return (len(prefix) <= len(historical_actions)
+                and all(a is b for a, b in zip(prefix, historical_actions)))
+    
     def _actions_to_xml(self, actions: List[Dict]) -> str:
         """将actions转换为XML格式文本"""
         xml_parts = []
@@ -205,6 +420,114 @@ class ActionCompressor:
                 "result": {"status": "success", "output": "[历史动作已省略]", "_is_summary": True}
             }
     
+    def _rolling_summarize(
+        self,
+        historical_actions: List[Dict],
+        target_tokens: int = 5000,
+        thinking: str = "",
+        task_input: str = "",
+        max_context_window: int = None
+    ) -> Dict:
+        """
+        滚动总结：只总结上次压缩之后新增的动作，已有总结不再重新总结
+        
+        总结保存为一组按时间排序的节点（总结的总结）：
+        - 新增动作总结为一个0层节点（segment_tokens）
+        - 末尾有 summary_fanout 个同层节点时合并为上一层的一个节点（类似二进制进位）
+        - 总长度超过 target_tokens 时，合并最早的节点
+        每次压缩的开销与新增内容成正比，合并的开销摊还后为对数级
+        
+        Args:
+            historical_actions: 除最新一条外的历史动作（第一条可能是上次的总结）
+            target_tokens: 总结的总长度上限
+            thinking: 当前的 thinking 内容
+            task_input: 任务需求描述
+            max_context_window: 最大上下文窗口
+            
+        Returns:
+            一个summary action（result._summary_nodes 记录节点结构）
+        """
+        nodes = []
+        new_actions = historical_actions
+        if new_actions and new_actions[0].get("tool_name") == "_historical_summary":
+            nodes = self._summary_nodes(new_actions[0])
+            new_actions = new_actions[1:]
+        
+        if new_actions:
+            safe_print(f"   🧩 滚动总结: 新增 {len(new_actions)} 条动作，已有 {len(nodes)} 个总结节点")
+            segment = self._summarize_historical_xml(
+                self._actions_to_xml(new_actions),
+                target_tokens=self.segment_tokens,
+                thinking=thinking,
+                task_input=task_input,
+                max_context_window=max_context_window
+            )
+            text = segment["result"]["output"]
+            nodes.append({"level": 0, "actions": len(new_actions), "text": text, "tokens": self.count_tokens(text)})
+        
+        fanout = self.summary_fanout
+        # 进位：末尾 fanout 个同层节点合并为上一层
+        while len(nodes) >= fanout and len({node["level"] for node in nodes[-fanout:]}) == 1:
+            nodes[-fanout:] = [self._merge_summary_nodes(nodes[-fanout:], thinking, task_input)]
+        
+        # 总长度超限：合并最早的节点
+        while len(nodes) > 1 and sum(node["tokens"] for node in nodes) > target_tokens:
+            group = nodes[:fanout]
+            nodes[:len(group)] = [self._merge_summary_nodes(group, thinking, task_input)]
+        
+        output = "\n\n".join(node["text"] for node in nodes)
+        return {
+            "tool_name": "_historical_summary",
+            "arguments": {},
+            "result": {
+                "status": "success",
+                "output": output,
+                "_is_summary": True,
+                # 节点文本是output中按顺序以"\n\n"连接的片段，这里只记录长度，避免重复存储
+                "_summary_nodes": [
+                    {"level": node["level"], "actions": node["actions"], "tokens": node["tokens"], "chars": len(node["text"])}
+                    for node in nodes
+                ]
+            }
+        }
+    
+    def _summary_nodes(self, summary_action: Dict) -> List[Dict]:
+        """从summary action还原总结节点（旧格式或全量总结视为一个0层节点）"""
+        result = summary_action.get("result", {})
+        output = result.get("output", "")
+        meta = result.get("_summary_nodes")
+        if meta and sum(node["chars"] for node in meta) + 2 * (len(meta) - 1) == len(output):
+            nodes = []
+            offset = 0
+            for node in meta:
+                text = output[offset:offset + node["chars"]]
+                offset += node["chars"] + 2
+                nodes.append({"level": node["level"], "actions": node["actions"], "text": text, "tokens": node["tokens"]})
+            return nodes
+        return [{"level": 0, "actions": 0, "text": output, "tokens": self.count_tokens(output)}]
+    
+    def _merge_summary_nodes(self, nodes: List[Dict], thinking: str, task_input: str) -> Dict:
+        """将若干相邻总结节点合并为上一层的一个节点（总结的总结）"""
+        level = max(node["level"] for node in nodes) + 1
+        safe_print(f"   🧩 合并 {len(nodes)} 个总结节点 → 第{level}层")
+        
+        context_info = ""
+        if task_input:
+            context_info += f"\n<任务需求>\n{task_input}\n</任务需求>\n"
+        if thinking:
+            context_info += f"\n<当前进度与计划>\n{thinking}\n</当前进度与计划>\n"
+        
+        texts = [node["text"] for node in nodes]
+        text = self._llm_merge(texts, self.segment_tokens, context_info, "历史动作总结")
+        if text is None:
+            text = self._fallback_compress("\n\n".join(texts), self.segment_tokens)
+        return {
+            "level": level,
+            "actions": sum(node["actions"] for node in nodes),
+            "text": text,
+            "tokens": self.count_tokens(text)
+        }
+    
     def _single_summarize(
         self,
         xml_text: str,
@@ -249,12 +572,12 @@ class ActionCompressor:
         
         history = [ChatMessage(role="user", content=prompt)]
         
-        response = self.llm_client.chat(
+        response = self._compress_chat(
+            "history",
+            xml_text,
+            target_tokens,
             history=history,
-            model=self.llm_client.compressor_models[0],
-            system_prompt=f"你是整体上下文构造专家。目标：将内容压缩到{target_tokens} tokens以内。",
-            tool_list=[],
-            tool_choice="auto"
+            system_prompt=f"你是整体上下文构造专家。目标：将内容压缩到{target_tokens} tokens以内。"
         )
         
         summary = response.output if response.status == "success" else "[总结失败]"
@@ -327,11 +650,11 @@ class ActionCompressor:
         if thinking:
             context_info += f"\n<当前进度与计划>\n{thinking}\n</当前进度与计划>\n"
         
-        # 对每个chunk进行压缩
-        chunk_summaries = []
+        # 对每个chunk进行压缩（并发，结果按段序排列）
         target_per_chunk = target_tokens // len(chunks)
         
-        for i, chunk in enumerate(chunks):
+        def summarize_chunk(i: int) -> str:
+            chunk = chunks[i]
             safe_print(f"      压缩第 {i+1}/{len(chunks)} 段...")
             
             prompt = f"""你是智能历史信息压缩助手。这是分段压缩任务的第 {i+1}/{len(chunks)} 段。
@@ -360,26 +683,28 @@ class ActionCompressor:
             history = [ChatMessage(role="user", content=prompt)]
             
             try:
-                response = self.llm_client.chat(
+                response = self._compress_chat(
+                    "history_chunk",
+                    chunk,
+                    target_per_chunk,
                     history=history,
-                    model=self.llm_client.compressor_models[0],
-                    system_prompt=f"你是内容压缩专家。目标：将本段压缩到{target_per_chunk} tokens以内。",
-                    tool_list=[],
-                    tool_choice="auto"
+                    system_prompt=f"你是内容压缩专家。目标：将本段压缩到{target_per_chunk} tokens以内。"
                 )
                 
                 if response.status == "success":
-                    chunk_summaries.append(f"[段{i+1}] {response.output}")
                     safe_print(f"         ✅ 第{i+1}段压缩成功")
-                else:
-                    chunk_summaries.append(f"[段{i+1}] [压缩失败]")
-                    safe_print(f"         ⚠️ 第{i+1}段压缩失败: {response.output}")
+                    return f"[段{i+1}] {response.output}"
+                safe_print(f"         ⚠️ 第{i+1}段压缩失败: {response.output}")
+                return f"[段{i+1}] [压缩失败]"
             except Exception as e:
-                chunk_summaries.append(f"[段{i+1}] [压缩异常]")
                 safe_print(f"         ❌ 第{i+1}段压缩异常: {e}")
+                return f"[段{i+1}] [压缩异常]"
+        
+        chunk_summaries = self._map_chunks(summarize_chunk, len(chunks))
         
-        # 合并所有段的总结
-        final_summary = "\n\n".join(chunk_summaries)
+        # 合并所有段的总结（合并失败时按段拼接）
+        merged_summary = self._merge_chunk_results(chunk_summaries, target_tokens, context_info, "历史动作总结")
+        final_summary = merged_summary or "\n\n".join(chunk_summaries)
         
         safe_print(f"      ✅ 分段压缩完成，共{len(chunks)}段")
         
@@ -391,7 +716,8 @@ class ActionCompressor:
                 "output": final_summary,
                 "_is_summary": True,
                 "_chunked": True,
-                "_chunks_count": len(chunks)
+                "_chunks_count": len(chunks),
+                "_merged": merged_summary is not None
             }
         }
     
@@ -461,6 +787,8 @@ class ActionCompressor:
                     field_context=field_context,
                     max_context_window=max_context_window
                 )
+                # 浅拷贝共享result字典，复制后再改，避免篡改原始action（渲染缓存按对象命中）
+                compressed_action["result"] = dict(compressed_action["result"])
                 compressed_action["result"]["output"] = compressed_output
                 compressed_action["result"]["_compressed"] = True
                 compressed_action["result"]["_original_tokens"] = output_tokens
@@ -568,12 +896,12 @@ class ActionCompressor:
             
             history = [ChatMessage(role="user", content=prompt)]
             
-            response = self.llm_client.chat(
+            response = self._compress_chat(
+                f"field:{content_type}",
+                text,
+                target_tokens,
                 history=history,
-                model=self.llm_client.compressor_models[0],
-                system_prompt=f"你是智能内容压缩助手。目标：将{content_type}压缩到{target_tokens} tokens，同时保留核心信息。",
-                tool_list=[],
-                tool_choice="auto"
+                system_prompt=f"你是智能内容压缩助手。目标：将{content_type}压缩到{target_tokens} tokens，同时保留核心信息。"
             )
             
             compressed = response.output if response.status == "success" else text[:1000] + "\n[压缩失败，仅保留前1000字符]"
@@ -666,11 +994,11 @@ class ActionCompressor:
         if field_context:
             context_info += f"\n<字段来源>\n这是最新动作中 {field_context} 的内容\n</字段来源>\n"
         
-        # 压缩每个chunk
-        chunk_results = []
+        # 压缩每个chunk（并发，结果按段序排列）
         target_per_chunk = target_tokens // len(chunks)
         
-        for i, chunk in enumerate(chunks):
+        def compress_chunk(i: int) -> str:
+            chunk = chunks[i]
             safe_print(f"         压缩字段第 {i+1}/{len(chunks)} 段...")
             
             prompt = f"""你是智能内容压缩助手。这是分段压缩的第 {i+1}/{len(chunks)} 段{content_type}。
@@ -692,31 +1020,117 @@ class ActionCompressor:
             history = [ChatMessage(role="user", content=prompt)]
             
             try:
-                response = self.llm_client.chat(
+                response = self._compress_chat(
+                    f"field_chunk:{content_type}",
+                    chunk,
+                    target_per_chunk,
                     history=history,
-                    model=self.llm_client.compressor_models[0],
-                    system_prompt=f"压缩专家。目标：将本段压缩到{target_per_chunk} tokens。",
-                    tool_list=[],
-                    tool_choice="auto"
+                    system_prompt=f"压缩专家。目标：将本段压缩到{target_per_chunk} tokens。"
                 )
                 
                 if response.status == "success":
-                    chunk_results.append(response.output)
                     safe_print(f"            ✅ 第{i+1}段压缩成功")
-                else:
-                    chunk_results.append(chunk[:500] + "\n[本段压缩失败]")
-                    safe_print(f"            ⚠️ 第{i+1}段压缩失败")
+                    return response.output
+                safe_print(f"            ⚠️ 第{i+1}段压缩失败")
+                return chunk[:500] + "\n[本段压缩失败]"
             except Exception as e:
-                chunk_results.append(chunk[:500] + "\n[本段压缩异常]")
                 safe_print(f"            ❌ 第{i+1}段压缩异常: {e}")
+                return chunk[:500] + "\n[本段压缩异常]"
         
-        # 合并结果
-        final_result = '\n\n---\n\n'.join(chunk_results)
+        chunk_results = self._map_chunks(compress_chunk, len(chunks))
+        
+        # 合并结果（合并失败时按段拼接）
+        final_result = (self._merge_chunk_results(chunk_results, target_tokens, context_info, content_type)
+                        or '\n\n---\n\n'.join(chunk_results))
         
         safe_print(f"         ✅ 字段分段压缩完成，共{len(chunks)}段")
         
         return final_result
     
+    def _map_chunks(self, compress_chunk: Callable[[int], str], count: int) -> List[str]:
+        """
+        并发压缩各段，结果按段序返回（与串行执行一致）
+        
+        每段在调用方上下文的副本中执行，用量归属（usage_scope）随之传递；
+        总耗时约为最慢一段，而不是各段之和
+        """
+        workers = min(count, self.max_parallel_chunks)
+        if workers <= 1:
+            return [compress_chunk(i) for i in range(count)]
+        
+        contexts = [contextvars.copy_context() for _ in range(count)]
+        
+        def run(i: int) -> str:
+            with get_tracer().track(f"compress_chunk_{i + 1}"):
+                return compress_chunk(i)
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compress-chunk") as pool:
+            return list(pool.map(lambda i: contexts[i].run(run, i), range(count)))
+    
+    def _merge_chunk_results(
+        self,
+        chunk_results: List[str],
+        target_tokens: int,
+        context_info: str,
+        content_type: str
+    ) -> Optional[str]:
+        """
+        合并各段的压缩结果：去除段间重复、统一时间线，并控制总长度
+        
+        Returns:
+            合并后的文本（只有一段、未启用合并或合并失败时返回None）
+        """
+        if not self.merge_chunks or len(chunk_results) <= 1:
+            return None
+        return self._llm_merge(chunk_results, target_tokens, context_info, content_type)
+    
+    def _llm_merge(
+        self,
+        chunk_results: List[str],
+        target_tokens: int,
+        context_info: str,
+        content_type: str
+    ) -> Optional[str]:
+        """调用压缩模型合并按顺序排列的若干段文本（失败返回None）"""
+        from services.llm_client import ChatMessage
+        
+        parts = "\n\n".join(
+            f"<第{i+1}段>\n{result}\n</第{i+1}段>" for i, result in enumerate(chunk_results)
+        )
+        prompt = f"""你是智能内容压缩助手。以下是同一份{content_type}按顺序分段压缩后的 {len(chunk_results)} 段结果，请合并为一份完整的结果。
+
+{context_info}
+
+<分段压缩结果>
+{parts}
+</分段压缩结果>
+
+合并要求：
+1. **目标长度**: 严格控制在 {target_tokens} tokens 以内
+2. **保持顺序**: 按段的先后顺序组织内容
+3. **去除重复**: 合并各段之间重复或相互覆盖的信息，以后面的段为准
+4. **保留关键信息**: 文件路径、重要数据、关键结果不得丢失
+
+请直接输出合并后的内容："""
+        
+        safe_print(f"      🔗 合并 {len(chunk_results)} 段压缩结果...")
+        try:
+            response = self._compress_chat(
+                f"merge:{content_type}",
+                parts,
+                target_tokens,
+                history=[ChatMessage(role="user", content=prompt)],
+                system_prompt=f"你是内容压缩专家。目标：将各段结果合并到{target_tokens} tokens以内。"
+            )
+        except Exception as e:
+            safe_print(f"      ⚠️ 合并异常，按段拼接: {e}")
+            return None
+        
+        if response.status != "success" or not response.output:
+            safe_print("      ⚠️ 合并失败，按段拼接")
+            return None
+        return response.output
+    
     def _fallback_compress(self, text: str, max_tokens: int) -> str:
         """
         备用压缩方案（首尾保留法）- 当LLM压缩失败时使用
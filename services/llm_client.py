@@ -6,12 +6,24 @@ from utils.windows_compat import safe_print
 """
 
 import os
+import json
+import time
+import random
+import asyncio
+import threading
+import contextvars
 import yaml
-from typing import List, Dict, Any, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Any, Optional, Callable
 from dataclasses import dataclass
 from pathlib import Path
-from litellm import completion  # 直接导入completion函数
+from litellm import completion, acompletion  # 直接导入completion函数
 import litellm
+from utils.llm_scheduler import get_llm_scheduler, PRIORITY_DEFAULT
+from utils.tracer import get_tracer
+from utils.usage_ledger import get_usage_ledger
 
 
 @dataclass
@@ -19,6 +31,7 @@ class ChatMessage:
     """聊天消息"""
     role: str
     content: str
+    cache: bool = False  # 是否为提示词缓存断点（prompt_cache 模式下添加 cache_control）
 
 
 @dataclass
@@ -39,27 +52,172 @@ class LLMResponse:
     finish_reason: str
     usage: Optional[Dict] = None
     error_information: str = ""
+    from_cache: bool = False  # 是否来自响应缓存/cassette（未调用LLM提供商）
 
 
-class SimpleLLMClient:
-    """简化的LLM客户端 - 基于LiteLLM"""
+def _extract_usage(usage) -> Optional[Dict]:
+    """
+    提取usage信息（包含提供商提示词缓存命中的token数）
     
-    def __init__(self, llm_config_path: str = None, tools_config_path: str = None):
+    cached_tokens: OpenAI prompt_tokens_details.cached_tokens / Anthropic cache_read_input_tokens
+    cache_creation_tokens: Anthropic cache_creation_input_tokens
+    """
+    if not usage:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) if details is not None else None
+    if not cached_tokens:
+        cached_tokens = getattr(usage, 'cache_read_input_tokens', None)
+    return {
+        "prompt_tokens": getattr(usage, 'prompt_tokens', 0),
+        "completion_tokens": getattr(usage, 'completion_tokens', 0),
+        "total_tokens": getattr(usage, 'total_tokens', 0),
+        "cached_tokens": cached_tokens or 0,
+        "cache_creation_tokens": getattr(usage, 'cache_creation_input_tokens', None) or 0
+    }
+
+
+# 可重试的HTTP状态码和异常类型（litellm / httpx / openai 的临时错误）
+_RETRYABLE_STATUS_CODES = {408, 409, 429}
+_RETRYABLE_ERRORS = {
+    "RateLimitError", "Timeout", "APITimeoutError", "APIConnectionError",
+    "ServiceUnavailableError", "InternalServerError",
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "ReadError", "RemoteProtocolError"
+}
+
+
+# 流式输出中途失败、重试或回退到其他模型时发送给前端的通知
+RETRY_NOTICE = "LLM调用中断，正在重试（之前输出的部分内容作废）"
+
+
+class _StreamAssembler:
+    """
+    流式响应组装器 - 逐块累积文本增量和工具调用参数
+    
+    文本增量通过 EventEmitter.token 实时转发；某个工具调用的参数完整后
+    （下一个工具调用开始或流结束时）立即回调 on_tool_call
+    
+    重试/回退的尝试（retried=True）：之前的尝试可能已转发了部分文本，先发出通知，
+    本次的文本在流完整结束后再一次性转发，避免前端出现重复或拼接的输出
+    """
+    
+    def __init__(self, model: str, on_tool_call: Callable = None, retried: bool = False):
+        from utils.event_emitter import get_event_emitter
+        self.emitter = get_event_emitter()
+        self.model = model
+        self.on_tool_call = on_tool_call
+        self.hold_text = retried
+        if retried and self.emitter.enabled:
+            self.emitter.notice(RETRY_NOTICE)
+        # 每个组装器对应一次（重）试：通知回调新的尝试开始（重试/回退会重放工具调用）
+        begin_attempt = getattr(on_tool_call, "begin_attempt", None)
+        if begin_attempt:
+            begin_attempt()
+        self.text_parts = []
+        self.tool_calls = []
+        self.current = None  # 正在组装的工具调用 {"index", "id", "name", "arguments"}
+        self.finish_reason = None
+        self.usage = None
+    
+    def feed(self, chunk):
+        """处理一个流式块"""
+        if getattr(chunk, "model", None):
+            self.model = chunk.model
+        chunk_usage = getattr(chunk, "usage", None)
+        if chunk_usage:
+            self.usage = _extract_usage(chunk_usage)
+        if not getattr(chunk, "choices", None):
+            return
+        
+        choice = chunk.choices[0]
+        if getattr(choice, "finish_reason", None):
+            self.finish_reason = choice.finish_reason
+        delta = getattr(choice, "delta", None)
+        if delta is None:
+            return
+        
+        # 文本增量：实时转发
+        content = getattr(delta, "content", None)
+        if content:
+            self.text_parts.append(content)
+            if self.emitter.enabled and not self.hold_text:
+                self.emitter.token(content)
+        
+        # 工具调用增量：按 index 累积参数
+        for tc in getattr(delta, "tool_calls", None) or []:
+            index = getattr(tc, "index", None)
+            if index is None:
+                index = self.current["index"] if self.current else 0
+            if self.current is None or index != self.current["index"]:
+                self._complete_current()
+                self.current = {"index": index, "id": "", "name": "", "arguments": ""}
+            if getattr(tc, "id", None):
+                self.current["id"] = tc.id
+            function = getattr(tc, "function", None)
+            if function is not None:
+                if getattr(function, "name", None):
+                    self.current["name"] += function.name
+                if getattr(function, "arguments", None):
+                    self.current["arguments"] += function.arguments
+    
+    def _complete_current(self):
+        """当前工具调用的参数已完整：解析并回调"""
+        if self.current is None:
+            return
+        try:
+            arguments = json.loads(self.current["arguments"]) if self.current["arguments"] else {}
+        except Exception:
+            arguments = {}
+        tool_call = ToolCall(
+            id=self.current["id"],
+            name=self.current["name"],
+            arguments=arguments
+        )
+        self.tool_calls.append(tool_call)
+        self.current = None
+        if self.on_tool_call:
+            try:
+                self.on_tool_call(tool_call)
+            except Exception as e:
+                safe_print(f"⚠️ 提前分发工具调用失败: {e}")
+    
+    def finish(self) -> LLMResponse:
+        """流结束：完成最后一个工具调用并组装响应"""
+        self._complete_current()
+        output = "".join(self.text_parts)
+        if self.hold_text and output and self.emitter.enabled:
+            self.emitter.token(output)
+        return LLMResponse(
+            status="success",
+            output=output,
+            tool_calls=self.tool_calls,
+            model=self.model,
+            finish_reason=self.finish_reason or "stop",
+            usage=self.usage
+        )
+
+
+class LLMRuntime:
+    """
+    进程级LLM运行时 - 所有Agent、子Agent和Thinking共享
+    
+    - llm_config.yaml 只读取、解析一次（文件修改后自动重新加载）
+    - litellm 使用共享的 keep-alive 连接池（httpx 按 api_base 的 host 维护连接，避免重复TLS握手）
+    - 按工具列表缓存构建好的工具定义
+    - 重试/对冲请求的策略、每个模型的延迟统计和调用统计
+    """
+    
+    def __init__(self, llm_config_path):
         """
-        初始化LLM客户端
+        加载并解析LLM配置
         
         Args:
             llm_config_path: LLM配置文件路径
-            tools_config_path: 工具配置文件路径
         """
-        # 加载LLM配置
-        if llm_config_path is None:
-            project_root = Path(__file__).parent.parent
-            llm_config_path = project_root / "config" / "run_env_config" / "llm_config.yaml"
-        
         if not os.path.exists(llm_config_path):
             raise FileNotFoundError(f"LLM配置文件不存在: {llm_config_path}")
         
+        self.config_path = str(llm_config_path)
         with open(llm_config_path, 'r', encoding='utf-8') as f:
             self.config = yaml.safe_load(f)
         
@@ -79,23 +237,33 @@ class SimpleLLMClient:
         self._parse_models_config(self.config.get("models", []), self.models)
         self._parse_models_config(self.config.get("figure_models", []), self.figure_models)
         self._parse_models_config(self.config.get("compressor_models", []), self.compressor_models)
-
         
-        if not self.api_key:
+        # 响应缓存（llm_cache: off / cache / record / replay）
+        from services.llm_response_cache import create_response_cache
+        self.response_cache = create_response_cache()
+        
+        # 回放模式不访问LLM提供商，不需要API密钥
+        if not self.api_key and not self.response_cache.replay_only:
             raise ValueError("未配置API密钥")
         
         if not self.models:
             raise ValueError("未配置可用模型列表")
         
-        # 加载工具配置
-        self.tools_config = {}
-        if tools_config_path and os.path.exists(tools_config_path):
-            with open(tools_config_path, 'r', encoding='utf-8') as f:
-                self.tools_config = yaml.safe_load(f)
+        # 工具定义缓存：(id(tools_config), 工具列表) -> (tools_config, 工具定义)
+        self._tool_definitions = {}
+        self._lock = threading.Lock()
         
         # 配置LiteLLM
         litellm.set_verbose = False  # 关闭详细日志
         litellm.drop_params = True  # 自动丢弃不支持的参数（如Anthropic不支持parallel_tool_calls）
+        self._setup_connection_pool()
+        
+        # 重试、对冲请求和模型回退（llm_retry）
+        from utils.runtime_config import get_runtime_option
+        self.retry_config = get_runtime_option("llm_retry", {}) or {}
+        self._latencies = {}  # 模型 -> 最近成功调用的耗时（秒）
+        self._hedge_pool = None
+        self.call_stats = {"calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "fallbacks": 0, "failures": 0}
         
         safe_print(f"✅ LLM客户端初始化成功（LiteLLM）")
         safe_print(f"   Base URL: {self.base_url}")
@@ -137,6 +305,168 @@ class SimpleLLMClient:
             else:
                 safe_print(f"⚠️ 不支持的模型配置格式，跳过: {model_item}")
     
+    def _setup_connection_pool(self):
+        """为 litellm 配置共享的 keep-alive 连接池（同步调用）"""
+        from utils.runtime_config import get_runtime_option
+        if not get_runtime_option("llm_runtime.connection_pool", True):
+            return
+        try:
+            import httpx
+        except ImportError:
+            return
+        
+        if getattr(litellm, "client_session", None) is None:
+            limits = httpx.Limits(
+                max_connections=get_runtime_option("llm_runtime.max_connections", 20),
+                max_keepalive_connections=get_runtime_option("llm_runtime.max_keepalive_connections", 10),
+                keepalive_expiry=get_runtime_option("llm_runtime.keepalive_expiry", 60)
+            )
+            litellm.client_session = httpx.Client(limits=limits, timeout=httpx.Timeout(600.0))
+    
+    def get_tool_definitions(self, tools_config: Dict, tool_list: List[str]) -> List[Dict]:
+        """
+        获取工具定义（OpenAI格式），按 (工具配置, 工具列表) 缓存
+        
+        Args:
+            tools_config: 工具配置字典（ConfigLoader.all_tools）
+            tool_list: 工具名称列表
+        """
+        key = (id(tools_config), tuple(tool_list))
+        cached = self._tool_definitions.get(key)
+        if cached is not None and cached[0] is tools_config:
+            return list(cached[1])
+        
+        tools = []
+        for tool_name in tool_list:
+            if tool_name in tools_config:
+                tool_config = tools_config[tool_name]
+                tools.append({
+                    "type": "function",
+                    "function": {
+                        "name": tool_config.get("name", tool_name),
+                        "description": tool_config.get("description", ""),
+                        "parameters": tool_config.get("parameters", {})
+                    }
+                })
+        
+        with self._lock:
+            # 保存 tools_config 引用，保证 id 不会被复用
+            self._tool_definitions[key] = (tools_config, tools)
+        return list(tools)
+
+
+    def record_latency(self, model: str, seconds: float):
+        """记录一次成功调用的耗时（用于计算对冲请求的触发阈值）"""
+        with self._lock:
+            latencies = self._latencies.get(model)
+            if latencies is None:
+                latencies = self._latencies[model] = deque(maxlen=200)
+            latencies.append(seconds)
+    
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """
+        对冲请求的触发时间：该模型最近调用耗时的指定百分位
+        
+        Returns:
+            秒数；未启用对冲或样本不足时返回None
+        """
+        hedge_config = self.retry_config.get("hedge", {}) or {}
+        if not hedge_config.get("enabled", False):
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies.get(model, ()))
+        if len(latencies) < hedge_config.get("min_samples", 20):
+            return None
+        percentile = hedge_config.get("percentile", 95)
+        threshold = latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+        return max(threshold, hedge_config.get("min_delay", 1.0))
+    
+    def get_hedge_pool(self) -> ThreadPoolExecutor:
+        """同步对冲请求使用的线程池"""
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+            return self._hedge_pool
+    
+    def count(self, name: str, n: int = 1):
+        """累加调用统计"""
+        with self._lock:
+            self.call_stats[name] += n
+    
+    def get_call_stats(self) -> Dict:
+        """获取调用统计（调用次数、尝试次数、重试、对冲、回退、失败）"""
+        with self._lock:
+            return dict(self.call_stats)
+
+
+_runtime = None
+_runtime_mtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_llm_runtime(llm_config_path: str = None) -> LLMRuntime:
+    """
+    获取进程级LLM运行时（配置文件修改后自动重新加载）
+    
+    Args:
+        llm_config_path: LLM配置文件路径（None则使用 llm_runtime.config_path 或默认配置）
+        
+    Returns:
+        LLMRuntime实例
+    """
+    global _runtime, _runtime_mtime
+    if llm_config_path is None:
+        from utils.runtime_config import get_runtime_option
+        llm_config_path = get_runtime_option("llm_runtime.config_path")
+    if llm_config_path is None:
+        project_root = Path(__file__).parent.parent
+        llm_config_path = project_root / "config" / "run_env_config" / "llm_config.yaml"
+    
+    if not os.path.exists(llm_config_path):
+        raise FileNotFoundError(f"LLM配置文件不存在: {llm_config_path}")
+    
+    mtime = os.path.getmtime(llm_config_path)
+    with _runtime_lock:
+        if _runtime is None or _runtime.config_path != str(llm_config_path) or _runtime_mtime != mtime:
+            if _runtime is not None:
+                safe_print(f"🔄 检测到LLM配置变化，重新加载: {llm_config_path}")
+            _runtime = LLMRuntime(llm_config_path)
+            _runtime_mtime = mtime
+        return _runtime
+
+
+class SimpleLLMClient:
+    """简化的LLM客户端 - 基于LiteLLM"""
+    
+    def __init__(self, llm_config_path: str = None, tools_config_path: str = None):
+        """
+        初始化LLM客户端（配置、连接池和工具定义缓存借用进程级 LLMRuntime）
+        
+        Args:
+            llm_config_path: LLM配置文件路径
+            tools_config_path: 工具配置文件路径
+        """
+        self.runtime = get_llm_runtime(llm_config_path)
+        
+        # 读取配置
+        self.config = self.runtime.config
+        self.base_url = self.runtime.base_url
+        self.api_key = self.runtime.api_key
+        self.temperature = self.runtime.temperature
+        self.max_tokens = self.runtime.max_tokens
+        self.max_context_window = self.runtime.max_context_window  # 上下文窗口限制
+        self.models = self.runtime.models  # 模型名称列表
+        self.figure_models = self.runtime.figure_models
+        self.compressor_models = self.runtime.compressor_models
+        self.model_configs = self.runtime.model_configs  # 模型名称 -> 配置字典
+        self.response_cache = self.runtime.response_cache
+        
+        # 加载工具配置
+        self.tools_config = {}
+        if tools_config_path and os.path.exists(tools_config_path):
+            with open(tools_config_path, 'r', encoding='utf-8') as f:
+                self.tools_config = yaml.safe_load(f)
+    
     def chat(
         self,
         history: List[ChatMessage],
@@ -145,7 +475,13 @@ class SimpleLLMClient:
         tool_list: List[str],
         tool_choice: str = "required",
         temperature: float = None,
-        max_tokens: int = None
+        max_tokens: int = None,
+        parallel_tool_calls: bool = False,
+        stream: bool = False,
+        on_tool_call: Callable = None,
+        prompt_cache: bool = False,
+        priority: int = None,
+        purpose: str = None
     ) -> LLMResponse:
         """
         调用LLM进行对话
@@ -158,146 +494,618 @@ class SimpleLLMClient:
             tool_choice: 工具选择策略
             temperature: 温度参数（None则使用配置文件默认值）
             max_tokens: 最大token数（None则使用配置文件默认值）
+            parallel_tool_calls: 是否允许一次返回多个工具调用
+            stream: 是否使用流式响应（文本增量实时转发到 EventEmitter）
+            on_tool_call: 流式模式下每个工具调用参数完整时的回调（用于提前执行工具；
+                回调对象可提供 begin_attempt()，每次重试/回退开始时调用）
+            prompt_cache: 为系统提示词和 cache=True 的消息添加提供商缓存标记（Anthropic cache_control）
+            priority: 限流排队优先级（越小越先发送，见 utils/llm_scheduler.py，None为默认优先级）
+            purpose: 调用用途（agent_turn / thinking / compression / history_compression），记入用量账本
+            
+        Returns:
+            LLMResponse对象
+        """
+        self.runtime.count("calls")
+        start = time.perf_counter()
+        if priority is None:
+            priority = PRIORITY_DEFAULT
+        attempts = []
+        last_error = None
+        for attempt_model in self._model_chain(model):
+            if attempt_model != model:
+                safe_print(f"🔁 回退到模型: {attempt_model}")
+                self.runtime.count("fallbacks")
+            try:
+                kwargs = self._build_request(
+                    history, attempt_model, system_prompt, tool_list, tool_choice,
+                    temperature, max_tokens, parallel_tool_calls, stream, prompt_cache
+                )
+                cached_response = self._cached_response(kwargs, attempt_model, stream, on_tool_call, bool(attempts))
+                if cached_response is not None:
+                    return self._record_usage(cached_response, purpose, start)
+                
+                llm_response = self._complete_with_retry(kwargs, attempt_model, stream, on_tool_call, attempts, priority)
+            except Exception as e:
+                last_error = e
+                continue
             
+            self._store_response(kwargs, llm_response)
+            return self._record_usage(self._with_attempts(llm_response, attempts), purpose, start)
+        
+        self.runtime.count("failures")
+        return self._record_usage(self._with_attempts(self._error_response(model, last_error), attempts), purpose, start)
+    
+    async def achat(
+        self,
+        history: List[ChatMessage],
+        model: str,
+        system_prompt: str,
+        tool_list: List[str],
+        tool_choice: str = "required",
+        temperature: float = None,
+        max_tokens: int = None,
+        parallel_tool_calls: bool = False,
+        stream: bool = False,
+        on_tool_call: Callable = None,
+        prompt_cache: bool = False,
+        priority: int = None,
+        purpose: str = None
+    ) -> LLMResponse:
+        """
+        异步调用LLM进行对话（基于 litellm.acompletion，参数与 chat 相同，
+        流式模式下 on_tool_call 在事件循环中同步回调）
+        
         Returns:
             LLMResponse对象
         """
+        self.runtime.count("calls")
+        start = time.perf_counter()
+        if priority is None:
+            priority = PRIORITY_DEFAULT
+        attempts = []
+        last_error = None
+        for attempt_model in self._model_chain(model):
+            if attempt_model != model:
+                safe_print(f"🔁 回退到模型: {attempt_model}")
+                self.runtime.count("fallbacks")
+            try:
+                kwargs = self._build_request(
+                    history, attempt_model, system_prompt, tool_list, tool_choice,
+                    temperature, max_tokens, parallel_tool_calls, stream, prompt_cache
+                )
+                cached_response = self._cached_response(kwargs, attempt_model, stream, on_tool_call, bool(attempts))
+                if cached_response is not None:
+                    return self._record_usage(cached_response, purpose, start)
+                
+                llm_response = await self._acomplete_with_retry(kwargs, attempt_model, stream, on_tool_call, attempts, priority)
+            except Exception as e:
+                last_error = e
+                continue
+            
+            self._store_response(kwargs, llm_response)
+            return self._record_usage(self._with_attempts(llm_response, attempts), purpose, start)
+        
+        self.runtime.count("failures")
+        return self._record_usage(self._with_attempts(self._error_response(model, last_error), attempts), purpose, start)
+    
+    def _model_chain(self, model: str) -> List[str]:
+        """
+        本次调用依次尝试的模型（llm_retry.fallback_models 开启时，
+        按配置顺序追加同一模型列表中的其他模型）
+        """
+        if not self.runtime.retry_config.get("fallback_models", False):
+            return [model]
+        for model_group in (self.models, self.compressor_models, self.figure_models):
+            if model in model_group:
+                return [model] + [m for m in model_group if m != model]
+        return [model]
+    
+    def _complete_once(self, kwargs: Dict, model: str, stream: bool, on_tool_call: Callable = None,
+                       priority: int = PRIORITY_DEFAULT, retried: bool = False) -> LLMResponse:
+        """调用一次 completion（先在限流调度器中排队；调用异常直接抛出，并归还预估的token）"""
+        scheduler = get_llm_scheduler()
+        grant = None
+        if scheduler.enabled:
+            tokens = scheduler.estimate_tokens(kwargs["messages"], kwargs.get("tools"), kwargs.get("max_tokens"))
+            with get_tracer().span("llm_queue", "llm", model=model, priority=priority, tokens=tokens):
+                grant = scheduler.acquire(model, tokens, priority)
+        
+        usage = {"total_tokens": 0}  # 调用异常时归还预估的token
+        try:
+            if stream:
+                assembler = _StreamAssembler(model, on_tool_call, retried)
+                for chunk in completion(**kwargs):
+                    assembler.feed(chunk)
+                llm_response = assembler.finish()
+            else:
+                response = completion(**kwargs)  # 使用导入的函数
+                llm_response = self._parse_response(response, model)
+            usage = llm_response.usage
+        finally:
+            scheduler.settle(grant, usage)
+        return llm_response
+    
+    async def _acomplete_once(self, kwargs: Dict, model: str, stream: bool, on_tool_call: Callable = None,
+                              priority: int = PRIORITY_DEFAULT, retried: bool = False) -> LLMResponse:
+        """调用一次 acompletion（先在限流调度器中排队；调用异常直接抛出，并归还预估的token）"""
+        scheduler = get_llm_scheduler()
+        grant = None
+        if scheduler.enabled:
+            tokens = scheduler.estimate_tokens(kwargs["messages"], kwargs.get("tools"), kwargs.get("max_tokens"))
+            with get_tracer().span("llm_queue", "llm", model=model, priority=priority, tokens=tokens):
+                grant = await scheduler.acquire_async(model, tokens, priority)
+        
+        usage = {"total_tokens": 0}  # 调用异常（含取消）时归还预估的token
+        try:
+            if stream:
+                assembler = _StreamAssembler(model, on_tool_call, retried)
+                async for chunk in await acompletion(**kwargs):
+                    assembler.feed(chunk)
+                llm_response = assembler.finish()
+            else:
+                response = await acompletion(**kwargs)
+                llm_response = self._parse_response(response, model)
+            usage = llm_response.usage
+        finally:
+            scheduler.settle(grant, usage)
+        return llm_response
+    
+    def _complete_with_retry(self, kwargs: Dict, model: str, stream: bool, on_tool_call: Callable, attempts: List[Dict],
+                             priority: int = PRIORITY_DEFAULT) -> LLMResponse:
+        """
+        调用LLM，临时错误（429/5xx/超时/连接错误）按带抖动的指数退避重试，优先遵循 Retry-After
+        
+        Args:
+            attempts: 尝试记录列表（每次尝试追加一条）
+        """
+        max_retries = int(self.runtime.retry_config.get("max_retries", 3))
+        for retry in range(max_retries + 1):
+            start = time.perf_counter()
+            self.runtime.count("attempts")
+            try:
+                llm_response = self._complete_with_hedge(kwargs, model, stream, on_tool_call, attempts, priority)
+            except Exception as e:
+                attempts.append(self._attempt_record(model, "error", start, e))
+                if retry >= max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._retry_delay(retry, e)
+                safe_print(f"⚠️ LLM调用失败（{type(e).__name__}），{delay:.1f}秒后重试 ({retry + 1}/{max_retries})")
+                self.runtime.count("retries")
+                time.sleep(delay)
+                continue
+            
+            attempts.append(self._attempt_record(model, "success", start))
+            self.runtime.record_latency(model, time.perf_counter() - start)
+            return llm_response
+    
+    async def _acomplete_with_retry(self, kwargs: Dict, model: str, stream: bool, on_tool_call: Callable, attempts: List[Dict],
+                                    priority: int = PRIORITY_DEFAULT) -> LLMResponse:
+        """调用LLM并重试临时错误（异步版本，见 _complete_with_retry）"""
+        max_retries = int(self.runtime.retry_config.get("max_retries", 3))
+        for retry in range(max_retries + 1):
+            start = time.perf_counter()
+            self.runtime.count("attempts")
+            try:
+                llm_response = await self._acomplete_with_hedge(kwargs, model, stream, on_tool_call, attempts, priority)
+            except Exception as e:
+                attempts.append(self._attempt_record(model, "error", start, e))
+                if retry >= max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._retry_delay(retry, e)
+                safe_print(f"⚠️ LLM调用失败（{type(e).__name__}），{delay:.1f}秒后重试 ({retry + 1}/{max_retries})")
+                self.runtime.count("retries")
+                await asyncio.sleep(delay)
+                continue
+            
+            attempts.append(self._attempt_record(model, "success", start))
+            self.runtime.record_latency(model, time.perf_counter() - start)
+            return llm_response
+    
+    def _complete_with_hedge(self, kwargs: Dict, model: str, stream: bool, on_tool_call: Callable, attempts: List[Dict],
+                             priority: int = PRIORITY_DEFAULT) -> LLMResponse:
+        """
+        调用LLM；耗时超过该模型延迟百分位阈值时再发送一个相同的对冲请求，使用先成功的结果
+        
+        两个请求都会计费（对冲最多使花费翻倍）：落后的请求无法中止，结束时记为
+        hedge_loser 尝试并写入用量账本
+        流式请求不对冲（工具调用回调和文本转发会重复）
+        """
+        hedge_delay = None if stream else self.runtime.hedge_delay(model)
+        if hedge_delay is None:
+            return self._complete_once(kwargs, model, stream, on_tool_call, priority, bool(attempts))
+        
+        pool = self.runtime.get_hedge_pool()
+        starts = {}
+        future = pool.submit(self._complete_once, kwargs, model, False, None, priority)
+        starts[future] = time.perf_counter()
+        done, _ = wait(list(starts), timeout=hedge_delay)
+        if not done:
+            safe_print(f"   ⏱️ LLM调用超过 {hedge_delay:.1f} 秒，发送对冲请求")
+            self.runtime.count("hedges")
+            self.runtime.count("attempts")
+            attempts.append({"model": model, "outcome": "hedge", "latency_ms": int(hedge_delay * 1000)})
+            future = pool.submit(self._complete_once, kwargs, model, False, None, priority)
+            starts[future] = time.perf_counter()
+        
+        error = None
+        for future in as_completed(list(starts)):
+            try:
+                llm_response = future.result()
+            except Exception as e:
+                error = e
+                continue
+            context = contextvars.copy_context()
+            for loser, loser_start in starts.items():
+                if loser is not future and not loser.cancel():
+                    loser.add_done_callback(
+                        lambda f, loser_start=loser_start: context.run(
+                            self._record_hedge_loser, model, attempts, loser_start, f
+                        )
+                    )
+            return llm_response
+        raise error
+    
+    async def _acomplete_with_hedge(self, kwargs: Dict, model: str, stream: bool, on_tool_call: Callable, attempts: List[Dict],
+                                    priority: int = PRIORITY_DEFAULT) -> LLMResponse:
+        """
+        调用LLM并在超过延迟阈值时发送对冲请求（异步版本，落后的请求会被取消；
+        已经结束的落后请求同样记为 hedge_loser 尝试并写入用量账本）
+        """
+        hedge_delay = None if stream else self.runtime.hedge_delay(model)
+        if hedge_delay is None:
+            return await self._acomplete_once(kwargs, model, stream, on_tool_call, priority, bool(attempts))
+        
+        starts = {}
+        task = asyncio.ensure_future(self._acomplete_once(kwargs, model, False, None, priority))
+        starts[task] = time.perf_counter()
+        done, _ = await asyncio.wait(list(starts), timeout=hedge_delay)
+        if not done:
+            safe_print(f"   ⏱️ LLM调用超过 {hedge_delay:.1f} 秒，发送对冲请求")
+            self.runtime.count("hedges")
+            self.runtime.count("attempts")
+            attempts.append({"model": model, "outcome": "hedge", "latency_ms": int(hedge_delay * 1000)})
+            task = asyncio.ensure_future(self._acomplete_once(kwargs, model, False, None, priority))
+            starts[task] = time.perf_counter()
+        
+        error = None
+        winner = None
+        pending = set(starts)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = task.exception()
+        finally:
+            for task, task_start in starts.items():
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif winner is not None:
+                    self._record_hedge_loser(model, attempts, task_start, task)
+        if winner is None:
+            raise error
+        return winner.result()
+    
+    def _record_hedge_loser(self, model: str, attempts: List[Dict], start: float, future):
+        """
+        记录对冲中落后的请求（已经发出的请求同样计费）：追加 hedge_loser 尝试，并写入用量账本
+        
+        Args:
+            future: 结束的落后请求（concurrent.futures.Future 或 asyncio.Task）
+        """
+        error = future.exception()
+        usage = future.result().usage if error is None else None
+        record = self._attempt_record(model, "hedge_loser", start, error)
+        if usage:
+            record["total_tokens"] = usage.get("total_tokens", 0)
+        attempts.append(record)
+        get_usage_ledger().record(
+            "hedge_loser", model, usage, time.perf_counter() - start, "success" if error is None else "error"
+        )
+    
+    def _is_retryable(self, e: Exception) -> bool:
+        """是否为可重试的临时错误"""
+        status_code = getattr(e, "status_code", None)
+        if isinstance(status_code, int):
+            return status_code in _RETRYABLE_STATUS_CODES or status_code >= 500
+        return type(e).__name__ in _RETRYABLE_ERRORS
+    
+    def _retry_delay(self, retry: int, e: Exception) -> float:
+        """第 retry 次重试前的等待时间：Retry-After，否则为全抖动指数退避"""
+        retry_config = self.runtime.retry_config
+        retry_after = self._retry_after(e)
+        if retry_after is not None:
+            return min(retry_after, float(retry_config.get("max_retry_after", 120)))
+        base_delay = float(retry_config.get("base_delay", 1.0))
+        max_delay = float(retry_config.get("max_delay", 30))
+        return random.uniform(0, min(max_delay, base_delay * (2 ** retry)))
+    
+    def _retry_after(self, e: Exception) -> Optional[float]:
+        """从错误响应的 Retry-After / retry-after-ms 头读取等待秒数"""
+        headers = getattr(getattr(e, "response", None), "headers", None) or getattr(e, "litellm_response_headers", None)
+        if not headers:
+            return None
+        try:
+            value = headers.get("retry-after-ms") or headers.get("Retry-After-Ms")
+            if value:
+                return max(0.0, float(value) / 1000)
+            value = headers.get("retry-after") or headers.get("Retry-After")
+            if not value:
+                return None
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except Exception:
+            return None
+    
+    def _attempt_record(self, model: str, outcome: str, start: float, e: Exception = None) -> Dict:
+        """一次尝试的记录（写入 usage["attempts"]）"""
+        record = {"model": model, "outcome": outcome, "latency_ms": int((time.perf_counter() - start) * 1000)}
+        if e is not None:
+            record["error"] = f"{type(e).__name__}: {e}"[:300]
+        return record
+    
+    def _with_attempts(self, llm_response: LLMResponse, attempts: List[Dict]) -> LLMResponse:
+        """把所有尝试记录写入 usage"""
+        llm_response.usage = dict(llm_response.usage or {}, attempts=attempts)
+        return llm_response
+    
+    def _record_usage(self, llm_response: LLMResponse, purpose: str, start: float) -> LLMResponse:
+        """把本次调用（总耗时包含排队、重试和回退）记入当前任务的用量账本"""
+        get_usage_ledger().record(
+            purpose, llm_response.model, llm_response.usage, time.perf_counter() - start,
+            llm_response.status, llm_response.from_cache
+        )
+        return llm_response
+    
+    def _build_request(
+        self,
+        history: List[ChatMessage],
+        model: str,
+        system_prompt: str,
+        tool_list: List[str],
+        tool_choice: str,
+        temperature: float,
+        max_tokens: int,
+        parallel_tool_calls: bool,
+        stream: bool = False,
+        prompt_cache: bool = False
+    ) -> Dict:
+        """构建 completion/acompletion 的请求参数"""
         # 使用配置文件的默认值
         if temperature is None:
             temperature = self.temperature
         if max_tokens is None:
             max_tokens = self.max_tokens
         
-        try:
-            # 构建工具定义（OpenAI格式）
-            tools_definition = self._build_tools_definition(tool_list)
-            
-            # 转换消息格式
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend([{"role": msg.role, "content": msg.content} for msg in history])
-            
-            # 构建请求参数
-            kwargs = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature,
-                "api_key": self.api_key,
-            }
-            
-            # 只在 base_url 非空时添加 api_base（对于 Google/Anthropic 等官方 API，留空让 litellm 自动路由）
-            if self.base_url:
-                kwargs["api_base"] = self.base_url
-            
-            # 只在max_tokens > 0时添加
-            if max_tokens > 0:
-                kwargs["max_tokens"] = max_tokens
-            
-            # 添加工具定义
-            if tools_definition:
-                kwargs["tools"] = tools_definition
-                if tool_choice == "required":
-                    # litellm 会自动将 tool_choice 转换为各模型的格式
-                    # OpenAI: tool_choice="required"
-                    # Gemini: tool_config={function_calling_config: {mode: "ANY"}}
-                    kwargs["tool_choice"] = "required"
-                # 禁用并行工具调用（每次只调用一个工具）
-                # 注意：Gemini 不支持 parallel_tool_calls，但 litellm.drop_params=True 会自动丢弃
-                kwargs["parallel_tool_calls"] = False
-            
-            # 添加模型特定的额外参数
-            model_extra_params = self.model_configs.get(model, {})
-            if model_extra_params:
-                # 处理 provider 参数（OpenRouter 特定）
-                if "provider" in model_extra_params:
-                    if "extra_body" not in kwargs:
-                        kwargs["extra_body"] = {}
-                    kwargs["extra_body"]["provider"] = model_extra_params["provider"]
-                
-                # 处理 extra_headers
-                if "extra_headers" in model_extra_params:
-                    kwargs["extra_headers"] = model_extra_params["extra_headers"]
-                
-                # 处理 extra_body（合并到已有的 extra_body）
-                if "extra_body" in model_extra_params:
-                    if "extra_body" not in kwargs:
-                        kwargs["extra_body"] = {}
-                    kwargs["extra_body"].update(model_extra_params["extra_body"])
-                
-                safe_print(f"   ⚙️  应用模型额外参数: {list(model_extra_params.keys())}")
+        # 构建工具定义（OpenAI格式）
+        tools_definition = self._build_tools_definition(tool_list)
+        
+        # 转换消息格式（prompt_cache 模式下稳定前缀标记为缓存断点）
+        use_cache_control = prompt_cache and self._supports_cache_control(model)
+        messages = [{"role": "system", "content": self._message_content(system_prompt, use_cache_control)}]
+        messages.extend([
+            {"role": msg.role, "content": self._message_content(msg.content, use_cache_control and msg.cache)}
+            for msg in history
+        ])
+        
+        # 构建请求参数
+        kwargs = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "api_key": self.api_key,
+        }
+        
+        # 只在 base_url 非空时添加 api_base（对于 Google/Anthropic 等官方 API，留空让 litellm 自动路由）
+        if self.base_url:
+            kwargs["api_base"] = self.base_url
+        
+        # 只在max_tokens > 0时添加
+        if max_tokens > 0:
+            kwargs["max_tokens"] = max_tokens
+        
+        # 流式响应（请求在最后一个块中返回usage）
+        if stream:
+            kwargs["stream"] = True
+            kwargs["stream_options"] = {"include_usage": True}
+        
+        # 添加工具定义
+        if tools_definition:
+            kwargs["tools"] = tools_definition
+            if tool_choice == "required":
+                # litellm 会自动将 tool_choice 转换为各模型的格式
+                # OpenAI: tool_choice="required"
+                # Gemini: tool_config={function_calling_config: {mode: "ANY"}}
+                kwargs["tool_choice"] = "required"
+            # 默认禁用并行工具调用（每次只调用一个工具），开启并行模式时允许多个
+            # 注意：Gemini 不支持 parallel_tool_calls，但 litellm.drop_params=True 会自动丢弃
+            kwargs["parallel_tool_calls"] = parallel_tool_calls
+        
+        # 添加模型特定的额外参数
+        model_extra_params = self.model_configs.get(model, {})
+        if model_extra_params:
+            # 处理 provider 参数（OpenRouter 特定）
+            if "provider" in model_extra_params:
+                if "extra_body" not in kwargs:
+                    kwargs["extra_body"] = {}
+                kwargs["extra_body"]["provider"] = model_extra_params["provider"]
             
-            # 使用LiteLLM调用
-            # 添加调试信息
-            safe_print(f"   📝 System Prompt长度: {len(system_prompt)} 字符")
-            safe_print(f"   🔧 工具数量: {len(tools_definition)}")
-            safe_print(f"   📨 消息数量: {len(messages)}")
+            # 处理 extra_headers
+            if "extra_headers" in model_extra_params:
+                kwargs["extra_headers"] = model_extra_params["extra_headers"]
             
-            response = completion(**kwargs)  # 使用导入的函数
+            # 处理 extra_body（合并到已有的 extra_body）
+            if "extra_body" in model_extra_params:
+                if "extra_body" not in kwargs:
+                    kwargs["extra_body"] = {}
+                kwargs["extra_body"].update(model_extra_params["extra_body"])
             
-            # 解析响应（参考原项目的安全解析方式）
-            if response.choices and len(response.choices) > 0:
-                choice = response.choices[0]
-                message = choice.message
-                
-                output_text = message.content or ""
-                tool_calls = []
-                
-                # 安全解析工具调用
-                if hasattr(message, 'tool_calls') and message.tool_calls:
-                    for tc in message.tool_calls:
-                        import json
-                        # 安全解析参数
-                        try:
-                            if isinstance(tc.function.arguments, str):
-                                arguments = json.loads(tc.function.arguments)
-                            else:
-                                arguments = tc.function.arguments
-                        except:
-                            arguments = {}
-                        
-                        tool_calls.append(ToolCall(
-                            id=tc.id,
-                            name=tc.function.name,
-                            arguments=arguments
-                        ))
-                
-                # 安全提取usage信息
-                usage = None
-                if hasattr(response, 'usage') and response.usage:
-                    usage = {
-                        "prompt_tokens": getattr(response.usage, 'prompt_tokens', 0),
-                        "completion_tokens": getattr(response.usage, 'completion_tokens', 0),
-                        "total_tokens": getattr(response.usage, 'total_tokens', 0)
-                    }
-            else:
+            safe_print(f"   ⚙️  应用模型额外参数: {list(model_extra_params.keys())}")
+        
+        # 添加调试信息
+        safe_print(f"   📝 System Prompt长度: {len(system_prompt)} 字符")
+        safe_print(f"   🔧 工具数量: {len(tools_definition)}")
+        safe_print(f"   📨 消息数量: {len(messages)}")
+        
+        return kwargs
+    
+    def _cached_response(self, kwargs: Dict, model: str, stream: bool, on_tool_call: Callable = None,
+                         retried: bool = False) -> Optional[LLMResponse]:
+        """
+        从响应缓存/cassette查找响应（未启用或未命中返回None，回放模式未命中返回错误响应）
+        
+        流式模式下命中时同样转发文本并回调 on_tool_call，与实际流式响应的行为一致
+        （retried: 回退到其他模型前已有失败的尝试，先通知前端作废之前的部分输出）
+        """
+        if not self.response_cache.enabled:
+            return None
+        
+        data = self.response_cache.lookup(kwargs)
+        if data is None:
+            if self.response_cache.replay_only:
                 return LLMResponse(
                     status="error",
                     output="",
                     tool_calls=[],
                     model=model,
                     finish_reason="error",
-                    error_information="响应格式异常：缺少choices字段"
+                    error_information=f"回放模式下cassette中没有该请求的录制响应: {self.response_cache.cassette_path}"
                 )
-            
-            return LLMResponse(
-                status="success",
-                output=output_text,
-                tool_calls=tool_calls,
-                model=response.model,
-                finish_reason=response.choices[0].finish_reason,
-                usage=usage
-            )
+            return None
         
-        except Exception as e:
-            import traceback
-            error_detail = traceback.format_exc()
+        llm_response = LLMResponse(
+            status=data["status"],
+            output=data["output"],
+            tool_calls=[ToolCall(**tc) for tc in data["tool_calls"]],
+            model=data["model"],
+            finish_reason=data["finish_reason"],
+            usage=data.get("usage"),
+            from_cache=True
+        )
+        safe_print(f"   💾 命中LLM响应缓存（{self.response_cache.mode}）")
+        
+        if stream:
+            from utils.event_emitter import get_event_emitter
+            emitter = get_event_emitter()
+            if retried and emitter.enabled:
+                emitter.notice(RETRY_NOTICE)
+            if llm_response.output and emitter.enabled:
+                emitter.token(llm_response.output)
+            begin_attempt = getattr(on_tool_call, "begin_attempt", None)
+            if begin_attempt:
+                begin_attempt()
+            for tool_call in llm_response.tool_calls:
+                if on_tool_call:
+                    try:
+                        on_tool_call(tool_call)
+                    except Exception as e:
+                        safe_print(f"⚠️ 提前分发工具调用失败: {e}")
+        return llm_response
+    
+    def _store_response(self, kwargs: Dict, llm_response: LLMResponse):
+        """保存成功的响应到响应缓存/cassette"""
+        if not self.response_cache.enabled or llm_response.status != "success":
+            return
+        self.response_cache.store(kwargs, {
+            "status": llm_response.status,
+            "output": llm_response.output,
+            "tool_calls": [
+                {"id": tc.id, "name": tc.name, "arguments": tc.arguments}
+                for tc in llm_response.tool_calls
+            ],
+            "model": llm_response.model,
+            "finish_reason": llm_response.finish_reason,
+            "usage": llm_response.usage
+        })
+    
+    def _supports_cache_control(self, model: str) -> bool:
+        """
+        是否为模型添加显式缓存标记（prompt_layout.cache_control: auto/always/never）
+        
+        auto: 仅 Anthropic/Claude 模型；OpenAI 等提供商按前缀自动缓存，不需要标记
+        """
+        from utils.runtime_config import get_runtime_option
+        mode = get_runtime_option("prompt_layout.cache_control", "auto")
+        if mode == "always":
+            return True
+        if mode == "never":
+            return False
+        model_name = model.lower()
+        return "claude" in model_name or "anthropic" in model_name
+    
+    def _message_content(self, content: str, cache_breakpoint: bool):
+        """消息内容；缓存断点使用带 cache_control 的内容块"""
+        if not cache_breakpoint:
+            return content
+        return [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+    
+    def _parse_response(self, response, model: str) -> LLMResponse:
+        """解析LLM响应（参考原项目的安全解析方式）"""
+        if response.choices and len(response.choices) > 0:
+            choice = response.choices[0]
+            message = choice.message
+            
+            output_text = message.content or ""
+            tool_calls = []
+            
+            # 安全解析工具调用
+            if hasattr(message, 'tool_calls') and message.tool_calls:
+                for tc in message.tool_calls:
+                    import json
+                    # 安全解析参数
+                    try:
+                        if isinstance(tc.function.arguments, str):
+                            arguments = json.loads(tc.function.arguments)
+                        else:
+                            arguments = tc.function.arguments
+                    except:
+                        arguments = {}
+                    
+                    tool_calls.append(ToolCall(
+                        id=tc.id,
+                        name=tc.function.name,
+                        arguments=arguments
+                    ))
+            
+            # 安全提取usage信息
+            usage = _extract_usage(getattr(response, 'usage', None))
+        else:
             return LLMResponse(
                 status="error",
                 output="",
                 tool_calls=[],
                 model=model,
                 finish_reason="error",
-                error_information=f"{str(e)}\n\nDetails:\n{error_detail}"
+                error_information="响应格式异常：缺少choices字段"
             )
+        
+        return LLMResponse(
+            status="success",
+            output=output_text,
+            tool_calls=tool_calls,
+            model=response.model,
+            finish_reason=response.choices[0].finish_reason,
+            usage=usage
+        )
+    
+    def _error_response(self, model: str, e: Exception) -> LLMResponse:
+        """将调用异常转换为错误响应"""
+        import traceback
+        error_detail = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+        return LLMResponse(
+            status="error",
+            output="",
+            tool_calls=[],
+            model=model,
+            finish_reason="error",
+            error_information=f"{str(e)}\n\nDetails:\n{error_detail}"
+        )
     
     def set_tools_config(self, tools_config: Dict):
         """
@@ -309,24 +1117,11 @@ class SimpleLLMClient:
         self.tools_config = tools_config
     
     def _build_tools_definition(self, tool_list: List[str]) -> List[Dict]:
-        """构建工具定义（OpenAI格式）"""
+        """构建工具定义（OpenAI格式，由 LLMRuntime 按工具列表缓存）"""
         if not self.tools_config:
             return []
         
-        tools = []
-        for tool_name in tool_list:
-            if tool_name in self.tools_config:
-                tool_config = self.tools_config[tool_name]
-                tools.append({
-                    "type": "function",
-                    "function": {
-                        "name": tool_config.get("name", tool_name),
-                        "description": tool_config.get("description", ""),
-                        "parameters": tool_config.get("parameters", {})
-                    }
-                })
-        
-        return tools
+        return self.runtime.get_tool_definitions(self.tools_config, tool_list)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM响应缓存 - 磁盘LRU缓存和录制/回放（cassette）
+
+模式（runtime_config.yaml llm_cache.mode）：
+- off: 不缓存
+- cache: 相同请求（模型、消息、工具、参数的哈希）直接返回磁盘上缓存的响应，
+         只缓存 temperature=0 的请求，总大小超过上限时按最近访问时间淘汰
+- record: 照常调用LLM，并把每个响应追加到cassette文件
+- replay: 只从cassette返回响应，未录制的请求返回错误，不访问LLM提供商
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+from utils.windows_compat import safe_print
+
+
+# 不参与缓存键的请求参数（凭据、地址、流式选项不影响响应内容）
+_IGNORED_KEYS = ("api_key", "api_base", "extra_headers", "stream", "stream_options")
+
+
+def request_key(kwargs: Dict) -> str:
+    """
+    计算请求的缓存键
+    
+    Args:
+        kwargs: completion 请求参数（SimpleLLMClient._build_request 的结果）
+    
+    Returns:
+        sha256 十六进制字符串
+    """
+    payload = {k: v for k, v in kwargs.items() if k not in _IGNORED_KEYS}
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """LLM响应缓存（进程内共享，线程安全）"""
+    
+    MODES = ("off", "cache", "record", "replay")
+    
+    def __init__(self, mode: str = "off", cache_dir: str = None, max_size_mb: float = 512, cassette: str = None):
+        """
+        初始化响应缓存
+        
+        Args:
+            mode: off / cache / record / replay
+            cache_dir: 磁盘缓存目录（cache模式）
+            max_size_mb: 磁盘缓存大小上限（MB）
+            cassette: cassette文件路径（record/replay模式，JSONL）
+        """
+        if mode not in self.MODES:
+            safe_print(f"⚠️ 未知的LLM缓存模式: {mode}，不使用缓存")
+            mode = "off"
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        
+        base_dir = Path.home() / "mla_v3"
+        self.cache_dir = Path(os.path.expanduser(cache_dir)) if cache_dir else base_dir / "llm_cache"
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.cassette_path = Path(os.path.expanduser(cassette)) if cassette else base_dir / "llm_cassette.jsonl"
+        
+        # cache模式：key -> 文件大小，按最近访问顺序排列（最旧的在前）
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        # replay模式：key -> [响应...]，同一请求多次录制时按顺序回放
+        self._cassette = {}
+        self._replay_cursor = {}
+        
+        if mode == "cache":
+            self._load_index()
+        elif mode == "replay":
+            self._load_cassette()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+    
+    @property
+    def replay_only(self) -> bool:
+        return self.mode == "replay"
+    
+    def lookup(self, kwargs: Dict) -> Optional[Dict]:
+        """
+        查找缓存的响应
+        
+        Args:
+            kwargs: completion 请求参数
+        
+        Returns:
+            序列化的响应字典，未命中返回None
+        """
+        if self.mode == "cache":
+            if not self._cacheable(kwargs):
+                return None
+            response = self._read_entry(request_key(kwargs))
+        elif self.mode == "replay":
+            response = self._next_recorded(request_key(kwargs))
+        else:
+            return None
+        
+        with self.lock:
+            self.stats["hits" if response is not None else "misses"] += 1
+        return response
+    
+    def store(self, kwargs: Dict, response: Dict):
+        """
+        保存一个成功的响应（cache模式写入磁盘缓存，record模式追加到cassette）
+        
+        Args:
+            kwargs: completion 请求参数
+            response: 序列化的响应字典
+        """
+        if self.mode == "cache" and self._cacheable(kwargs):
+            self._write_entry(request_key(kwargs), response)
+        elif self.mode == "record":
+            self._append_cassette(request_key(kwargs), response)
+    
+    def get_stats(self) -> Dict:
+        """获取命中统计"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["mode"] = self.mode
+            if self.mode == "cache":
+                stats["entries"] = len(self._entries)
+                stats["size_bytes"] = self._total_bytes
+            return stats
+    
+    def _cacheable(self, kwargs: Dict) -> bool:
+        """只缓存确定性请求（temperature=0）"""
+        return not kwargs.get("temperature")
+    
+    # ------------------------------------------------------------------
+    # 磁盘LRU缓存
+    # ------------------------------------------------------------------
+    
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+    
+    def _load_index(self):
+        """扫描缓存目录，按修改时间（最近访问时间）重建LRU顺序"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+        safe_print(f"💾 LLM响应缓存: {len(self._entries)} 条, {self._total_bytes / 1024 / 1024:.1f} MB")
+    
+    def _read_entry(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                response = json.load(f)
+            os.utime(path)  # 修改时间作为最近访问时间，重启后保持LRU顺序
+            return response
+        except (OSError, ValueError):
+            with self.lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+            return None
+    
+    def _write_entry(self, key: str, response: Dict):
+        path = self._entry_path(key)
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            safe_print(f"⚠️ 写入LLM响应缓存失败: {e}")
+            return
+        
+        with self.lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self.stats["stores"] += 1
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+            self.stats["evictions"] += len(evicted)
+        
+        for old_key in evicted:
+            try:
+                self._entry_path(old_key).unlink()
+            except OSError:
+                pass
+    
+    # ------------------------------------------------------------------
+    # cassette（录制/回放）
+    # ------------------------------------------------------------------
+    
+    def _load_cassette(self):
+        """读取cassette文件"""
+        if not self.cassette_path.exists():
+            safe_print(f"⚠️ cassette文件不存在: {self.cassette_path}，回放模式下所有请求都会失败")
+            return
+        
+        count = 0
+        with open(self.cassette_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 录制中断留下的不完整行
+                self._cassette.setdefault(record["key"], []).append(record["response"])
+                count += 1
+        safe_print(f"📼 已加载cassette: {self.cassette_path} ({count} 条响应)")
+    
+    def _next_recorded(self, key: str) -> Optional[Dict]:
+        """按录制顺序返回响应，超过录制次数后重复最后一条"""
+        with self.lock:
+            responses = self._cassette.get(key)
+            if not responses:
+                return None
+            cursor = self._replay_cursor.get(key, 0)
+            self._replay_cursor[key] = cursor + 1
+            return responses[min(cursor, len(responses) - 1)]
+    
+    def _append_cassette(self, key: str, response: Dict):
+        line = json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n"
+        with self.lock:
+            try:
+                self.cassette_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.cassette_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                self.stats["stores"] += 1
+            except OSError as e:
+                safe_print(f"⚠️ 写入cassette失败: {e}")
+
+
+def create_response_cache() -> LLMResponseCache:
+    """按 runtime_config.yaml 的 llm_cache 配置创建响应缓存"""
+    from utils.runtime_config import get_runtime_option
+    mode = get_runtime_option("llm_cache.mode", "off")
+    if mode is False:
+        mode = "off"  # YAML 把未加引号的 off 解析为 False
+    return LLMResponseCache(
+        mode=mode,
+        cache_dir=get_runtime_option("llm_cache.cache_dir"),
+        max_size_mb=float(get_runtime_option("llm_cache.max_size_mb", 512)),
+        cassette=get_runtime_option("llm_cache.cassette")
+    )
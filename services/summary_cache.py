@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压缩总结缓存 - 按内容哈希记忆化 ActionCompressor 的压缩结果
+
+键为 (提示词类型, 内容哈希, 目标token数, 压缩模型)：同一任务内相同的历史动作、
+工具输出或分段，无论来自哪个Agent、是否经过恢复，都只调用一次压缩模型。
+
+每个任务一个 ~/mla_v3/conversations/<task>_summaries.jsonl（追加写入），
+条目超过 max_entries 时按最近使用时间淘汰，文件过长时重写为当前条目。
+"""
+
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from utils.windows_compat import safe_print
+from utils.conversation_storage import ConversationStorage
+from utils.usage_ledger import current_scope
+
+
+class SummaryCache:
+    """压缩总结缓存（进程内共享，线程安全）"""
+    
+    def __init__(self, enabled: bool = False, max_entries: int = 500):
+        """
+        初始化总结缓存
+        
+        Args:
+            enabled: 是否启用
+            max_entries: 每个任务保留的最大条目数（最近最少使用的先淘汰）
+        """
+        self.enabled = enabled
+        self.max_entries = max(1, int(max_entries))
+        self.storage = ConversationStorage()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._tasks = {}  # task_id -> OrderedDict(key -> 总结)，最近使用的在后
+        self._lines = {}  # task_id -> 缓存文件行数
+    
+    @staticmethod
+    def key(kind: str, content: str, target_tokens: int, model: str) -> str:
+        """
+        计算缓存键
+        
+        Args:
+            kind: 提示词类型（history / history_chunk / field:<内容类型> 等）
+            content: 被压缩的内容
+            target_tokens: 目标token数
+            model: 压缩模型
+        
+        Returns:
+            sha256 十六进制字符串
+        """
+        header = json.dumps([kind, int(target_tokens), model], ensure_ascii=False)
+        return hashlib.sha256(f"{header}\n{content}".encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """查找当前任务（usage_scope）的缓存总结，未命中返回None"""
+        if not self.enabled:
+            return None
+        task_id = current_scope()[0]
+        with self.lock:
+            entries = self._entries(task_id)
+            summary = entries.get(key)
+            if summary is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            entries.move_to_end(key)
+            self._append(task_id, {"key": key, "hit": True})
+        return summary
+    
+    def put(self, key: str, summary: str):
+        """保存当前任务的一个压缩结果"""
+        if not self.enabled or not summary:
+            return
+        task_id = current_scope()[0]
+        with self.lock:
+            entries = self._entries(task_id)
+            entries[key] = summary
+            entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._append(task_id, {"key": key, "summary": summary})
+            if self._lines.get(task_id, 0) > 2 * self.max_entries:
+                self._rewrite(task_id)
+    
+    def get_stats(self) -> Dict:
+        """获取命中统计"""
+        with self.lock:
+            return dict(self.stats)
+    
+    # ------------------------------------------------------------------
+    # 持久化（调用方持有锁；没有任务归属时只缓存在内存中）
+    # ------------------------------------------------------------------
+    
+    def _entries(self, task_id: Optional[str]) -> OrderedDict:
+        """任务的缓存条目（首次使用时从缓存文件重建，回放命中记录恢复LRU顺序）"""
+        entries = self._tasks.get(task_id)
+        if entries is not None:
+            return entries
+        
+        entries = self._tasks[task_id] = OrderedDict()
+        lines = 0
+        if task_id:
+            path = self.storage.summary_cache_path(task_id)
+            if path.exists():
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            lines += 1
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                continue  # 中断写入留下的不完整行
+                            key = record.get("key")
+                            if "summary" in record:
+                                entries[key] = record["summary"]
+                                entries.move_to_end(key)
+                            elif key in entries:
+                                entries.move_to_end(key)
+                except OSError as e:
+                    safe_print(f"⚠️ 读取总结缓存失败: {e}")
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        self._lines[task_id] = lines
+        return entries
+    
+    def _append(self, task_id: Optional[str], record: Dict):
+        if not task_id:
+            return
+        try:
+            with open(self.storage.summary_cache_path(task_id), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._lines[task_id] = self._lines.get(task_id, 0) + 1
+        except OSError as e:
+            safe_print(f"⚠️ 写入总结缓存失败: {e}")
+    
+    def _rewrite(self, task_id: str):
+        """按LRU顺序重写缓存文件（去掉命中记录和已淘汰的条目）"""
+        path = self.storage.summary_cache_path(task_id)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        entries = self._tasks[task_id]
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, summary in entries.items():
+                    f.write(json.dumps({"key": key, "summary": summary}, ensure_ascii=False) + "\n")
+            tmp_path.replace(path)
+            self._lines[task_id] = len(entries)
+        except OSError as e:
+            safe_print(f"⚠️ 重写总结缓存失败: {e}")
+
+
+# 全局实例
+_summary_cache = None
+_summary_cache_lock = threading.Lock()
+
+
+def get_summary_cache() -> SummaryCache:
+    """获取全局总结缓存（由 runtime_config.yaml context_compression.summary_cache 配置）"""
+    global _summary_cache
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            from utils.runtime_config import get_runtime_option
+            config = get_runtime_option("context_compression.summary_cache", {}) or {}
+            _summary_cache = SummaryCache(
+                enabled=bool(config.get("enabled", False)),
+                max_entries=config.get("max_entries", 500)
+            )
+        return _summary_cache
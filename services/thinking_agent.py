@@ -7,15 +7,21 @@ Thinking Agent - 任务进展分析服务
 
 from typing import Dict, List
 from services.llm_client import SimpleLLMClient, ChatMessage
+from utils.llm_scheduler import PRIORITY_THINKING
 
 
 class ThinkingAgent:
     """思考Agent - 用于分析任务进展"""
     
-    def __init__(self):
-        """初始化Thinking Agent"""
+    def __init__(self, llm_client: SimpleLLMClient = None):
+        """
+        初始化Thinking Agent
+        
+        Args:
+            llm_client: 复用的LLM客户端（None则创建，配置来自共享的 LLMRuntime）
+        """
         # 使用简化的LLM客户端
-        self.llm_client = SimpleLLMClient()
+        self.llm_client = llm_client or SimpleLLMClient()
         
         # Thinking Agent的系统提示词
         self.system_prompt = """你是一个agent行动的上下文管理专家，这个 agent 每次在清除动作历史之前会请你进行上下文整理。
@@ -131,7 +137,9 @@ agent可以调用的所有工具和参数信息
                 model=self.llm_client.models[0],
                 system_prompt=self.system_prompt,
                 tool_list=[],  # Thinking不使用工具
-                tool_choice="auto"
+                tool_choice="auto",
+                priority=PRIORITY_THINKING,
+                purpose="thinking"
             )
             
             if response.status == "success":
@@ -226,7 +234,9 @@ Agent的完整上下文（包含系统角色、历史动作等）：
                 model=self.llm_client.models[0],
                 system_prompt=self.system_prompt,
                 tool_list=[],
-                tool_choice="auto"
+                tool_choice="auto",
+                priority=PRIORITY_THINKING,
+                purpose="thinking"
             )
             
             if response.status == "success":
@@ -65,6 +65,7 @@ sys.path.insert(0, str(project_root))
 from utils.config_loader import ConfigLoader
 from core.hierarchy_manager import get_hierarchy_manager
 from core.agent_executor import AgentExecutor
+from utils.conversation_storage import ConversationStorage
 
 
 def main():
@@ -93,9 +94,15 @@ def main():
     parser.add_argument('--test', action='store_true', help='Run default test task')
     parser.add_argument('--config-show', action='store_true', help='Display current configuration')
     parser.add_argument('--config-set', nargs=2, metavar=('KEY', 'VALUE'), help='Set configuration item (e.g., api_key "YOUR_KEY")')
-    parser.add_argument('--config-file', type=str, help='Use custom configuration file path')
+    parser.add_argument('--config-file', type=str, help='Use custom LLM configuration file path (instead of config/run_env_config/llm_config.yaml)')
     parser.add_argument('--force-new', action='store_true', help='Force clear all state and start new task')
     parser.add_argument('--auto-mode', type=str, choices=['true', 'false'], help='Tool execution mode: true=auto execute, false=requires confirmation')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Run the agent on an asyncio event loop (AsyncAgentExecutor)')
+    parser.add_argument('--trace', type=str, metavar='OUT_JSON', help='Write a Chrome/Perfetto trace of the run (span timings) to this file')
+    parser.add_argument('--llm-cache', type=str, choices=['off', 'cache', 'record', 'replay'], help='LLM response cache mode (overrides llm_cache.mode in runtime_config.yaml)')
+    parser.add_argument('--cassette', type=str, metavar='PATH', help='Cassette file for --llm-cache record/replay')
+    parser.add_argument('--max-tokens', type=int, metavar='N', help='Token budget of the task (overrides usage_ledger.budget.max_tokens)')
+    parser.add_argument('--max-cost', type=float, metavar='USD', help='Cost budget of the task in USD (overrides usage_ledger.budget.max_cost)')
     
     args = parser.parse_args()
     
@@ -168,6 +175,27 @@ def main():
     from utils.event_emitter import init_event_emitter
     emitter = init_event_emitter(enabled=args.jsonl)
     
+    # Initialize span tracer (--trace)
+    from utils.tracer import init_tracer
+    tracer = init_tracer(enabled=bool(args.trace))
+    
+    # LLM response cache / record-replay (--llm-cache, --cassette)
+    from utils.runtime_config import set_runtime_option
+    if args.llm_cache:
+        set_runtime_option("llm_cache.mode", args.llm_cache)
+    if args.cassette:
+        set_runtime_option("llm_cache.cassette", args.cassette)
+    
+    # Custom LLM configuration file (--config-file)
+    if args.config_file:
+        set_runtime_option("llm_runtime.config_path", str(Path(args.config_file).expanduser().resolve()))
+    
+    # Per-task usage budget (--max-tokens, --max-cost)
+    if args.max_tokens is not None:
+        set_runtime_option("usage_ledger.budget.max_tokens", args.max_tokens)
+    if args.max_cost is not None:
+        set_runtime_option("usage_ledger.budget.max_cost", args.max_cost)
+    
     # JSONL mode: Redirect all print to stderr
     if args.jsonl:
         sys.stdout_orig = sys.stdout
@@ -237,14 +265,16 @@ def main():
         if args.force_new:
             if not args.jsonl:
                 print("🗑️  --force-new: Clearing all state, starting new task")
-            context = hierarchy_manager._load_context()
-            context["current"] = {
-                "instructions": [],
-                "hierarchy": {},
-                "agents_status": {}
-            }
-            hierarchy_manager._save_context(context)
-            hierarchy_manager._save_stack([])
+            with hierarchy_manager.exclusive():
+                context = hierarchy_manager._load_context()
+                context["current"] = {
+                    "instructions": [],
+                    "hierarchy": {},
+                    "agents_status": {}
+                }
+                hierarchy_manager._save_context(context)
+                hierarchy_manager._save_stack([])
+            ConversationStorage().delete_prompt_blobs(args.task_id)
         else:
             from core.state_cleaner import clean_before_start
             clean_before_start(args.task_id, args.user_input)
@@ -280,7 +310,12 @@ def main():
             print("▶️  Starting task execution")
             print(f"{'='*100}\n")
         
-        agent = AgentExecutor(
+        executor_class = AgentExecutor
+        if args.use_async:
+            from core.async_agent_executor import AsyncAgentExecutor
+            executor_class = AsyncAgentExecutor
+        
+        agent = executor_class(
             agent_name=args.agent_name,
             agent_config=agent_config,
             config_loader=config_loader,
@@ -292,7 +327,11 @@ def main():
             auto_mode = args.auto_mode == 'true'
             agent.tool_executor.set_task_permission(args.task_id, auto_mode)
         
-        result = agent.run(args.task_id, args.user_input)
+        if args.use_async:
+            import asyncio
+            result = asyncio.run(agent.arun(args.task_id, args.user_input))
+        else:
+            result = agent.run(args.task_id, args.user_input)
         
         # Output result
         if args.jsonl:
@@ -331,6 +370,11 @@ def main():
             import traceback
             traceback.print_exc()
         return 1
+    
+    finally:
+        if args.trace:
+            event_count = tracer.export(args.trace)
+            print(f"🧭 Trace written to {args.trace} ({event_count} events, open in https://ui.perfetto.dev)")
 
 
 if __name__ == "__main__":
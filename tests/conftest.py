@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试公共配置：把仓库根目录加入导入路径，并提供隔离的用户主目录
+（会话、层级状态等都写在 ~/mla_v3 下）
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """把 HOME 指向临时目录，返回该目录"""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""历史动作压缩：单条超大动作压缩后的结果必须被执行器采用（不能每轮重新压缩）"""
+
+import threading
+
+import pytest
+
+pytest.importorskip("litellm")
+
+from services.action_compressor import ActionCompressor
+from services.llm_client import LLMResponse
+from core.agent_executor import AgentExecutor
+
+
+class FakeLLMClient:
+    """只记录调用次数的压缩模型（release 未设置时阻塞，模拟慢速压缩模型）"""
+    
+    compressor_models = ["fake-compressor"]
+    max_context_window = 10000
+    
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+    
+    def chat(self, **kwargs):
+        self.calls += 1
+        assert self.release.wait(10)
+        return LLMResponse(status="success", output="压缩后的文件内容摘要", tool_calls=[],
+                           model="fake-compressor", finish_reason="stop")
+
+
+def _huge_file_read():
+    return {
+        "tool_name": "file_read",
+        "arguments": {"path": "big.txt"},
+        "result": {"status": "success", "output": "x" * 200000}
+    }
+
+
+def test_single_oversized_action_returns_new_list_without_mutating_original():
+    client = FakeLLMClient()
+    compressor = ActionCompressor(client)
+    history = [_huge_file_read()]
+    
+    compressed = compressor.compress_if_needed(history, client.max_context_window)
+    
+    assert compressed is not history
+    assert len(compressed) == 1
+    assert compressed[0]["result"]["_compressed"] is True
+    assert len(compressed[0]["result"]["output"]) < 1000
+    assert history[0]["result"]["output"] == "x" * 200000
+    assert client.calls > 0
+
+
+def test_unchanged_history_is_returned_as_is():
+    client = FakeLLMClient()
+    history = [{"tool_name": "file_read", "arguments": {"path": "a.txt"}, "result": {"status": "success", "output": "ok"}}]
+    
+    assert ActionCompressor(client).compress_if_needed(history, client.max_context_window) is history
+    assert client.calls == 0
+
+
+def test_executor_adopts_compressed_single_action():
+    client = FakeLLMClient()
+    executor = AgentExecutor.__new__(AgentExecutor)
+    executor.llm_client = client
+    executor.action_compressor = ActionCompressor(client)
+    executor.action_history = [_huge_file_read()]
+    executor.latest_thinking = ""
+    executor.current_task_input = ""
+    executor.history_version = 0
+    
+    executor._compress_action_history_if_needed()
+    
+    assert executor.action_history[0]["result"]["_compressed"] is True
+    assert executor.history_version == 1
+    
+    # 下一轮：已压缩的动作不超限，不再调用压缩模型
+    calls = client.calls
+    executor._compress_action_history_if_needed()
+    assert client.calls == calls
+    assert executor.history_version == 1
+
+
+def _action(i):
+    return {"tool_name": "file_read", "arguments": {"path": f"{i}.txt"}, "result": {"status": "success", "output": "y" * 3000}}
+
+
+def test_unfinished_precompaction_does_not_block_the_turn():
+    client = FakeLLMClient()
+    compressor = ActionCompressor(client)
+    compressor.precompact_enabled = True
+    compressor.low_watermark = 0.5
+    window = 26000  # 压缩阈值 6000 tokens
+    
+    client.release.clear()
+    history = [_action(i) for i in range(6)]
+    assert compressor.compress_if_needed(history, window) is history  # 超过低水位：开始后台预压缩
+    
+    history = history + [_action(i) for i in range(6, 12)]
+    assert compressor.compress_if_needed(history, window) is history  # 超过阈值但预压缩未完成：不等待
+    
+    client.release.set()
+    compressor._precompact[1].result(timeout=10)
+    compressed = compressor.compress_if_needed(history, window)
+    assert compressed is not history
+    assert len(compressed) < len(history)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""会话日志后端：截断的尾部记录的重放、后台压缩快照、读取状态的隔离"""
+
+import json
+
+import pytest
+
+import utils.conversation_storage as conversation_storage
+from utils.conversation_storage import ActionJournal, ConversationStorage
+
+
+def _state(actions, turn):
+    return {"task_id": "t", "agent_id": "a", "current_turn": turn,
+            "action_history": actions, "action_history_fact": actions, "prompt_snapshots": []}
+
+
+def _action(i):
+    return {"tool_name": "file_read", "arguments": {"path": f"f{i}"}, "result": {"status": "success"}}
+
+
+@pytest.fixture(autouse=True)
+def fresh_journals(monkeypatch):
+    """每个测试使用独立的进程内日志缓存"""
+    monkeypatch.setattr(conversation_storage, "_journals", {})
+
+
+def test_torn_tail_is_truncated_on_replay(tmp_path):
+    snapshot_path = tmp_path / "x_actions.json"
+    journal = ActionJournal(str(snapshot_path), compact_every=100)
+    actions = journal.snapshot().setdefault("action_history", [])
+    for i in range(3):
+        actions.append(_action(i))
+        journal.append(_state(actions, i))
+    journal._handle.close()
+    
+    journal_path = journal._journal_path(journal.generation)
+    intact_size = journal_path.stat().st_size
+    with open(journal_path, 'ab') as f:
+        f.write(b'{"extend": {"action_history": [{"tool_na')
+    
+    replayed = ActionJournal(str(snapshot_path), compact_every=100)
+    
+    assert replayed.read()["action_history"] == [_action(i) for i in range(3)]
+    assert replayed.read()["current_turn"] == 2
+    assert journal_path.stat().st_size == intact_size
+    
+    # 新记录从干净的行开始，再次重放仍然完整
+    data = replayed.snapshot()
+    data["action_history"].append(_action(3))
+    data["current_turn"] = 3
+    replayed.append(data)
+    replayed._handle.close()
+    assert ActionJournal(str(snapshot_path)).read()["action_history"] == [_action(i) for i in range(4)]
+
+
+def test_compaction_writes_snapshot_and_drops_old_journals(tmp_path):
+    snapshot_path = tmp_path / "x_actions.json"
+    journal = ActionJournal(str(snapshot_path), compact_every=4)
+    data = journal.snapshot()
+    actions = data.setdefault("action_history", [])
+    for i in range(4):
+        actions.append(_action(i))
+        journal.append(_state(actions, i))
+    if journal._compacting is not None:
+        journal._compacting.join()
+    
+    with open(snapshot_path, 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert snapshot["_journal_generation"] == 1
+    assert snapshot["action_history"] == [_action(i) for i in range(4)]
+    assert journal._journal_generations() == []
+    
+    # 压缩之后的记录写入新一代日志，重放 = 快照 + 新日志
+    actions.append(_action(4))
+    journal.append(_state(actions, 4))
+    journal._handle.close()
+    assert journal._journal_generations() == [1]
+    
+    replayed = ActionJournal(str(snapshot_path))
+    assert replayed.read()["action_history"] == [_action(i) for i in range(5)]
+    assert replayed.generation == 1
+
+
+def test_compacted_snapshot_is_not_affected_by_later_appends(tmp_path, monkeypatch):
+    snapshot_path = tmp_path / "x_actions.json"
+    journal = ActionJournal(str(snapshot_path), compact_every=1000)
+    actions = [_action(0)]
+    journal.append(_state(actions, 0))
+    
+    captured = {}
+    monkeypatch.setattr(journal, "_write_snapshot", lambda state, generation: captured.update(state=state))
+    journal.compact(wait=False)
+    
+    actions.append(_action(1))
+    journal.append(_state(actions, 1))
+    actions[0]["result"]["status"] = "changed"
+    
+    assert captured["state"]["action_history"] == [_action(0)]
+
+
+def test_read_state_returns_private_copy(home):
+    storage = ConversationStorage(backend="journal")
+    actions = [_action(0)]
+    storage.save_actions("t", "a", "agent", "input", actions, current_turn=1)
+    
+    # 调用方修改传入的列表或读到的状态，都不会影响日志内部状态
+    actions[0]["result"]["status"] = "changed"
+    state = storage.read_state("t", "a")
+    state["action_history"].append(_action(1))
+    state["action_history"][0]["arguments"]["path"] = "other"
+    
+    assert storage.read_state("t", "a")["action_history"] == [_action(0)]
+
+
+def test_prompt_blobs_are_stored_per_task_and_deleted_with_it(home, monkeypatch):
+    from core import state_cleaner
+    from core.hierarchy_manager import HierarchyManager
+    storage = ConversationStorage()
+    prompt_hash = storage.save_prompt_blob("/work/a", "system prompt")
+    
+    assert storage.load_prompt_blob("/work/a", prompt_hash) == "system prompt"
+    assert storage.load_prompt_blob("/work/b", prompt_hash) is None
+    
+    # 同一任务续跑时保留快照，换成新任务时删除
+    manager = HierarchyManager("/work/a")
+    monkeypatch.setattr(state_cleaner, "get_hierarchy_manager", lambda task_id: manager)
+    manager.start_new_instruction("task")
+    manager.push_agent("alpha_agent", "task")
+    state_cleaner.clean_before_start("/work/a", "task")
+    assert storage.load_prompt_blob("/work/a", prompt_hash) == "system prompt"
+    
+    state_cleaner.clean_before_start("/work/a", "another task")
+    assert storage.load_prompt_blob("/work/a", prompt_hash) is None
+    assert not storage.prompt_blob_dir("/work/a").exists()
+
+
+def test_prompt_inspector_only_returns_prompts_stored_for_the_turn(home):
+    from utils.prompt_inspector import get_stored_prompt
+    storage = ConversationStorage()
+    first = storage.save_prompt_blob("/work/a", "prompt 1")
+    second = storage.save_prompt_blob("/work/a", "prompt 5")
+    blob_state = {"task_id": "/work/a", "current_turn": 8,
+                  "prompt_snapshots": [{"turn": 1, "hash": first}, {"turn": 5, "hash": second}]}
+    
+    assert get_stored_prompt(storage, blob_state, 4) == "prompt 1"
+    assert get_stored_prompt(storage, blob_state) == "prompt 5"
+    assert get_stored_prompt(storage, blob_state, 0) is None
+    
+    # checkpoint/inline 只保存最近一轮的提示词
+    checkpoint_state = {"task_id": "/work/a", "current_turn": 8, "system_prompt": "latest", "prompt_snapshots": []}
+    assert get_stored_prompt(storage, checkpoint_state) == "latest"
+    assert get_stored_prompt(storage, checkpoint_state, 8) == "latest"
+    assert get_stored_prompt(storage, checkpoint_state, 3) is None
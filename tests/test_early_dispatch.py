@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""流式响应中只读工具的提前执行：重试重放回调时不重复执行，只采用与最终响应一致的结果"""
+
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("litellm")
+
+from core.agent_executor import _EarlyDispatcher
+from services.llm_client import ToolCall, _StreamAssembler
+
+READ_ONLY = {"file_read", "dir_list"}
+
+
+class FakeExecutor:
+    def _is_read_only_tool(self, name):
+        return name in READ_ONLY
+    
+    def _can_dispatch_early(self, tool_call, previous_calls):
+        return all(self._is_read_only_tool(call.name) for call in list(previous_calls) + [tool_call])
+    
+    def _paths_conflict(self, tool_call, group):
+        return False
+
+
+def _dispatcher():
+    submitted = []
+    
+    def submit(tool_call):
+        submitted.append(tool_call.id)
+        return Future()
+    
+    return _EarlyDispatcher(FakeExecutor(), submit), submitted
+
+
+def _read(call_id, path="a.txt"):
+    return ToolCall(id=call_id, name="file_read", arguments={"path": path})
+
+
+def test_replayed_attempt_does_not_dispatch_twice():
+    dispatcher, submitted = _dispatcher()
+    for _ in range(2):  # 第一次流式尝试中断后重试，回调被重放
+        dispatcher.begin_attempt()
+        dispatcher(_read("call_1"))
+    
+    results = dispatcher.take([_read("call_1")])
+    
+    assert submitted == ["call_1"]
+    assert list(results) == ["call_1"]
+
+
+def test_stale_attempt_results_are_cancelled():
+    dispatcher, submitted = _dispatcher()
+    dispatcher.begin_attempt()
+    dispatcher(_read("call_old"))
+    stale = dispatcher.submitted["call_old"][2]
+    dispatcher.begin_attempt()  # 回退到另一个模型，生成了不同的调用
+    dispatcher(_read("call_new", "b.txt"))
+    
+    results = dispatcher.take([_read("call_new", "b.txt")])
+    
+    assert list(results) == ["call_new"]
+    assert stale.cancelled()
+    assert dispatcher.submitted == {}
+
+
+def test_changed_arguments_are_not_adopted():
+    dispatcher, _ = _dispatcher()
+    dispatcher.begin_attempt()
+    dispatcher(_read("call_1", "a.txt"))
+    
+    assert dispatcher.take([_read("call_1", "other.txt")]) == {}
+
+
+def test_only_read_only_prefix_of_final_response_is_adopted():
+    dispatcher, _ = _dispatcher()
+    dispatcher.begin_attempt()
+    dispatcher(_read("call_1"))
+    dispatcher(_read("call_2", "b.txt"))
+    
+    final_calls = [_read("call_1"), ToolCall(id="call_w", name="file_write", arguments={}), _read("call_2", "b.txt")]
+    results = dispatcher.take(final_calls)
+    
+    assert list(results) == ["call_1"]
+
+
+def test_stream_assembler_starts_a_new_attempt():
+    dispatcher, _ = _dispatcher()
+    dispatcher.streamed_calls.append(ToolCall(id="w", name="file_write", arguments={}))
+    
+    _StreamAssembler("fake-model", dispatcher)
+    
+    assert dispatcher.streamed_calls == []
+
+
+@pytest.fixture
+def grouping_executor():
+    """只带分组所需属性的 AgentExecutor（工具定义来自 Default 配置）"""
+    from core.agent_executor import AgentExecutor
+    from utils.config_loader import ConfigLoader
+    executor = AgentExecutor.__new__(AgentExecutor)
+    executor.config_loader = ConfigLoader("Default")
+    executor.parallel_tool_calls = True
+    executor.parallel_sub_agents = False
+    executor.stream_responses = True
+    executor.early_tool_dispatch = True
+    return executor
+
+
+def _names(groups):
+    return [[call.id for call in group] for group in groups]
+
+
+def test_save_path_conflicts_split_read_only_groups(grouping_executor):
+    calls = [
+        ToolCall(id="search", name="web_search", arguments={"query": "q", "save_path": "notes/search.md"}),
+        ToolCall(id="read", name="file_read", arguments={"path": ["./notes/search.md"]}),
+        ToolCall(id="arxiv", name="arxiv_search", arguments={"query": "q", "save_path": "notes/arxiv.md"}),
+        ToolCall(id="crawl", name="crawl_page", arguments={"url": "u", "save_path": "notes/arxiv.md"}),
+        ToolCall(id="list", name="dir_list", arguments={"path": "other"}),
+        ToolCall(id="grep", name="grep", arguments={"pattern": "x"}),
+    ]
+    
+    groups = grouping_executor._group_tool_calls(calls)
+    
+    # 读取搜索结果文件、写入同一个 save_path、搜索整个工作空间都必须等之前的写入完成
+    assert _names(groups) == [["search"], ["read", "arxiv"], ["crawl", "list"], ["grep"]]
+
+
+def test_early_dispatch_skips_conflicting_save_path(grouping_executor):
+    search = ToolCall(id="search", name="web_search", arguments={"query": "q", "save_path": "out/a.md"})
+    read_other = ToolCall(id="read_other", name="file_read", arguments={"path": ["src/main.py"]})
+    read_result = ToolCall(id="read_result", name="file_read", arguments={"path": ["out"]})
+    
+    assert grouping_executor._can_dispatch_early(read_other, [search])
+    assert not grouping_executor._can_dispatch_early(read_result, [search, read_other])
+    
+    submitted = []
+    dispatcher = _EarlyDispatcher(grouping_executor, lambda tool_call: submitted.append(tool_call.id) or Future())
+    dispatcher.begin_attempt()
+    for tool_call in (search, read_other, read_result):
+        dispatcher(tool_call)
+    
+    assert submitted == ["search", "read_other"]
+    assert list(dispatcher.take([search, read_other, read_result])) == ["search", "read_other"]
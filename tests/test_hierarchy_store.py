@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""层级存储：版本比较并交换、跨进程锁、历史归档与历史行的增量写入"""
+
+import sys
+import multiprocessing
+
+import pytest
+
+import core.hierarchy_store as hierarchy_store
+from core.hierarchy_store import JsonHierarchyStore, SqliteHierarchyStore
+from core.history_archive import HistoryArchive
+
+
+def _entry(i):
+    return {"instructions": [{"instruction": f"task {i}"}], "agents_status": {}, "hierarchy": {},
+            "start_time": f"t{i}", "completion_time": f"t{i}"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    archive = HistoryArchive(tmp_path / "t_history", segment_size=2)
+    store = SqliteHierarchyStore("t", tmp_path / "t_hierarchy.db", lock_file=tmp_path / "t_hierarchy.lock",
+                                 archive=archive, hot_history=3)
+    yield store
+    store.close()
+
+
+def _append(store, entry):
+    context = store.load_context()
+    context["history"].append(entry)
+    assert store.save_context(context, expected_version=context["version"])
+
+
+def test_stale_save_is_rejected(store):
+    first = store.load_context()
+    second = store.load_context()
+    first["current"]["note"] = "first"
+    
+    assert store.save_context(first, expected_version=first["version"])
+    assert not store.save_context(second, expected_version=second["version"])
+    assert store.load_current()["note"] == "first"
+
+
+def test_history_beyond_hot_entries_is_archived(store):
+    for i in range(8):
+        _append(store, _entry(i))
+    
+    assert [e["start_time"] for e in store.load_history()] == ["t5", "t6", "t7"]
+    assert [item["id"] for item in store.archive.index()] == [1, 2, 3, 4, 5]
+    assert [e["start_time"] for e in store.archive.load([2, 5])] == ["t1", "t4"]
+
+
+def test_rolled_back_spill_is_not_archived_twice(store, monkeypatch):
+    for i in range(3):
+        _append(store, _entry(i))
+    
+    def fail(cur):
+        raise RuntimeError("写入中途失败")
+    
+    # 归档写入分段文件后事务回滚：行仍在数据库中，但不应再次归档或出现在history中
+    monkeypatch.setattr(SqliteHierarchyStore, "_touch", staticmethod(fail))
+    with pytest.raises(RuntimeError):
+        _append(store, _entry(3))
+    monkeypatch.undo()
+    assert [item["id"] for item in store.archive.index()] == [1]
+    assert [e["start_time"] for e in store.load_history()] == ["t1", "t2"]
+    
+    _append(store, _entry(3))
+    _append(store, _entry(4))
+    
+    assert [e["start_time"] for e in store.archive.load()] == ["t0", "t1"]
+    assert [e["start_time"] for e in store.load_history()] == ["t2", "t3", "t4"]
+
+
+def test_save_context_only_touches_changed_history_rows(tmp_path):
+    store = SqliteHierarchyStore("t", tmp_path / "t_hierarchy.db", lock_file=tmp_path / "t_hierarchy.lock")
+    for i in range(4):
+        _append(store, _entry(i))
+    ids_before = [row[0] for row in store._query("SELECT id FROM history ORDER BY id")]
+    
+    context = store.load_context()
+    del context["history"][1]
+    assert store.save_context(context)
+    
+    rows = store._query("SELECT id, start_time FROM history ORDER BY id")
+    assert rows == [(ids_before[0], "t0"), (ids_before[2], "t2"), (ids_before[3], "t3")]
+    store.close()
+
+
+def test_archive_if_all_done_moves_current_into_history(store):
+    store.push_agent("main", "a1", "alpha", "hi")
+    store.pop_agent("main", "a1", "done")
+    current = store.load_current()
+    
+    assert store.archive_if_all_done()
+    history = store.load_history()
+    assert len(history) == 1
+    assert history[0]["agents_status"] == current["agents_status"]
+    assert history[0]["hierarchy"] == current["hierarchy"]
+    assert store.load_current()["agents_status"] == {}
+
+
+@pytest.fixture
+def json_store(tmp_path):
+    archive = HistoryArchive(tmp_path / "t_history", segment_size=2)
+    return JsonHierarchyStore("t", tmp_path / "t_stack.json", tmp_path / "t_share_context.json",
+                              lock_file=tmp_path / "t_hierarchy.lock", archive=archive, hot_history=3)
+
+
+def test_json_history_beyond_hot_entries_is_archived(json_store):
+    for i in range(6):
+        _append(json_store, _entry(i))
+    
+    context = json_store.load_context()
+    assert [e["start_time"] for e in context["history"]] == ["t3", "t4", "t5"]
+    assert context["history_offset"] == 3
+    assert [item["id"] for item in json_store.archive.index()] == [1, 2, 3]
+
+
+def test_json_interrupted_spill_is_not_archived_twice(json_store, monkeypatch):
+    for i in range(3):
+        _append(json_store, _entry(i))
+    
+    write_json = hierarchy_store._write_json
+    
+    def fail_context_write(path, data):
+        if path == json_store.context_file:
+            raise OSError("写入中途失败")
+        write_json(path, data)
+    
+    # 条目已写入归档，但上下文文件没有被替换
+    monkeypatch.setattr(hierarchy_store, "_write_json", fail_context_write)
+    context = json_store.load_context()
+    context["history"].append(_entry(3))
+    assert not json_store.save_context(context)
+    monkeypatch.undo()
+    assert [item["id"] for item in json_store.archive.index()] == [1]
+    assert [e["start_time"] for e in json_store.load_context()["history"]] == ["t1", "t2"]
+    
+    _append(json_store, _entry(3))
+    _append(json_store, _entry(4))
+    
+    assert [e["start_time"] for e in json_store.archive.load()] == ["t0", "t1"]
+    assert [e["start_time"] for e in json_store.load_context()["history"]] == ["t2", "t3", "t4"]
+
+
+def _increment(home, count):
+    import os
+    os.environ["HOME"] = home
+    from core.hierarchy_manager import HierarchyManager
+    manager = HierarchyManager("/work/concurrent")
+    
+    def bump(context):
+        context["current"]["counter"] = context["current"].get("counter", 0) + 1
+    
+    for _ in range(count):
+        assert manager.update_context(bump, max_retries=100)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="依赖fork启动子进程")
+def test_concurrent_processes_do_not_lose_updates(home):
+    processes = [multiprocessing.get_context("fork").Process(target=_increment, args=(str(home), 10)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    
+    from core.hierarchy_manager import HierarchyManager
+    assert HierarchyManager("/work/concurrent").get_context()["current"]["counter"] == 30
+
+
+def test_failed_save_does_not_bump_manager_version(home, monkeypatch):
+    from core.hierarchy_manager import HierarchyManager
+    manager = HierarchyManager("/work/version")
+    stale = manager._load_context()
+    fresh = manager._load_context()
+    assert manager._save_context(fresh)
+    version = manager.version
+    
+    # 版本冲突被拒绝、存储写入抛出异常，都不应让上下文缓存失效
+    assert not manager._save_context(stale)
+    
+    def broken_save(context, expected_version=None):
+        raise OSError("disk full")
+    
+    monkeypatch.setattr(manager.store, "save_context", broken_save)
+    assert not manager._save_context(manager._load_context())
+    assert manager.version == version
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "json"])
+def test_clean_before_start_removes_stale_branches(home, monkeypatch, backend):
+    from utils.runtime_config import get_runtime_config
+    monkeypatch.setitem(get_runtime_config(), "hierarchy_store", {"backend": backend})
+    from core.hierarchy_manager import HierarchyManager
+    from core import state_cleaner
+    manager = HierarchyManager(f"/work/stale_{backend}")
+    monkeypatch.setattr(state_cleaner, "get_hierarchy_manager", lambda task_id: manager)
+    
+    # 并发执行中途进程退出：分支没有被 close_branch 删除
+    manager.push_agent("alpha_agent", "task")
+    branch_id = manager.fork_branch()
+    with manager.use_branch(branch_id):
+        manager.push_agent("beta_agent", "subtask")
+    assert set(manager._load_branches()) == {manager.MAIN_BRANCH, branch_id}
+    
+    state_cleaner.clean_before_start(manager.task_id, "another task")
+    
+    assert manager._load_branches() == {manager.MAIN_BRANCH: []}
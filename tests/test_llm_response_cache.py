@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""LLM响应缓存：缓存键、磁盘LRU缓存、cassette录制与回放"""
+
+import json
+
+from services.llm_response_cache import LLMResponseCache, request_key
+
+
+def _request(content="hello", **overrides):
+    kwargs = {"model": "m", "messages": [{"role": "user", "content": content}], "temperature": 0,
+              "api_key": "sk-1", "api_base": "https://a.example", "stream": False}
+    kwargs.update(overrides)
+    return kwargs
+
+
+def _response(output):
+    return {"status": "success", "output": output, "tool_calls": [], "model": "m", "finish_reason": "stop"}
+
+
+def test_request_key_ignores_credentials_and_stream_options():
+    base = request_key(_request())
+    
+    assert request_key(_request(api_key="sk-2", api_base="https://b.example")) == base
+    assert request_key(_request(stream=True, stream_options={"include_usage": True})) == base
+    # 参数顺序不影响缓存键
+    assert request_key(dict(reversed(list(_request().items())))) == base
+    
+    assert request_key(_request("other")) != base
+    assert request_key(_request(model="m2")) != base
+    assert request_key(_request(tools=[{"type": "function", "function": {"name": "file_read"}}])) != base
+
+
+def test_cache_mode_hits_only_deterministic_requests(tmp_path):
+    cache = LLMResponseCache("cache", cache_dir=str(tmp_path / "cache"))
+    cache.store(_request(), _response("a"))
+    cache.store(_request(temperature=0.7), _response("b"))
+    
+    assert cache.lookup(_request(api_key="sk-other")) == _response("a")
+    assert cache.lookup(_request(temperature=0.7)) is None
+    assert cache.lookup(_request("other")) is None
+    
+    # 重启后从磁盘重建索引
+    reloaded = LLMResponseCache("cache", cache_dir=str(tmp_path / "cache"))
+    assert reloaded.lookup(_request()) == _response("a")
+    assert reloaded.get_stats()["entries"] == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    entry_size = len(json.dumps(_response("1")))
+    # 上限只能容纳两条
+    cache = LLMResponseCache("cache", cache_dir=str(tmp_path / "cache"), max_size_mb=entry_size * 2.5 / 1024 / 1024)
+    cache.store(_request("1"), _response("1"))
+    cache.store(_request("2"), _response("2"))
+    assert cache.lookup(_request("1")) is not None  # "1" 变为最近访问
+    cache.store(_request("3"), _response("3"))
+    
+    assert cache.lookup(_request("2")) is None
+    assert cache.lookup(_request("1")) == _response("1")
+    assert cache.lookup(_request("3")) == _response("3")
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_record_then_replay_in_recorded_order(tmp_path):
+    cassette = str(tmp_path / "cassette.jsonl")
+    recorder = LLMResponseCache("record", cassette=cassette)
+    assert recorder.lookup(_request()) is None  # 录制模式照常调用LLM
+    recorder.store(_request(), _response("first"))
+    recorder.store(_request(), _response("second"))
+    recorder.store(_request("other"), _response("other"))
+    with open(cassette, 'a', encoding='utf-8') as f:
+        f.write('{"key": "torn')  # 录制中断留下的不完整行
+    
+    player = LLMResponseCache("replay", cassette=cassette)
+    
+    assert player.replay_only
+    assert player.lookup(_request(temperature=0.7, api_key="sk-other")) is None
+    assert player.lookup(_request()) == _response("first")
+    assert player.lookup(_request()) == _response("second")
+    # 超过录制次数后重复最后一条
+    assert player.lookup(_request()) == _response("second")
+    assert player.lookup(_request("other")) == _response("other")
+    assert player.lookup(_request("missing")) is None
+    assert player.get_stats()["misses"] == 2
+
+
+def test_unknown_mode_disables_cache(tmp_path):
+    cache = LLMResponseCache("bogus", cache_dir=str(tmp_path / "cache"))
+    cache.store(_request(), _response("a"))
+    
+    assert not cache.enabled
+    assert cache.lookup(_request()) is None
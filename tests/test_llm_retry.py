@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""LLM调用重试：可重试错误的判断、Retry-After与指数退避、重试次数、模型回退顺序"""
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("litellm")
+
+import services.llm_client as llm_client
+from services.llm_client import LLMResponse, SimpleLLMClient
+
+
+class FakeRuntime:
+    def __init__(self, retry_config=None):
+        self.retry_config = retry_config or {}
+        self.call_stats = {"attempts": 0, "retries": 0}
+        self.latencies = []
+    
+    def count(self, name, n=1):
+        self.call_stats[name] = self.call_stats.get(name, 0) + n
+    
+    def record_latency(self, model, seconds):
+        self.latencies.append((model, seconds))
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+def _client(retry_config=None):
+    client = SimpleLLMClient.__new__(SimpleLLMClient)
+    client.runtime = FakeRuntime(retry_config)
+    client.models = ["main", "backup"]
+    client.compressor_models = ["small"]
+    client.figure_models = []
+    return client
+
+
+def _success(model):
+    return LLMResponse(status="success", output="ok", tool_calls=[], model=model, finish_reason="stop")
+
+
+def test_retryable_errors():
+    client = _client()
+    
+    assert client._is_retryable(StatusError(429))
+    assert client._is_retryable(StatusError(503))
+    assert client._is_retryable(APIConnectionError("reset"))
+    assert not client._is_retryable(StatusError(400))
+    assert not client._is_retryable(StatusError(401))
+    assert not client._is_retryable(ValueError("bad request"))
+
+
+def test_retry_delay_prefers_retry_after():
+    client = _client({"base_delay": 1.0, "max_delay": 8, "max_retry_after": 60})
+    
+    assert client._retry_delay(0, StatusError(429, {"retry-after": "5"})) == 5
+    assert client._retry_delay(0, StatusError(429, {"retry-after-ms": "250"})) == 0.25
+    assert client._retry_delay(0, StatusError(429, {"retry-after": "600"})) == 60
+    # 没有Retry-After时为全抖动指数退避，不超过 max_delay
+    for retry in range(6):
+        assert 0 <= client._retry_delay(retry, StatusError(503)) <= min(8, 2 ** retry)
+
+
+def test_transient_errors_are_retried_then_succeed(monkeypatch):
+    client = _client({"max_retries": 3, "base_delay": 0})
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    failures = [StatusError(503), APIConnectionError("reset")]
+    
+    def hedge(kwargs, model, stream, on_tool_call, attempts, priority):
+        if failures:
+            raise failures.pop(0)
+        return _success(model)
+    
+    client._complete_with_hedge = hedge
+    attempts = []
+    
+    assert client._complete_with_retry({}, "main", False, None, attempts).status == "success"
+    assert [a["outcome"] for a in attempts] == ["error", "error", "success"]
+    assert client.runtime.call_stats["retries"] == 2
+    assert len(client.runtime.latencies) == 1
+
+
+def test_permanent_errors_and_exhausted_retries_raise(monkeypatch):
+    client = _client({"max_retries": 2, "base_delay": 0})
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    calls = []
+    
+    def hedge(kwargs, model, stream, on_tool_call, attempts, priority):
+        calls.append(model)
+        raise errors[0]
+    
+    client._complete_with_hedge = hedge
+    
+    errors = [StatusError(400)]
+    with pytest.raises(StatusError):
+        client._complete_with_retry({}, "main", False, None, [])
+    assert len(calls) == 1
+    
+    calls.clear()
+    errors = [StatusError(429)]
+    with pytest.raises(StatusError):
+        client._complete_with_retry({}, "main", False, None, [])
+    assert len(calls) == 3
+
+
+def test_model_chain_falls_back_within_the_same_group():
+    client = _client({"fallback_models": True})
+    
+    assert client._model_chain("backup") == ["backup", "main"]
+    assert client._model_chain("small") == ["small"]
+    assert client._model_chain("unknown") == ["unknown"]
+    
+    client.runtime.retry_config["fallback_models"] = False
+    assert client._model_chain("main") == ["main"]
+
+
+class RecordingEmitter:
+    enabled = True
+    
+    def __init__(self):
+        self.events = []
+    
+    def token(self, text):
+        self.events.append(("token", text))
+    
+    def notice(self, text):
+        self.events.append(("notice", text))
+
+
+def _chunk(text):
+    return SimpleNamespace(model="main", usage=None,
+                           choices=[SimpleNamespace(finish_reason=None, delta=SimpleNamespace(content=text, tool_calls=None))])
+
+
+def test_retried_stream_does_not_duplicate_text(monkeypatch):
+    import utils.event_emitter as event_emitter
+    emitter = RecordingEmitter()
+    monkeypatch.setattr(event_emitter, "get_event_emitter", lambda: emitter)
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    client = _client({"max_retries": 2, "base_delay": 0})
+    client.runtime.hedge_delay = lambda model: None
+    streams = []
+    
+    def completion(**kwargs):
+        streams.append(kwargs)
+        yield _chunk("Hel")
+        if len(streams) == 1:
+            raise APIConnectionError("stream reset")  # 第一次尝试中途断开
+        yield _chunk("lo")
+    
+    monkeypatch.setattr(llm_client, "completion", completion)
+    
+    response = client._complete_with_retry({"messages": []}, "main", True, None, [])
+    
+    assert response.output == "Hello"
+    # 第一次尝试的部分文本已实时转发；重试时先通知作废，再一次性转发完整文本
+    assert emitter.events == [("token", "Hel"), ("notice", llm_client.RETRY_NOTICE), ("token", "Hello")]
+
+
+def test_hedge_loser_is_recorded_in_attempts_and_ledger(monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from utils.usage_ledger import usage_scope, current_scope
+    
+    recorded = []
+    ledger = SimpleNamespace(record=lambda purpose, model, usage, latency, status="success", from_cache=False:
+                             recorded.append((current_scope(), purpose, usage, status)))
+    monkeypatch.setattr(llm_client, "get_usage_ledger", lambda: ledger)
+    
+    pool = ThreadPoolExecutor(max_workers=2)
+    client = _client()
+    client.runtime.hedge_delay = lambda model: 0.01
+    client.runtime.get_hedge_pool = lambda: pool
+    release = threading.Event()
+    calls = []
+    
+    def complete_once(kwargs, model, stream, on_tool_call=None, priority=None, retried=False):
+        calls.append(model)
+        if len(calls) == 1:
+            release.wait(5)  # 第一个请求很慢，对冲请求先返回
+            return LLMResponse("success", "slow", [], model, "stop", usage={"total_tokens": 100})
+        return LLMResponse("success", "fast", [], model, "stop", usage={"total_tokens": 50})
+    
+    client._complete_once = complete_once
+    attempts = []
+    with usage_scope("task", "agent"):
+        response = client._complete_with_hedge({}, "main", False, None, attempts)
+    release.set()
+    pool.shutdown(wait=True)
+    
+    assert response.output == "fast"
+    assert [a["outcome"] for a in attempts] == ["hedge", "hedge_loser"]
+    assert attempts[-1]["total_tokens"] == 100
+    # 落后请求在线程池中结束，仍记入发起调用的任务和Agent
+    assert recorded == [(("task", "agent"), "hedge_loser", {"total_tokens": 100}, "success")]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""LLM限流调度器：令牌桶、按优先级排队、按实际usage修正预算（调用失败时归还预估）"""
+
+import time
+import threading
+
+import pytest
+
+from utils.llm_scheduler import (
+    LLMScheduler, TokenBucket, PRIORITY_AGENT, PRIORITY_COMPRESSION, PRIORITY_THINKING, agent_priority
+)
+
+
+def _scheduler(rpm=0, tpm=0):
+    return LLMScheduler({"enabled": True, "default": {"rpm": rpm, "tpm": tpm}})
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(60)  # 每秒补充1个
+    now = bucket.updated
+    
+    assert bucket.wait_time(60, now) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(2, now) == pytest.approx(2.0)
+    assert bucket.wait_time(2, now + 1.5) == pytest.approx(0.5)
+    # 超过容量的请求只需等到桶满，透支部分由后续请求承担
+    assert bucket.wait_time(600, now + 60) == 0
+
+
+def test_disabled_scheduler_grants_nothing():
+    scheduler = LLMScheduler({"enabled": False})
+    
+    assert scheduler.acquire("m", 10) is None
+    scheduler.settle(None, {"total_tokens": 10})
+    assert scheduler.get_metrics() == {}
+
+
+def test_waiting_requests_are_served_by_priority():
+    scheduler = _scheduler(rpm=600)  # 每0.1秒补充一个请求
+    scheduler.acquire("m")
+    scheduler.queues["m"].requests.tokens = -2  # 桶已透支，后续请求需要排队
+    
+    order = []
+    
+    def request(name, priority):
+        scheduler.acquire("m", priority=priority)
+        order.append(name)
+    
+    threads = []
+    for name, priority in (("compression", PRIORITY_COMPRESSION), ("thinking", PRIORITY_THINKING),
+                           ("sub_agent", agent_priority(2)), ("top_agent", PRIORITY_AGENT)):
+        thread = threading.Thread(target=request, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        # 等该请求进入队列，保证到达顺序与优先级相反
+        deadline = time.monotonic() + 5
+        while len(scheduler.queues["m"].waiting) < len(threads) and time.monotonic() < deadline:
+            time.sleep(0.005)
+    
+    for thread in threads:
+        thread.join(10)
+    
+    assert order == ["top_agent", "sub_agent", "thinking", "compression"]
+    metrics = scheduler.get_metrics()["m"]
+    assert metrics["granted"] == 5
+    assert metrics["max_queue_depth"] == 4
+    assert metrics["queue_depth"] == 0
+
+
+def test_settle_corrects_token_budget():
+    scheduler = _scheduler(tpm=1000)
+    bucket = scheduler._queue("m").tokens
+    
+    grant = scheduler.acquire("m", 300)
+    assert bucket.tokens == pytest.approx(700, abs=1)
+    
+    scheduler.settle(grant, {"total_tokens": 500})
+    assert bucket.tokens == pytest.approx(500, abs=1)
+    
+    # 没有usage时保留预估
+    scheduler.settle(scheduler.acquire("m", 100), None)
+    assert bucket.tokens == pytest.approx(400, abs=1)
+    
+    # 调用失败（usage为0）时归还预估
+    scheduler.settle(scheduler.acquire("m", 200), {"total_tokens": 0})
+    assert bucket.tokens == pytest.approx(400, abs=1)
+
+
+def test_failed_completion_refunds_estimate(monkeypatch):
+    pytest.importorskip("litellm")
+    import services.llm_client as llm_client
+    
+    scheduler = _scheduler(tpm=100000)
+    monkeypatch.setattr(llm_client, "get_llm_scheduler", lambda: scheduler)
+    
+    def failing_completion(**kwargs):
+        raise ConnectionError("connection reset")
+    
+    monkeypatch.setattr(llm_client, "completion", failing_completion)
+    kwargs = {"model": "m", "messages": [{"role": "user", "content": "hello " * 500}], "max_tokens": 2000}
+    
+    with pytest.raises(ConnectionError):
+        llm_client.SimpleLLMClient._complete_once(None, kwargs, "m", stream=False)
+    
+    assert scheduler.get_metrics()["m"]["tokens_available"] >= 99999
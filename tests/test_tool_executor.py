@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""工具执行器的异步接口：共享 httpx.AsyncClient、阻塞的文件读写和层级存储操作不在事件循环线程中执行"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("requests")
+
+import core.tool_executor as tool_executor
+from core.tool_executor import ToolExecutor
+
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.calls = []
+    
+    async def get(self, url, **kwargs):
+        self.calls.append(("get", url))
+        return SimpleNamespace(status_code=200)
+    
+    async def post(self, url, **kwargs):
+        self.calls.append(("post", url))
+        return SimpleNamespace(status_code=200, raise_for_status=lambda: None,
+                               json=lambda: {"success": True, "data": {"content": "ok"}})
+
+
+class FakeHierarchyManager:
+    def __init__(self):
+        self.threads = []
+    
+    def fork_branch(self):
+        self.threads.append(threading.current_thread())
+        return f"branch_{len(self.threads)}"
+    
+    def close_branch(self, branch_id):
+        self.threads.append(threading.current_thread())
+
+
+def _executor(hierarchy_manager=None):
+    executor = ToolExecutor.__new__(ToolExecutor)
+    executor.config_loader = SimpleNamespace(get_tool_config=lambda name: {"type": "tool_call_agent"})
+    executor.hierarchy_manager = hierarchy_manager
+    executor.tools_server_url = "http://toolserver"
+    executor.task_cache = {}
+    executor.task_permissions = {}
+    executor._async_client = None
+    executor._async_client_loop = None
+    return executor
+
+
+def test_async_calls_share_one_client_and_offload_off_the_loop(monkeypatch):
+    client = FakeAsyncClient()
+    offload_threads = []
+    
+    def offload_result(task_id, tool_name, result):
+        offload_threads.append(threading.current_thread())
+        return result
+    
+    monkeypatch.setattr(tool_executor, "get_blob_store", lambda: SimpleNamespace(offload_result=offload_result))
+    executor = _executor()
+    created = []
+    
+    def get_async_client():
+        created.append(client)
+        return client
+    
+    executor._get_async_client = get_async_client
+    
+    async def run():
+        return [await executor.aexecute("file_read", {"path": "a.txt"}, "task") for _ in range(2)]
+    
+    results = asyncio.run(run())
+    
+    assert [r["status"] for r in results] == ["success", "success"]
+    # 任务状态只检查一次，之后的调用复用同一个客户端
+    assert client.calls == [("get", "http://toolserver/api/task/task/status"),
+                            ("post", "http://toolserver/api/tool/execute"),
+                            ("post", "http://toolserver/api/tool/execute")]
+    assert len(created) == 3  # 每次请求都经过 _get_async_client 取共享客户端
+    assert offload_threads and threading.main_thread() not in offload_threads
+
+
+def test_async_fan_out_forks_and_closes_branches_off_the_loop():
+    hierarchy_manager = FakeHierarchyManager()
+    executor = _executor(hierarchy_manager)
+    
+    async def aexecute(tool_name, arguments, task_id, branch_id=None):
+        return {"status": "success", "output": branch_id, "error_information": ""}
+    
+    executor.aexecute = aexecute
+    
+    results = asyncio.run(executor.aexecute_fan_out([("agent_a", {}), ("agent_b", {})], "task"))
+    
+    assert [r["output"] for r in results] == ["branch_1", "branch_2"]
+    assert len(hierarchy_manager.threads) == 4
+    assert threading.main_thread() not in hierarchy_manager.threads
@@ -6,6 +6,7 @@
 """
 
 import os
+import sys
 import yaml
 import base64
 from pathlib import Path
@@ -13,6 +14,12 @@ from typing import Optional
 from litellm import completion
 import litellm
 
+# 与主进程共用限流调度器实现（项目根目录的 utils/llm_scheduler.py）
+_project_root = str(Path(__file__).parent.parent)
+if _project_root not in sys.path:
+    sys.path.append(_project_root)
+from utils.llm_scheduler import get_llm_scheduler, PRIORITY_TOOL
+
 # 尝试导入 transcribe，如果不支持则使用替代方案
 try:
     from litellm import transcribe
@@ -111,6 +118,38 @@ class LLMClientLite:
         
         print(f"✅ 配置已重新加载")
     
+    def _completion(self, model: str, messages: list):
+        """
+        调用 completion（先在限流调度器中排队，调用后按实际usage修正token预算）
+        
+        Args:
+            model: 模型名称
+            messages: 消息列表
+        """
+        scheduler = get_llm_scheduler()
+        grant = None
+        if scheduler.enabled:
+            tokens = scheduler.estimate_tokens(messages, max_tokens=self.max_tokens)
+            grant = scheduler.acquire(model, tokens, PRIORITY_TOOL)
+        
+        try:
+            response = completion(
+                model=model,
+                messages=messages,
+                temperature=self.temperature,
+                api_key=self.api_key,
+                api_base=self.base_url
+            )
+        except BaseException:
+            # 调用失败：归还预估的token
+            scheduler.settle(grant, {"total_tokens": 0})
+            raise
+        
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            scheduler.settle(grant, {"total_tokens": getattr(usage, "total_tokens", None)})
+        return response
+    
     def vision_query(
         self,
         image_path: str,
@@ -175,13 +214,7 @@ class LLMClientLite:
         
         # 调用LLM
         try:
-            response = completion(
-                model=model,
-                messages=messages,
-                temperature=self.temperature,
-                api_key=self.api_key,
-                api_base=self.base_url
-            )
+            response = self._completion(model, messages)
             
             # 提取响应
             if response.choices and len(response.choices) > 0:
@@ -398,13 +431,7 @@ class LLMClientLite:
                 "content": f"以下是音频转录内容：\n\n{transcript_text}\n\n请回答以下问题：{question}"
             }]
             
-            response = completion(
-                model=model,
-                messages=messages,
-                temperature=self.temperature,
-                api_key=self.api_key,
-                api_base=self.base_url
-            )
+            response = self._completion(model, messages)
             
             # 提取响应
             if response.choices and len(response.choices) > 0:
@@ -450,13 +477,7 @@ class LLMClientLite:
         
         # 调用LLM
         try:
-            response = completion(
-                model=model,
-                messages=messages,
-                temperature=self.temperature,
-                api_key=self.api_key,
-                api_base=self.base_url
-            )
+            response = self._completion(model, messages)
             
             # 提取响应
             if response.choices and len(response.choices) > 0:
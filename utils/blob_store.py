@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Blob Store - Content-addressed storage of large tool results
+
+Tool results whose output exceeds tool_results.max_inline_chars are written to
+~/mla_v3/conversations/<task>_blobs/<sha256>.txt; the action record keeps only a
+preview, the size and a handle (first 16 hex digits of the hash). Agents page
+through the full content with the blob_read tool.
+
+Usage:
+    python utils/blob_store.py --task_id /path/to/workspace                    # list blobs
+    python utils/blob_store.py --task_id /path/to/workspace --handle <handle>  # print a blob
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Ensure project modules can be imported when run as a script
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.conversation_storage import ConversationStorage
+
+HANDLE_LENGTH = 16
+
+
+class BlobStore:
+    """Per-task content-addressed blob store shared by all agents in the process"""
+    
+    def __init__(self, config: Dict = None):
+        """
+        Args:
+            config: tool_results section of runtime_config.yaml
+        """
+        config = config or {}
+        self.offload = bool(config.get("offload", False))
+        self.max_inline_chars = int(config.get("max_inline_chars", 20000))
+        self.preview_chars = int(config.get("preview_chars", 2000))
+        self.max_read_chars = int(config.get("max_read_chars", 20000))
+        self.storage = ConversationStorage()
+        self._texts = {}  # (task_id, handle) -> text of the most recently read blob
+        self.lock = threading.Lock()
+    
+    def put(self, task_id: str, text: str) -> str:
+        """
+        Store a text (deduplicated by content)
+        
+        Returns:
+            Blob handle
+        """
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        blob_dir = self.storage.blob_dir(task_id)
+        blob_path = blob_dir / f"{digest}.txt"
+        if not blob_path.exists():
+            blob_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_name(blob_path.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, blob_path)
+        return digest[:HANDLE_LENGTH]
+    
+    def _path(self, task_id: str, handle: str) -> Optional[Path]:
+        """File of a handle (None if not exist)"""
+        handle = (handle or "").strip().lower()
+        if len(handle) < HANDLE_LENGTH or not all(c in "0123456789abcdef" for c in handle):
+            return None
+        matches = list(self.storage.blob_dir(task_id).glob(f"{handle}*.txt"))
+        return matches[0] if matches else None
+    
+    def _load(self, task_id: str, handle: str) -> Optional[str]:
+        """Full text of a blob (the last read blob is kept in memory for paging)"""
+        key = (task_id, handle)
+        with self.lock:
+            text = self._texts.get(key)
+        if text is not None:
+            return text
+        path = self._path(task_id, handle)
+        if path is None:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        with self.lock:
+            self._texts = {key: text}
+        return text
+    
+    def read(self, task_id: str, handle: str, offset: int = 0, length: int = None) -> Optional[Dict]:
+        """
+        Read a character range of a blob
+        
+        Args:
+            task_id: Task ID
+            handle: Blob handle
+            offset: Start character (0-based)
+            length: Number of characters (capped at max_read_chars)
+        
+        Returns:
+            {handle, offset, length, size, has_more, content}, None if the blob does not exist
+        """
+        text = self._load(task_id, handle)
+        if text is None:
+            return None
+        offset = max(0, int(offset or 0))
+        length = min(int(length or self.max_read_chars), self.max_read_chars)
+        content = text[offset:offset + max(0, length)]
+        return {
+            "handle": handle,
+            "offset": offset,
+            "length": len(content),
+            "size": len(text),
+            "has_more": offset + len(content) < len(text),
+            "content": content
+        }
+    
+    def offload_result(self, task_id: str, tool_name: str, result: Dict) -> Dict:
+        """
+        Replace a large tool output by a preview and a blob handle
+        
+        Returns:
+            The result unchanged when offloading is disabled or the output is small,
+            otherwise a new result with output preview and a "blob" entry
+        """
+        output = result.get("output")
+        if not self.offload or not isinstance(output, str) or len(output) <= self.max_inline_chars:
+            return result
+        try:
+            handle = self.put(task_id, output)
+        except OSError as e:
+            print(f"⚠️ Failed to offload {tool_name} result: {e}")
+            return result
+        
+        preview = output[:self.preview_chars]
+        offloaded = dict(result)
+        offloaded["output"] = (
+            f"{preview}\n\n"
+            f"[输出过长已截断：共 {len(output)} 字符，仅显示前 {len(preview)} 字符。"
+            f"完整内容已保存为 blob {handle}，"
+            f"使用 blob_read(handle=\"{handle}\", offset={len(preview)}, length=...) 分页读取]"
+        )
+        offloaded["blob"] = {"handle": handle, "size": len(output), "preview_chars": len(preview)}
+        return offloaded
+    
+    def list_blobs(self, task_id: str) -> List[Dict]:
+        """Blobs of a task: [{handle, size (bytes)}]"""
+        blob_dir = self.storage.blob_dir(task_id)
+        if not blob_dir.exists():
+            return []
+        return [{"handle": path.stem[:HANDLE_LENGTH], "size": path.stat().st_size}
+                for path in sorted(blob_dir.glob("*.txt"))]
+
+
+# Global instance
+_blob_store = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Get global blob store (configured from runtime_config.yaml tool_results)"""
+    global _blob_store
+    with _blob_store_lock:
+        if _blob_store is None:
+            from utils.runtime_config import get_runtime_option
+            _blob_store = BlobStore(get_runtime_option("tool_results", {}))
+        return _blob_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List or print offloaded tool results of a task')
+    parser.add_argument('--task_id', type=str, required=True, help='Task ID (workspace path)')
+    parser.add_argument('--handle', type=str, default=None, help='Print the blob with this handle')
+    args = parser.parse_args()
+    
+    store = get_blob_store()
+    if args.handle:
+        text = store._load(args.task_id, args.handle)
+        if text is None:
+            print(f"❌ Blob not found: {args.handle}")
+            return 1
+        print(text)
+        return 0
+    
+    blobs = store.list_blobs(args.task_id)
+    if not blobs:
+        print(f"❌ No blobs stored for task: {args.task_id}")
+        return 1
+    for blob in blobs:
+        print(f"{blob['handle']}  {blob['size']:>10} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
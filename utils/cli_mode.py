@@ -63,7 +63,7 @@ TEXTS = {
         'usage_1': 'Enter task directly (use default Agent)',
         'usage_2': '@agent_name task (switch and use specified Agent)',
         'usage_3': 'HIL tasks will auto-prompt for response',
-        'usage_4': 'Ctrl+C interrupt | /resume resume | /quit exit | /help help',
+        'usage_4': 'Ctrl+C interrupt | /resume resume | /usage tokens | /quit exit | /help help',
         
         # Commands
         'starting_task': 'Starting Task',
@@ -121,6 +121,8 @@ TEXTS = {
         'hil_pending': 'HIL task waiting for response',
         'tool_confirm_pending': 'Tool confirmation waiting for processing',
         'press_enter_hint': 'Please press Enter to enter processing mode',
+        'token_usage': 'Token Usage',
+        'no_usage': 'No LLM usage recorded for this task yet',
         
         # Toolbar
         'toolbar': '@agent switch | Ctrl+C interrupt | /resume resume | /quit exit',
@@ -146,7 +148,7 @@ TEXTS = {
         'usage_1': '直接输入任务（使用默认 Agent）',
         'usage_2': '@agent_name 任务（切换并使用指定 Agent）',
         'usage_3': 'HIL 任务出现时会自动提示，输入响应内容即可',
-        'usage_4': 'Ctrl+C 中断任务 | /resume 恢复 | /quit 退出 | /help 帮助',
+        'usage_4': 'Ctrl+C 中断任务 | /resume 恢复 | /usage 用量 | /quit 退出 | /help 帮助',
         
         # Commands
         'starting_task': '启动任务',
@@ -204,6 +206,8 @@ TEXTS = {
         'hil_pending': 'HIL 任务正在等待您的响应',
         'tool_confirm_pending': '工具确认请求正在等待您的处理',
         'press_enter_hint': '请直接按回车进入处理模式',
+        'token_usage': 'Token 用量',
+        'no_usage': '此任务还没有LLM用量记录',
         
         # Toolbar
         'toolbar': '@agent 切换 | Ctrl+C 中断 | /resume 恢复 | /quit 退出',
@@ -348,18 +352,28 @@ class InteractiveCLI:
             task_folder = Path(self.task_id).name if (os.sep in self.task_id or '/' in self.task_id or '\\' in self.task_id) else self.task_id
             task_name = f"{task_hash}_{task_folder}"
             
-            # Stack file location (consistent with hierarchy_manager)
+            # Stack location (consistent with hierarchy_manager and its hierarchy_store backend)
+            from utils.runtime_config import get_runtime_option
             conversations_dir = Path.home() / "mla_v3" / "conversations"
+            db_file = conversations_dir / f"{task_name}_hierarchy.db"
             stack_file = conversations_dir / f"{task_name}_stack.json"
             
-            if not stack_file.exists():
+            if get_runtime_option("hierarchy_store.backend", "sqlite") == "sqlite" and db_file.exists():
+                # Read main branch stack from the database
+                from core.hierarchy_store import SqliteHierarchyStore, MAIN_BRANCH
+                store = SqliteHierarchyStore(self.task_id, db_file)
+                try:
+                    stack = store.get_stack(MAIN_BRANCH)
+                finally:
+                    store.close()
+            elif stack_file.exists():
+                # Read stack
+                with open(stack_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    stack = data.get("stack", [])
+            else:
                 return {"found": False, "message": f"No interrupted task found (file does not exist: {stack_file})"}
             
-            # Read stack
-            with open(stack_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                stack = data.get("stack", [])
-            
             if not stack:
                 return {"found": False, "message": "No interrupted task (stack empty)"}
             
@@ -382,6 +396,21 @@ class InteractiveCLI:
         except Exception as e:
             return {"found": False, "message": f"Failed to read task: {e}"}
     
+    def _show_usage(self):
+        """Show token usage and cost of the current task (from utils/usage_ledger.py)"""
+        from utils.usage_ledger import get_usage_ledger
+        summary = get_usage_ledger().summarize(self.task_id)
+        total = summary["total"]
+        if not total["calls"]:
+            print(f"\n📊 {self.t('no_usage')}\n")
+            return
+        print(f"\n📊 {self.t('token_usage')}: {total['total_tokens']} tokens "
+              f"({total['prompt_tokens']} prompt, {total['cached_tokens']} cached, {total['completion_tokens']} completion), "
+              f"${total['cost']:.4f}, {total['calls']} LLM calls")
+        for purpose, usage in sorted(summary["by_purpose"].items()):
+            print(f"  - {purpose}: {usage['total_tokens']} tokens, ${usage['cost']:.4f} ({usage['calls']} calls)")
+        print()
+    
     def _start_hil_checker(self):
         """Start background HIL/tool confirmation checker thread"""
         def hil_checker_thread():
@@ -737,7 +766,7 @@ class InteractiveCLI:
             # Create auto-completion
             agent_completions = ['@' + agent for agent in self.available_agents]
             completer = WordCompleter(
-                agent_completions + ['/quit', '/exit', '/help', '/agents', '/resume', '/zh', '/en'],
+                agent_completions + ['/quit', '/exit', '/help', '/agents', '/resume', '/usage', '/zh', '/en'],
                 ignore_case=True,
                 sentence=True
             )
@@ -893,6 +922,10 @@ class InteractiveCLI:
                     print()
                     continue
                 
+                if user_input == '/usage':
+                    self._show_usage()
+                    continue
+                
                 if user_input == '/resume':
                     # Resume interrupted task
                     print(f"\n🔍 {self.t('checking_task')}")
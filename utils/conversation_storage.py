@@ -3,43 +3,277 @@
 """
 Conversation History Storage - Simplified Version
 Only saves action_history, does not save traditional user/assistant dialogues
+
+Two backends are available (runtime_config.yaml → conversation_storage.backend):
+- json: rewrites the whole <task>_<agent>_actions.json on every save
+- journal: appends one record per state delta to <task>_<agent>_actions.journal.<gen>
+  and compacts into <task>_<agent>_actions.json in the background
 """
 
+import os
+import copy
 import json
+import shutil
 import hashlib
+import threading
 from pathlib import Path
 from typing import Dict, List
 from datetime import datetime
 
+from utils.runtime_config import get_runtime_option
+
+
+# Fields that only grow by appending between compressions
+LIST_FIELDS = ("action_history", "action_history_fact", "prompt_snapshots")
+
+
+class ActionJournal:
+    """Append-only journal for one agent's action state"""
+    
+    def __init__(self, snapshot_path: str, compact_every: int = 200):
+        """
+        Args:
+            snapshot_path: Path of the <task>_<agent>_actions.json snapshot
+            compact_every: Number of records after which a background snapshot is written
+        """
+        self.snapshot_path = Path(snapshot_path)
+        self.compact_every = max(1, compact_every)
+        self.lock = threading.Lock()
+        self.state = {}
+        self.generation = 0
+        self.records_in_generation = 0
+        self._handle = None
+        self._list_refs = {}  # field -> (list object, persisted length)
+        self._compacting = None
+        self._replay()
+    
+    def _journal_path(self, generation: int) -> Path:
+        return self.snapshot_path.with_name(f"{self.snapshot_path.stem}.journal.{generation}")
+    
+    def _journal_generations(self) -> List[int]:
+        """List existing journal generations in ascending order"""
+        prefix = f"{self.snapshot_path.stem}.journal."
+        generations = []
+        for path in self.snapshot_path.parent.glob(f"{prefix}*"):
+            suffix = path.name[len(prefix):]
+            if suffix.isdigit():
+                generations.append(int(suffix))
+        return sorted(generations)
+    
+    def _replay(self):
+        """Rebuild state from the latest snapshot plus the journal records after it"""
+        snapshot_generation = 0
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+            snapshot_generation = self.state.pop("_journal_generation", 0)
+        
+        self.generation = snapshot_generation
+        for generation in self._journal_generations():
+            if generation < snapshot_generation:
+                continue
+            self.generation = generation
+            self.records_in_generation = 0
+            journal_path = self._journal_path(generation)
+            valid_bytes = 0
+            with open(journal_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line.decode('utf-8'))
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        # Torn write at the end of the journal (process killed mid-append)
+                        break
+                    self._apply(record)
+                    self.records_in_generation += 1
+                    valid_bytes += len(line)
+            if valid_bytes < journal_path.stat().st_size:
+                # Drop the torn tail so new records start on a clean line
+                with open(journal_path, 'r+b') as f:
+                    f.truncate(valid_bytes)
+    
+    def _apply(self, record: Dict):
+        """Apply one journal record to the in-memory state"""
+        self.state.update(record.get("set", {}))
+        for field, items in record.get("extend", {}).items():
+            self.state.setdefault(field, []).extend(items)
+    
+    def read(self) -> Dict:
+        """Return a deep copy of the current state (taken under the lock)"""
+        with self.lock:
+            return copy.deepcopy(self.state)
+    
+    def snapshot(self) -> Dict:
+        """Return a copy of the current state that callers may mutate"""
+        with self.lock:
+            data = copy.deepcopy(self.state)
+            for field in LIST_FIELDS:
+                if field in data:
+                    # The caller keeps appending to this list; track it so the next save is a delta
+                    self._list_refs[field] = (data[field], len(data[field]))
+            return data
+    
+    def append(self, data: Dict):
+        """
+        Persist the difference between data and the last persisted state
+        
+        Args:
+            data: Complete state dictionary (same layout as the _actions.json snapshot)
+        """
+        with self.lock:
+            record = {"set": {}, "extend": {}}
+            
+            for field, value in data.items():
+                if field == "last_updated":
+                    continue
+                if field in LIST_FIELDS:
+                    ref, persisted_len = self._list_refs.get(field, (None, 0))
+                    if value is ref and len(value) >= persisted_len:
+                        if len(value) > persisted_len:
+                            record["extend"][field] = value[persisted_len:]
+                    else:
+                        # List was replaced (compression, thinking reset): persist it whole
+                        record["set"][field] = value
+                    self._list_refs[field] = (value, len(value))
+                elif self.state.get(field) != value or field not in self.state:
+                    record["set"][field] = value
+            
+            if not record["set"] and not record["extend"]:
+                return
+            
+            record["set"]["last_updated"] = data.get("last_updated", datetime.now().isoformat())
+            if not record["extend"]:
+                del record["extend"]
+            
+            if self._handle is None:
+                self._handle = open(self._journal_path(self.generation), 'a', encoding='utf-8')
+            line = json.dumps(record, ensure_ascii=False)
+            self._handle.write(line + "\n")
+            self._handle.flush()
+            
+            # Apply the decoded record rather than the caller's objects, so later in-place
+            # changes by the caller never leak into state (and state matches what replay sees)
+            self._apply(json.loads(line))
+            
+            self.records_in_generation += 1
+            if self.records_in_generation >= self.compact_every and self._compacting is None:
+                self._start_compaction()
+    
+    def _start_compaction(self):
+        """Rotate to a new journal generation and write the snapshot in a background thread (lock held)"""
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        
+        self.generation += 1
+        self.records_in_generation = 0
+        
+        # The snapshot thread serializes its own copy; state keeps changing under the lock meanwhile
+        state = copy.deepcopy(self.state)
+        state["_journal_generation"] = self.generation
+        
+        self._compacting = threading.Thread(
+            target=self._write_snapshot, args=(state, self.generation), daemon=True
+        )
+        self._compacting.start()
+    
+    def _write_snapshot(self, state: Dict, generation: int):
+        """Write the snapshot atomically, then drop the journals it covers"""
+        try:
+            tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+            
+            for old_generation in self._journal_generations():
+                if old_generation < generation:
+                    self._journal_path(old_generation).unlink(missing_ok=True)
+        except Exception as e:
+            print(f"⚠️ Failed to compact conversation journal: {e}")
+        finally:
+            self._compacting = None
+    
+    def compact(self, wait: bool = True):
+        """
+        Force a snapshot of the current state
+        
+        Args:
+            wait: Block until the snapshot is written
+        """
+        with self.lock:
+            if self._compacting is None:
+                self._start_compaction()
+            worker = self._compacting
+        if wait and worker is not None:
+            worker.join()
+
+
+# Journals are shared per file within the process so every reader sees the latest state
+_journals = {}
+_journals_lock = threading.Lock()
+
 
 class ConversationStorage:
     """Conversation history storage"""
     
-    def __init__(self, task_id: str = None):
-        """Initialize storage - uses user home directory (cross-platform)"""
+    def __init__(self, task_id: str = None, backend: str = None):
+        """
+        Initialize storage - uses user home directory (cross-platform)
+        
+        Args:
+            task_id: Task ID
+            backend: "journal" or "json" (defaults to runtime_config.yaml)
+        """
         self.conversations_dir = Path.home() / "mla_v3" / "conversations"
         self.conversations_dir.mkdir(parents=True, exist_ok=True)
         self.task_id = task_id
+        self.backend = backend or get_runtime_option("conversation_storage.backend", "journal")
+        self.compact_every = get_runtime_option("conversation_storage.compact_every", 200)
     
-    def _generate_filename(self, task_id: str, agent_id: str) -> str:
-        """Generate conversation filename: hash + last folder name + agent_id"""
-        from pathlib import Path
-        import hashlib
-        
+    def _task_name(self, task_id: str) -> str:
+        """File name prefix of a task: hash + last folder name"""
         task_hash = hashlib.md5(task_id.encode()).hexdigest()[:8]
         # Cross-platform path handling: check if it's a path (contains / or \)
-        import os
         task_folder = Path(task_id).name if (os.sep in task_id or '/' in task_id or '\\' in task_id) else task_id
-        task_name = f"{task_hash}_{task_folder}"
-        
-        return str(self.conversations_dir / f"{task_name}_{agent_id}_actions.json")
+        return f"{task_hash}_{task_folder}"
+    
+    def _generate_filename(self, task_id: str, agent_id: str) -> str:
+        """Generate conversation filename: hash + last folder name + agent_id"""
+        return str(self.conversations_dir / f"{self._task_name(task_id)}_{agent_id}_actions.json")
+    
+    def usage_ledger_path(self, task_id: str) -> Path:
+        """Token usage ledger of a task (JSONL, see utils/usage_ledger.py)"""
+        return self.conversations_dir / f"{self._task_name(task_id)}_usage.jsonl"
+    
+    def summary_cache_path(self, task_id: str) -> Path:
+        """Memoized compression summaries of a task (JSONL, see services/summary_cache.py)"""
+        return self.conversations_dir / f"{self._task_name(task_id)}_summaries.jsonl"
+    
+    def blob_dir(self, task_id: str) -> Path:
+        """Content-addressed store of offloaded tool results of a task (see utils/blob_store.py)"""
+        return self.conversations_dir / f"{self._task_name(task_id)}_blobs"
+    
+    def prompt_blob_dir(self, task_id: str) -> Path:
+        """Content-addressed store of system prompt snapshots of a task (prompt_snapshot.policy: blob)"""
+        return self.conversations_dir / f"{self._task_name(task_id)}_prompt_blobs"
+    
+    def _get_journal(self, filepath: str) -> ActionJournal:
+        """Get (or replay) the shared journal for a snapshot path"""
+        with _journals_lock:
+            journal = _journals.get(filepath)
+            if journal is None:
+                journal = ActionJournal(filepath, compact_every=self.compact_every)
+                _journals[filepath] = journal
+            return journal
     
     def save_actions(self, task_id: str, agent_id: str, agent_name: str, 
                     task_input: str, action_history: List[Dict], current_turn: int,
                     latest_thinking: str = "", first_thinking_done: bool = False,
                     tool_call_counter: int = 0, system_prompt: str = "",
                     action_history_fact: List[Dict] = None,
-                    pending_tools: List[Dict] = None):
+                    pending_tools: List[Dict] = None,
+                    prompt_snapshots: List[Dict] = None):
         """
         Save action history and complete state
         
@@ -53,7 +287,8 @@ class ConversationStorage:
             latest_thinking: Latest thinking content
             first_thinking_done: Whether first thinking is completed
             tool_call_counter: Tool call counter
-            system_prompt: Complete system_prompt (including XML context)
+            system_prompt: Complete system_prompt (including XML context), empty unless stored inline
+            prompt_snapshots: [{"turn": int, "hash": str}] pointers into the prompt blob store
         """
         try:
             filepath = self._generate_filename(task_id, agent_id)
@@ -71,9 +306,14 @@ class ConversationStorage:
                 "first_thinking_done": first_thinking_done,
                 "tool_call_counter": tool_call_counter,
                 "system_prompt": system_prompt,
+                "prompt_snapshots": prompt_snapshots if prompt_snapshots else [],
                 "last_updated": datetime.now().isoformat()
             }
             
+            if self.backend == "journal":
+                self._get_journal(filepath).append(data)
+                return
+            
             with open(filepath, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=2, ensure_ascii=False)
             
@@ -82,6 +322,29 @@ class ConversationStorage:
         except Exception as e:
             print(f"⚠️ Failed to save conversation history: {e}")
     
+    def read_state(self, task_id: str, agent_id: str) -> Dict:
+        """
+        Read the saved state without logging (used by context building)
+        
+        Returns:
+            State dictionary (a private copy), or None if not exist
+        """
+        filepath = self._generate_filename(task_id, agent_id)
+        
+        if self.backend == "journal":
+            with _journals_lock:
+                journal = _journals.get(filepath)
+            if journal is not None:
+                return journal.read()
+            if not Path(filepath).exists() and not list(Path(filepath).parent.glob(f"{Path(filepath).stem}.journal.*")):
+                return None
+            return self._get_journal(filepath).read()
+        
+        if not Path(filepath).exists():
+            return None
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
     def load_actions(self, task_id: str, agent_id: str) -> Dict:
         """
         Load action history
@@ -96,11 +359,16 @@ class ConversationStorage:
         try:
             filepath = self._generate_filename(task_id, agent_id)
             
-            if not Path(filepath).exists():
-                return None
-            
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            if self.backend == "journal":
+                if self.read_state(task_id, agent_id) is None:
+                    return None
+                data = self._get_journal(filepath).snapshot()
+            else:
+                if not Path(filepath).exists():
+                    return None
+                
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
             
             print(f"📂 Action history loaded: Turn {data.get('current_turn', 0)}, {len(data.get('action_history', []))} actions")
             return data
@@ -108,6 +376,61 @@ class ConversationStorage:
         except Exception as e:
             print(f"⚠️ Failed to load conversation history: {e}")
             return None
+    
+    def save_prompt_blob(self, task_id: str, system_prompt: str) -> str:
+        """
+        Store a rendered system prompt content-addressed by its hash (deduplicated within the task)
+        
+        Returns:
+            SHA-256 hex digest of the prompt
+        """
+        prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+        blob_dir = self.prompt_blob_dir(task_id)
+        blob_path = blob_dir / f"{prompt_hash}.txt"
+        if blob_path.exists():
+            return prompt_hash
+        
+        try:
+            blob_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_name(blob_path.name + f".{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(system_prompt)
+            os.replace(tmp_path, blob_path)
+        except Exception as e:
+            print(f"⚠️ Failed to save prompt blob: {e}")
+        return prompt_hash
+    
+    def load_prompt_blob(self, task_id: str, prompt_hash: str) -> str:
+        """
+        Load a system prompt stored by save_prompt_blob
+        
+        Returns:
+            Prompt text, or None if not exist
+        """
+        blob_path = self.prompt_blob_dir(task_id) / f"{prompt_hash}.txt"
+        if not blob_path.exists():
+            return None
+        with open(blob_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    
+    def delete_prompt_blobs(self, task_id: str) -> int:
+        """
+        Delete all prompt snapshots of a task (called when the task state is reset)
+        
+        Returns:
+            Number of deleted blobs
+        """
+        blob_dir = self.prompt_blob_dir(task_id)
+        if not blob_dir.exists():
+            return 0
+        count = len(list(blob_dir.glob("*.txt")))
+        shutil.rmtree(blob_dir, ignore_errors=True)
+        return count
+    
+    def compact(self, task_id: str, agent_id: str):
+        """Write the _actions.json snapshot now (journal backend only)"""
+        if self.backend == "journal":
+            self._get_journal(self._generate_filename(task_id, agent_id)).compact(wait=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM Scheduler - Per-model request/token rate limiting with a priority queue
+
+Every LLM request in a process (agents, sub-agents, thinking, compression and
+the tool server's LLMClientLite) acquires a slot before it is sent:
+- requests-per-minute and tokens-per-minute token buckets per model
+  (prompt tokens estimated with tiktoken, corrected with the real usage afterwards)
+- waiting requests are served by priority, then arrival order
+- queue depth and wait time metrics per model (also emitted as trace counters)
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from typing import Dict, Any, Optional
+from utils.tracer import get_tracer
+
+
+# Priorities (lower is served first)
+PRIORITY_AGENT = 0          # agent turns, + hierarchy level (top-level agent first)
+PRIORITY_TOOL = 20          # LLM calls made by tools (tool server)
+PRIORITY_THINKING = 40      # progress analysis
+PRIORITY_COMPRESSION = 80   # history compression and summarization
+PRIORITY_DEFAULT = PRIORITY_TOOL
+
+
+def agent_priority(level: int) -> int:
+    """Priority of an agent turn at the given hierarchy level"""
+    return PRIORITY_AGENT + max(0, min(int(level or 0), PRIORITY_TOOL - 1))
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at capacity per minute"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount (capped at capacity) is available"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float):
+        # May go negative (debt) when a request is larger than the bucket
+        # or the real usage exceeded the estimate
+        self.tokens -= amount
+
+
+class _ModelQueue:
+    """Buckets, waiting requests and metrics of one model"""
+    
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.waiting = []  # heap of (priority, seq)
+        self.granted = 0
+        self.queued = 0
+        self.total_wait = 0.0
+        self.max_depth = 0
+    
+    def wait_time(self, tokens: int, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+    
+    def consume(self, tokens: int):
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(tokens)
+
+
+class Grant:
+    """A granted request slot (pass to LLMScheduler.settle after the call)"""
+    
+    def __init__(self, model: str, tokens: int, waited: float):
+        self.model = model
+        self.tokens = tokens
+        self.waited = waited
+
+
+class LLMScheduler:
+    """Per-model rate limiter shared by all LLM callers in the process"""
+    
+    def __init__(self, config: Dict = None):
+        """
+        Args:
+            config: llm_scheduler section of runtime_config.yaml
+        """
+        config = config or {}
+        self.enabled = bool(config.get("enabled", False))
+        self.default_limits = config.get("default", {}) or {}
+        self.model_limits = config.get("models", {}) or {}
+        self.completion_estimate = int(config.get("completion_estimate", 1000))
+        self.cond = threading.Condition()
+        self.queues = {}
+        self._seq = itertools.count()
+        self._encoding = None
+        self._encoding_loaded = False
+    
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self.queues.get(model)
+        if queue is None:
+            limits = dict(self.default_limits, **(self.model_limits.get(model, {}) or {}))
+            queue = self.queues[model] = _ModelQueue(limits.get("rpm", 0), limits.get("tpm", 0))
+        return queue
+    
+    # ------------------------------------------------------------------
+    # Token estimation
+    # ------------------------------------------------------------------
+    
+    def _count_text(self, text: str) -> int:
+        if not self._encoding_loaded:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                self._encoding = None
+            self._encoding_loaded = True
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(text) // 3
+    
+    def estimate_tokens(self, messages: list = None, tools: list = None, max_tokens: int = None) -> int:
+        """
+        Estimate the tokens a request will use (prompt + expected completion)
+        
+        Args:
+            messages: OpenAI-format messages (string or content-block content)
+            tools: Tool definitions
+            max_tokens: Completion limit of the request (0/None: completion_estimate)
+        """
+        total = 0
+        for message in messages or []:
+            content = message.get("content", "")
+            if isinstance(content, list):
+                content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+            total += self._count_text(str(content)) + 4
+        if tools:
+            import json
+            total += self._count_text(json.dumps(tools, ensure_ascii=False))
+        return total + (max_tokens or self.completion_estimate)
+    
+    # ------------------------------------------------------------------
+    # Acquire / settle
+    # ------------------------------------------------------------------
+    
+    def _try_grant(self, queue: _ModelQueue, entry, tokens: int) -> Optional[float]:
+        """
+        Grant the slot if entry is first in line and the buckets allow it (caller holds cond)
+        
+        Returns:
+            None when granted, otherwise seconds to wait before checking again
+        """
+        if queue.waiting[0] != entry:
+            return 1.0  # woken up by notify_all when the head is granted
+        wait = queue.wait_time(tokens, time.monotonic())
+        if wait > 0:
+            return wait
+        heapq.heappop(queue.waiting)
+        queue.consume(tokens)
+        return None
+    
+    def _enqueue(self, model: str, priority: int):
+        queue = self._queue(model)
+        entry = (priority, next(self._seq))
+        heapq.heappush(queue.waiting, entry)
+        queue.queued += 1
+        queue.max_depth = max(queue.max_depth, len(queue.waiting))
+        return queue, entry
+    
+    def _granted(self, model: str, queue: _ModelQueue, tokens: int, start: float) -> Grant:
+        waited = time.monotonic() - start
+        queue.granted += 1
+        queue.total_wait += waited
+        self.cond.notify_all()
+        self._emit_depth(model, queue)
+        return Grant(model, tokens, waited)
+    
+    def acquire(self, model: str, tokens: int = 0, priority: int = PRIORITY_DEFAULT) -> Optional[Grant]:
+        """
+        Block until a request of the given size may be sent to model
+        
+        Returns:
+            Grant (None when the scheduler is disabled)
+        """
+        if not self.enabled:
+            return None
+        start = time.monotonic()
+        with self.cond:
+            queue, entry = self._enqueue(model, priority)
+            self._emit_depth(model, queue)
+            try:
+                while True:
+                    wait = self._try_grant(queue, entry, tokens)
+                    if wait is None:
+                        return self._granted(model, queue, tokens, start)
+                    self.cond.wait(timeout=wait)
+            except BaseException:
+                self._leave(queue, entry)
+                raise
+    
+    async def acquire_async(self, model: str, tokens: int = 0, priority: int = PRIORITY_DEFAULT) -> Optional[Grant]:
+        """acquire for coroutines (waits without blocking the event loop)"""
+        if not self.enabled:
+            return None
+        start = time.monotonic()
+        with self.cond:
+            queue, entry = self._enqueue(model, priority)
+            self._emit_depth(model, queue)
+        try:
+            while True:
+                with self.cond:
+                    wait = self._try_grant(queue, entry, tokens)
+                    if wait is None:
+                        return self._granted(model, queue, tokens, start)
+                await asyncio.sleep(min(wait, 0.05))
+        except BaseException:
+            # Cancelled while waiting: leave the queue
+            with self.cond:
+                self._leave(queue, entry)
+            raise
+    
+    def _leave(self, queue: _ModelQueue, entry):
+        """Remove a request that stopped waiting (caller holds cond)"""
+        if entry in queue.waiting:
+            queue.waiting.remove(entry)
+            heapq.heapify(queue.waiting)
+            self.cond.notify_all()
+    
+    def settle(self, grant: Optional[Grant], usage: Optional[Dict]):
+        """
+        Correct the token bucket with the real usage of a granted request
+        
+        Args:
+            grant: Result of acquire
+            usage: Usage of the response; None (or no total_tokens) keeps the estimate,
+                {"total_tokens": 0} refunds it (the call failed)
+        """
+        if grant is None or not usage or usage.get("total_tokens") is None:
+            return
+        with self.cond:
+            queue = self._queue(grant.model)
+            if queue.tokens is not None:
+                queue.tokens.consume(usage["total_tokens"] - grant.tokens)
+    
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+    
+    def _emit_depth(self, model: str, queue: _ModelQueue):
+        get_tracer().counter(f"llm_queue {model}", "llm", depth=len(queue.waiting))
+    
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Queue and budget metrics per model
+        
+        Returns:
+            {model: {queue_depth, max_queue_depth, queued, granted, avg_wait_s,
+                     requests_available, tokens_available}}
+        """
+        with self.cond:
+            now = time.monotonic()
+            metrics = {}
+            for model, queue in self.queues.items():
+                if queue.requests is not None:
+                    queue.requests._refill(now)
+                if queue.tokens is not None:
+                    queue.tokens._refill(now)
+                metrics[model] = {
+                    "queue_depth": len(queue.waiting),
+                    "max_queue_depth": queue.max_depth,
+                    "queued": queue.queued,
+                    "granted": queue.granted,
+                    "avg_wait_s": queue.total_wait / queue.granted if queue.granted else 0.0,
+                    "requests_available": int(queue.requests.tokens) if queue.requests is not None else None,
+                    "tokens_available": int(queue.tokens.tokens) if queue.tokens is not None else None
+                }
+            return metrics
+
+
+# Global instance
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Get global LLM scheduler (configured from runtime_config.yaml llm_scheduler)"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            from utils.runtime_config import get_runtime_option
+            _scheduler = LLMScheduler(get_runtime_option("llm_scheduler", {}))
+        return _scheduler
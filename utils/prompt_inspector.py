@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prompt Inspector - Show or re-render historical system prompts from saved agent state
+
+Usage:
+    python utils/prompt_inspector.py --task_id /path/to/workspace                 # list agents
+    python utils/prompt_inspector.py --task_id ... --agent_id ID --list           # list snapshots
+    python utils/prompt_inspector.py --task_id ... --agent_id ID --turn 12        # stored prompt
+    python utils/prompt_inspector.py --task_id ... --agent_id ID --render         # re-render latest
+"""
+
+import sys
+import glob
+import argparse
+from pathlib import Path
+
+# Ensure project modules can be imported when run as a script
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.conversation_storage import ConversationStorage
+
+
+def list_agents(storage: ConversationStorage, task_id: str) -> list:
+    """List agent IDs that have saved state for a task"""
+    pattern = storage._generate_filename(task_id, "*")
+    prefix = pattern.split("*", 1)[0]
+    agent_ids = set()
+    for path in glob.glob(glob.escape(prefix) + "*"):
+        rest = path[len(prefix):]
+        if "_actions." in rest:
+            agent_ids.add(rest.split("_actions.", 1)[0])
+    return sorted(agent_ids)
+
+
+def get_stored_prompt(storage: ConversationStorage, state: dict, turn: int = None) -> str:
+    """
+    Get the stored system prompt closest to (at or before) a turn
+    
+    The inline/checkpoint policies keep only the prompt of the latest saved turn,
+    so for them an earlier turn has no stored prompt.
+    
+    Args:
+        storage: Conversation storage
+        state: Saved agent state
+        turn: Turn number (None for the latest)
+    
+    Returns:
+        Prompt text, or None if no prompt was stored
+    """
+    snapshots = state.get("prompt_snapshots", [])
+    if snapshots:
+        candidates = [s for s in snapshots if turn is None or s.get("turn", 0) <= turn]
+        if candidates:
+            return storage.load_prompt_blob(state.get("task_id", ""), candidates[-1]["hash"])
+        return None
+    if turn is not None and turn < state.get("current_turn", 0):
+        return None
+    return state.get("system_prompt") or None
+
+
+def render_prompt(task_id: str, state: dict, agent_system: str) -> str:
+    """
+    Re-render the system prompt from the latest saved state
+    
+    The call tree and user inputs come from the current shared context of the task;
+    earlier turns cannot be rebuilt this way.
+    """
+    from utils.config_loader import ConfigLoader
+    from core.hierarchy_manager import get_hierarchy_manager
+    from core.context_builder import ContextBuilder
+    
+    config_loader = ConfigLoader(agent_system)
+    agent_name = state.get("agent_name", "")
+    builder = ContextBuilder(
+        get_hierarchy_manager(task_id),
+        agent_config=config_loader.get_tool_config(agent_name),
+        config_loader=config_loader
+    )
+    return builder.build_context(
+        task_id,
+        state.get("agent_id", ""),
+        agent_name,
+        state.get("task_input", ""),
+        action_history=state.get("action_history", []),
+        thinking=state.get("latest_thinking", "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect historical system prompts of an agent')
+    parser.add_argument('--task_id', type=str, required=True, help='Task ID (workspace path)')
+    parser.add_argument('--agent_id', type=str, help='Agent ID (omit to list agents of the task)')
+    parser.add_argument('--turn', type=int, help='Show the stored prompt at or before this turn (requires a stored snapshot)')
+    parser.add_argument('--list', action='store_true', help='List stored prompt snapshots')
+    parser.add_argument('--render', action='store_true', help='Re-render the prompt from the latest saved state')
+    parser.add_argument('--agent_system', type=str, default='Default', help='Agent system name (for --render)')
+    parser.add_argument('--output', type=str, help='Write the prompt to a file instead of stdout')
+    args = parser.parse_args()
+    
+    storage = ConversationStorage()
+    
+    if not args.agent_id:
+        agent_ids = list_agents(storage, args.task_id)
+        if not agent_ids:
+            print(f"❌ No saved agent state for task: {args.task_id}")
+            return 1
+        print(f"📋 Agents with saved state ({len(agent_ids)}):")
+        for agent_id in agent_ids:
+            print(f"   {agent_id}")
+        return 0
+    
+    state = storage.read_state(args.task_id, args.agent_id)
+    if state is None:
+        print(f"❌ No saved state for agent: {args.agent_id}")
+        return 1
+    
+    if args.list:
+        snapshots = state.get("prompt_snapshots", [])
+        print(f"📋 Prompt snapshots for {args.agent_id}: {len(snapshots)}")
+        for snapshot in snapshots:
+            print(f"   turn {snapshot.get('turn')}: {snapshot.get('hash')}")
+        if state.get("system_prompt"):
+            print(f"   inline prompt stored at turn {state.get('current_turn')}")
+        return 0
+    
+    if args.render and args.turn is not None:
+        print("❌ --render rebuilds the latest state only and cannot be combined with --turn")
+        return 1
+    
+    if args.render:
+        prompt = render_prompt(args.task_id, state, args.agent_system)
+    else:
+        prompt = get_stored_prompt(storage, state, args.turn)
+        if prompt is None and args.turn is not None:
+            print(f"❌ No stored prompt at or before turn {args.turn} "
+                  f"(use prompt_snapshot.policy: blob to keep per-turn prompts)")
+            return 1
+        if prompt is None:
+            print("ℹ️ No stored prompt for this agent, re-rendering from the latest saved state")
+            prompt = render_prompt(args.task_id, state, args.agent_system)
+    
+    if args.output:
+        Path(args.output).write_text(prompt, encoding='utf-8')
+        print(f"✅ Prompt written to {args.output} ({len(prompt)} characters)")
+    else:
+        print(prompt)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
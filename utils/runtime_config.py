@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runtime Configuration - Framework options from run_env_config/runtime_config.yaml
+"""
+
+import copy
+import threading
+import yaml
+from pathlib import Path
+from typing import Any, Dict
+
+
+# Defaults used when runtime_config.yaml is missing or a key is not set
+DEFAULT_RUNTIME_CONFIG = {
+    "conversation_storage": {
+        "backend": "journal",
+        "compact_every": 200,
+    },
+    "prompt_snapshot": {
+        "policy": "checkpoint",
+    },
+    "tool_execution": {
+        "parallel_tool_calls": False,
+        "max_parallel_tools": 8,
+        "parallel_sub_agents": False,
+        "max_parallel_sub_agents": 4,
+    },
+    "hierarchy_store": {
+        "backend": "sqlite",
+        "export_json": True,
+        "history_archive": {
+            "enabled": True,
+            "hot_entries": 10,
+            "segment_size": 50,
+        },
+    },
+    "llm_runtime": {
+        "config_path": None,
+        "connection_pool": True,
+        "max_connections": 20,
+        "max_keepalive_connections": 10,
+        "keepalive_expiry": 60,
+    },
+    "llm_stream": {
+        "enabled": False,
+        "early_tool_dispatch": True,
+    },
+    "prompt_layout": {
+        "mode": "legacy",
+        "cache_control": "auto",
+    },
+    "llm_cache": {
+        "mode": "off",
+        "cache_dir": None,
+        "max_size_mb": 512,
+        "cassette": None,
+    },
+    "llm_retry": {
+        "max_retries": 3,
+        "base_delay": 1.0,
+        "max_delay": 30,
+        "max_retry_after": 120,
+        "fallback_models": False,
+        "hedge": {
+            "enabled": False,
+            "percentile": 95,
+            "min_samples": 20,
+            "min_delay": 1.0,
+        },
+    },
+    "llm_scheduler": {
+        "enabled": False,
+        "default": {
+            "rpm": 0,
+            "tpm": 0,
+        },
+        "models": {},
+        "completion_estimate": 1000,
+    },
+    "tool_results": {
+        "offload": False,
+        "max_inline_chars": 20000,
+        "preview_chars": 2000,
+        "max_read_chars": 20000,
+    },
+    "context_compression": {
+        "max_parallel_chunks": 4,
+        "merge_chunks": True,
+        "summary_mode": "full",
+        "segment_tokens": 1500,
+        "summary_fanout": 4,
+        "summary_cache": {
+            "enabled": False,
+            "max_entries": 500,
+        },
+        "precompact": {
+            "enabled": False,
+            "low_watermark": 0.75,
+        },
+    },
+    "usage_ledger": {
+        "enabled": True,
+        "prices": {},
+        "budget": {
+            "max_tokens": 0,
+            "max_cost": 0,
+        },
+    },
+}
+
+_runtime_config = None
+_runtime_config_lock = threading.Lock()
+
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    """Recursively merge override into a copy of base"""
+    merged = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def get_runtime_config(reload: bool = False) -> Dict:
+    """
+    Get the runtime configuration (parsed once per process)
+
+    Args:
+        reload: Re-read the configuration file
+
+    Returns:
+        Configuration dictionary merged over the defaults
+    """
+    global _runtime_config
+    with _runtime_config_lock:
+        if _runtime_config is None or reload:
+            config_file = Path(__file__).parent.parent / "config" / "run_env_config" / "runtime_config.yaml"
+            data = {}
+            try:
+                if config_file.exists():
+                    with open(config_file, 'r', encoding='utf-8') as f:
+                        data = yaml.safe_load(f) or {}
+            except Exception as e:
+                print(f"⚠️ Failed to load runtime configuration: {e}, using defaults")
+            _runtime_config = _merge(DEFAULT_RUNTIME_CONFIG, data)
+        return _runtime_config
+
+
+def get_runtime_option(key: str, default: Any = None) -> Any:
+    """
+    Get a single runtime option
+
+    Args:
+        key: Option key, supports dot notation (e.g., conversation_storage.backend)
+        default: Value returned when the key is not set
+    """
+    current = get_runtime_config()
+    for k in key.split('.'):
+        if not isinstance(current, dict) or k not in current:
+            return default
+        current = current[k]
+    return current
+
+
+def set_runtime_option(key: str, value: Any):
+    """
+    Override a runtime option for this process (e.g. from a command-line flag)
+
+    Args:
+        key: Option key, supports dot notation (e.g., llm_cache.mode)
+        value: New value
+    """
+    current = get_runtime_config()
+    keys = key.split('.')
+    with _runtime_config_lock:
+        for k in keys[:-1]:
+            current = current.setdefault(k, {})
+        current[keys[-1]] = value
+
+
+if __name__ == "__main__":
+    # Test
+    print(yaml.dump(get_runtime_config(), allow_unicode=True, default_flow_style=False))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Span Tracer - Per-turn latency tracing with Chrome/Perfetto trace-event export
+
+Spans are recorded as complete ("X") events and nest by time on the same track
+(thread, or asyncio task with its own track). Open the exported JSON in
+chrome://tracing or https://ui.perfetto.dev to get a flame view of a run.
+"""
+
+import os
+import json
+import time
+import inspect
+import threading
+import contextvars
+import functools
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+
+# Track (trace "tid") of the current asyncio task, None means "use the thread id"
+_current_track = contextvars.ContextVar("trace_track", default=None)
+
+
+class Tracer:
+    """Span tracer (no-op when disabled)"""
+    
+    def __init__(self, enabled: bool = False):
+        """
+        Args:
+            enabled: Whether to record spans
+        """
+        self.enabled = enabled
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.t0 = time.perf_counter()
+        self._track_ids = {}  # thread ident / track name -> tid
+    
+    def _now_us(self) -> float:
+        """Microseconds since the tracer was created"""
+        return (time.perf_counter() - self.t0) * 1e6
+    
+    def _tid(self) -> int:
+        """Trace tid of the current thread or asyncio track"""
+        track = _current_track.get()
+        if track is None:
+            key, name = threading.get_ident(), threading.current_thread().name
+        else:
+            key, name = track, track
+        tid = self._track_ids.get(key)
+        if tid is None:
+            with self.lock:
+                tid = self._track_ids.get(key)
+                if tid is None:
+                    tid = len(self._track_ids) + 1
+                    self._track_ids[key] = tid
+                    self.events.append({
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": self.pid,
+                        "tid": tid,
+                        "args": {"name": name}
+                    })
+        return tid
+    
+    @contextmanager
+    def span(self, name: str, category: str = "agent", **args):
+        """
+        Record a span around a block
+        
+        Yields a dict of span arguments; values added inside the block
+        (e.g. token usage) are exported with the span.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        
+        span_args = dict(args)
+        tid = self._tid()
+        start = self._now_us()
+        try:
+            yield span_args
+        finally:
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start,
+                "dur": self._now_us() - start,
+                "pid": self.pid,
+                "tid": tid,
+                "args": span_args
+            }
+            with self.lock:
+                self.events.append(event)
+    
+    @contextmanager
+    def track(self, name: str):
+        """
+        Run a block on its own trace track
+        
+        Concurrent asyncio tasks share one thread; giving each task its own track
+        keeps their spans from being mis-nested.
+        """
+        if not self.enabled:
+            yield
+            return
+        token = _current_track.set(f"{name}-{id(object())}")
+        try:
+            yield
+        finally:
+            _current_track.reset(token)
+    
+    def instant(self, name: str, category: str = "agent", **args):
+        """Record an instant event"""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "i",
+            "s": "t",
+            "ts": self._now_us(),
+            "pid": self.pid,
+            "tid": self._tid(),
+            "args": args
+        }
+        with self.lock:
+            self.events.append(event)
+    
+    def counter(self, name: str, category: str = "agent", **values):
+        """Record counter values (rendered as a counter track, e.g. queue depth)"""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "C",
+            "ts": self._now_us(),
+            "pid": self.pid,
+            "args": values
+        }
+        with self.lock:
+            self.events.append(event)
+    
+    def export(self, path: str) -> int:
+        """
+        Write recorded events in Chrome trace-event format
+        
+        Returns:
+            Number of events written
+        """
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return len(events)
+
+
+def traced(name: str, category: str = "agent"):
+    """Decorator recording a span around a function or coroutine function"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with get_tracer().span(name, category):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def usage_args(usage: Optional[Dict]) -> Dict[str, Any]:
+    """Token counts from LLMResponse.usage as span arguments"""
+    if not usage:
+        return {}
+    args = {
+        k: usage.get(k, 0)
+        for k in ("prompt_tokens", "completion_tokens", "total_tokens", "cached_tokens", "cache_creation_tokens")
+    }
+    if usage.get("attempts"):
+        args["attempts"] = len(usage["attempts"])
+    return args
+
+
+# Global instance
+_tracer = Tracer(enabled=False)
+
+
+def init_tracer(enabled: bool = False) -> Tracer:
+    """Initialize global tracer"""
+    global _tracer
+    _tracer = Tracer(enabled=enabled)
+    return _tracer
+
+
+def get_tracer() -> Tracer:
+    """Get global tracer"""
+    return _tracer
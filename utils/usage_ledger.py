@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Usage Ledger - Token usage, latency and cost of every LLM call, with per-task budgets
+
+Every SimpleLLMClient.chat/achat call is appended to
+~/mla_v3/conversations/<task>_usage.jsonl (next to the conversation files),
+attributed to the task and agent of the current usage_scope and to the call
+purpose (agent_turn, thinking, compression, history_compression).
+
+Usage:
+    python utils/usage_ledger.py --task_id /path/to/workspace             # totals by agent / purpose / model
+    python utils/usage_ledger.py --task_id /path/to/workspace --records   # every call
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Ensure project modules can be imported when run as a script
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.conversation_storage import ConversationStorage
+
+
+# (task_id, agent_id) the LLM calls of the current thread / asyncio task belong to
+_current_scope = contextvars.ContextVar("usage_scope", default=(None, None))
+
+_TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens")
+
+
+@contextmanager
+def usage_scope(task_id: str, agent_id: str):
+    """Attribute the LLM calls made inside the block to a task and agent"""
+    token = _current_scope.set((task_id, agent_id))
+    try:
+        yield
+    finally:
+        _current_scope.reset(token)
+
+
+def set_usage_agent(agent_id: str):
+    """
+    Set the agent of the enclosing usage_scope (agent IDs are assigned after the scope
+    is entered; the scope's exit still restores the outer value)
+    """
+    task_id, _ = _current_scope.get()
+    _current_scope.set((task_id, agent_id))
+
+
+def current_scope():
+    """(task_id, agent_id) of the current usage_scope ((None, None) outside one)"""
+    return _current_scope.get()
+
+
+def _empty_totals() -> Dict:
+    totals = {field: 0 for field in _TOKEN_FIELDS}
+    totals.update({"calls": 0, "errors": 0, "cache_hits": 0, "latency_ms": 0, "cost": 0.0})
+    return totals
+
+
+def _add(totals: Dict, record: Dict):
+    for field in _TOKEN_FIELDS:
+        totals[field] += record.get(field, 0) or 0
+    totals["calls"] += 1
+    totals["errors"] += record.get("status") != "success"
+    totals["cache_hits"] += bool(record.get("from_cache"))
+    totals["latency_ms"] += record.get("latency_ms", 0) or 0
+    totals["cost"] += record.get("cost", 0.0) or 0.0
+
+
+class UsageLedger:
+    """Append-only per-task usage ledger shared by all LLM callers in the process"""
+    
+    def __init__(self, config: Dict = None):
+        """
+        Args:
+            config: usage_ledger section of runtime_config.yaml
+        """
+        config = config or {}
+        self.enabled = bool(config.get("enabled", True))
+        self.prices = config.get("prices", {}) or {}
+        budget = config.get("budget", {}) or {}
+        self.max_tokens = int(budget.get("max_tokens", 0) or 0)
+        self.max_cost = float(budget.get("max_cost", 0) or 0)
+        self.storage = ConversationStorage()
+        self.lock = threading.Lock()
+        self._totals = {}  # task_id -> totals, loaded from the ledger file on first use
+    
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """
+        USD cost of a call
+        
+        Prices come from usage_ledger.prices (USD per 1M tokens: prompt, completion,
+        cached), then from litellm's model price table; unknown models cost 0.
+        """
+        price = self.prices.get(model)
+        if price:
+            cached_price = price.get("cached", price.get("prompt", 0))
+            return ((prompt_tokens - cached_tokens) * price.get("prompt", 0)
+                    + cached_tokens * cached_price
+                    + completion_tokens * price.get("completion", 0)) / 1_000_000
+        try:
+            import litellm
+            prompt_cost, completion_cost = litellm.cost_per_token(
+                model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+            )
+            return prompt_cost + completion_cost
+        except Exception:
+            return 0.0
+    
+    def record(self, purpose: str, model: str, usage: Optional[Dict], latency: float,
+               status: str = "success", from_cache: bool = False) -> Optional[Dict]:
+        """
+        Append one LLM call to the ledger of the current usage_scope's task
+        
+        Args:
+            purpose: Call purpose (agent_turn / thinking / compression / history_compression)
+            model: Model name
+            usage: LLMResponse.usage
+            latency: Wall-clock seconds of the call (including queueing and retries)
+            status: LLMResponse.status
+            from_cache: Served from the response cache / cassette (no tokens billed)
+        
+        Returns:
+            The stored record (None when disabled or outside a usage_scope)
+        """
+        task_id, agent_id = current_scope()
+        if not self.enabled or not task_id:
+            return None
+        
+        usage = usage or {}
+        record = {
+            "ts": time.time(),
+            "task_id": task_id,
+            "agent_id": agent_id,
+            "purpose": purpose or "other",
+            "model": model,
+            "status": status,
+            "from_cache": from_cache,
+            "latency_ms": int(latency * 1000),
+            "attempts": len(usage.get("attempts", []) or [])
+        }
+        for field in _TOKEN_FIELDS:
+            record[field] = 0 if from_cache else int(usage.get(field, 0) or 0)
+        record["cost"] = 0.0 if from_cache else self.cost(
+            model, record["prompt_tokens"], record["completion_tokens"], record["cached_tokens"]
+        )
+        
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            totals = self._load_totals(task_id)
+            _add(totals, record)
+            try:
+                with open(self.storage.usage_ledger_path(task_id), 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"⚠️ Failed to write usage ledger: {e}")
+        return record
+    
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    
+    def read_records(self, task_id: str) -> List[Dict]:
+        """All records of a task, oldest first"""
+        path = self.storage.usage_ledger_path(task_id)
+        if not path.exists():
+            return []
+        records = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # partial line from an interrupted write
+        return records
+    
+    def _load_totals(self, task_id: str) -> Dict:
+        """Running totals of a task (caller holds lock)"""
+        totals = self._totals.get(task_id)
+        if totals is None:
+            totals = self._totals[task_id] = _empty_totals()
+            for record in self.read_records(task_id):
+                _add(totals, record)
+        return totals
+    
+    def totals(self, task_id: str) -> Dict:
+        """Token, call, latency and cost totals of a task"""
+        with self.lock:
+            return dict(self._load_totals(task_id))
+    
+    def summarize(self, task_id: str) -> Dict:
+        """
+        Totals of a task, overall and grouped
+        
+        Returns:
+            {total, by_agent, by_purpose, by_model, budget}
+        """
+        summary = {"total": _empty_totals(), "by_agent": {}, "by_purpose": {}, "by_model": {}}
+        for record in self.read_records(task_id):
+            _add(summary["total"], record)
+            for group, key in (("by_agent", "agent_id"), ("by_purpose", "purpose"), ("by_model", "model")):
+                _add(summary[group].setdefault(str(record.get(key)), _empty_totals()), record)
+        summary["budget"] = {"max_tokens": self.max_tokens, "max_cost": self.max_cost}
+        return summary
+    
+    def check_budget(self, task_id: str) -> Optional[str]:
+        """
+        Check the per-task budget (usage_ledger.budget, 0 = unlimited)
+        
+        Returns:
+            Description of the exceeded budget, None while within budget
+        """
+        if not self.enabled or not task_id or (not self.max_tokens and not self.max_cost):
+            return None
+        totals = self.totals(task_id)
+        if self.max_tokens and totals["total_tokens"] >= self.max_tokens:
+            return f"Token budget exceeded: {totals['total_tokens']} / {self.max_tokens} tokens"
+        if self.max_cost and totals["cost"] >= self.max_cost:
+            return f"Cost budget exceeded: ${totals['cost']:.4f} / ${self.max_cost:.4f}"
+        return None
+
+
+# Global instance
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Get global usage ledger (configured from runtime_config.yaml usage_ledger)"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            from utils.runtime_config import get_runtime_option
+            _ledger = UsageLedger(get_runtime_option("usage_ledger", {}))
+        return _ledger
+
+
+def _format_totals(totals: Dict) -> str:
+    return (f"{totals['calls']:>5} calls  {totals['prompt_tokens']:>10} prompt  "
+            f"{totals['cached_tokens']:>9} cached  {totals['completion_tokens']:>9} completion  "
+            f"${totals['cost']:>9.4f}  {totals['latency_ms'] / 1000:>8.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the token usage and cost ledger of a task')
+    parser.add_argument('--task_id', type=str, required=True, help='Task ID (workspace path)')
+    parser.add_argument('--records', action='store_true', help='List every recorded LLM call')
+    parser.add_argument('--json', action='store_true', help='Print as JSON')
+    args = parser.parse_args()
+    
+    ledger = get_usage_ledger()
+    if args.records:
+        records = ledger.read_records(args.task_id)
+        if args.json:
+            print(json.dumps(records, ensure_ascii=False, indent=2))
+            return 0
+        for record in records:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['ts']))}  "
+                  f"{record.get('agent_id')}  {record.get('purpose')}  {record.get('model')}  "
+                  f"{record.get('status')}  {record.get('prompt_tokens')}+{record.get('completion_tokens')} tokens  "
+                  f"{record.get('latency_ms')}ms  ${record.get('cost', 0):.4f}")
+        return 0
+    
+    summary = ledger.summarize(args.task_id)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 0
+    if not summary["total"]["calls"]:
+        print(f"❌ No usage recorded for task: {args.task_id}")
+        return 1
+    print(f"📊 Usage of {args.task_id}")
+    print(f"   {'total':<24} {_format_totals(summary['total'])}")
+    for group, title in (("by_agent", "Agents"), ("by_purpose", "Purposes"), ("by_model", "Models")):
+        print(f"\n{title}:")
+        for key, totals in sorted(summary[group].items()):
+            print(f"   {key:<24} {_format_totals(totals)}")
+    budget = summary["budget"]
+    if budget["max_tokens"] or budget["max_cost"]:
+        print(f"\nBudget: max_tokens={budget['max_tokens'] or 'unlimited'}, max_cost={budget['max_cost'] or 'unlimited'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1036,6 +1036,29 @@ def get_status():
     })
 
 
+@app.route('/api/usage', methods=['GET'])
+@login_required
+def get_usage():
+    """Get token usage and cost of a task (totals by agent / purpose / model)"""
+    username = session.get('username')
+    if not username:
+        return jsonify({"error": "User not authenticated"}), 401
+    
+    task_id = request.args.get('task_id', '')
+    if not task_id:
+        return jsonify({"error": "Missing task_id parameter"}), 400
+    
+    try:
+        task_path, display_path = normalize_task_id(task_id, username)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    from utils.usage_ledger import get_usage_ledger
+    summary = get_usage_ledger().summarize(str(task_path))
+    summary["task_id"] = display_path
+    return jsonify(summary)
+
+
 @app.route('/api/tasks/list', methods=['GET'])
 @login_required
 def list_tasks():
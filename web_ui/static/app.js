@@ -102,6 +102,7 @@ const stopBtn = document.getElementById('stop-btn');
 const messagesContainer = document.getElementById('messages');
 const statusText = document.getElementById('status-text');
 const workspacePath = document.getElementById('workspace-path');
+const usageText = document.getElementById('usage-text');
 
 // File browser elements
 const fileBrowserPath = document.getElementById('file-browser-path');
@@ -1066,6 +1067,35 @@ function updateWorkspacePath() {
     fileBrowserPath.textContent = taskId || 'Please set a path for workspace';
     // 重置浏览路径到根目录
     currentBrowsePath = '';
+    loadUsage();
+}
+
+// 加载任务的 token 用量和费用（状态栏显示）
+async function loadUsage() {
+    const taskId = taskIdInput.value.trim();
+    if (!taskId) {
+        usageText.textContent = '';
+        return;
+    }
+    
+    try {
+        const response = await fetch(`/api/usage?task_id=${encodeURIComponent(taskId)}`, {
+            credentials: 'include'
+        });
+        const data = await response.json();
+        if (data.error || !data.total || !data.total.calls) {
+            usageText.textContent = '';
+            return;
+        }
+        
+        const total = data.total;
+        usageText.textContent = `${total.total_tokens.toLocaleString()} tokens · $${total.cost.toFixed(4)} · ${total.calls} LLM calls`;
+        usageText.title = Object.entries(data.by_purpose)
+            .map(([purpose, usage]) => `${purpose}: ${usage.total_tokens.toLocaleString()} tokens, $${usage.cost.toFixed(4)}`)
+            .join('\n');
+    } catch (error) {
+        console.error('Failed to load usage:', error);
+    }
 }
 
 // 加载文件列表
@@ -1777,6 +1807,8 @@ function handleSSEMessage(data) {
         clearHILState();
         // Refresh file list when task completes
         loadFiles();
+        // Refresh token usage when task completes
+        loadUsage();
     } else {
         // All messages from SSE are agent messages（isUser = false，保存到历史记录）
         addMessage(agent, type, content, false, true);